@@ -2,7 +2,7 @@
 
 print('Lauching CoperniFUS')
 
-import sys, functools, os, json, pathlib, trimesh, scipy, matplotlib, pickle, shelve, pprint, copy, hashlib, time, h5py, napari, base64, threading, warnings, re
+import sys, functools, os, json, pathlib, atexit, trimesh, scipy, matplotlib, pickle, shelve, pprint, copy, hashlib, time, h5py, napari, base64, threading, warnings, re, uuid, ast, itertools, concurrent.futures, weakref
 import PyQt6.QtGui as pyqtg
 import PyQt6.QtCore as pyqtc
 import PyQt6.QtWidgets as pyqtw
@@ -25,22 +25,47 @@ def clean_string(string):
     return clean_string
 
 
+_open_cache_handlers = weakref.WeakSet() # Flushed at exit: pending writes are not lost if a store is never closed
+
+def _flush_open_cache_handlers():
+    for cache_handler in list(_open_cache_handlers):
+        cache_handler.flush()
+
+atexit.register(_flush_open_cache_handlers)
+
+
 class CachedDataHandler:
 
-    def __init__(self, cache_dir_name='.cachedDir', cached_settings_fname=None):
+    _NDARRAY_REF_KEY = '__ndarray__'
+
+    def __init__(self, cache_dir_name='.cachedDir', cached_settings_fname=None, flush_delay=.5, backend='json', array_mmap_threshold=2**16):
+        """ backend: storage format of the settings files, one of _jsonshelve.SHELF_BACKENDS ('json', 'sqlite' or 'journal')
+        array_mmap_threshold: size (in bytes) above which stored numpy arrays are memory-mapped when read """
         self.cache_dir = pathlib.Path.home() / cache_dir_name
+        self.flush_delay = flush_delay
+        self.backend = backend
+        self.array_mmap_threshold = array_mmap_threshold
+        self._shelf_cls = _jsonshelve.SHELF_BACKENDS[backend]
+        self._store = None
+        self._arrays = {} # Resident numpy arrays {attribute_str_id: read-only array}
+        self.profiler = SettingsAccessProfiler(self)
         
         # Make cache dir if it does not exists
         self.cache_dir.mkdir(exist_ok=True)
 
+        # One-shot migration of existing .json settings files
+        if backend != 'json' and not any(self.cache_dir.glob(f'*{self.settings_file_suffix}')):
+            for migrated_fpath in _jsonshelve.migrate_json_shelves(self.cache_dir, backend=backend):
+                print(f'Migrated cached settings to {migrated_fpath}')
+
         successful_loading = False
 
         self.cached_settings_fname = None
         if cached_settings_fname is not None and self.is_cached_filename_existent(cached_settings_fname):
             self.cached_settings_fname = cached_settings_fname
         else:
-            # .json file loading trial
-            db_cached_fpaths = list(self.cache_dir.glob("*.json"))
+            # settings file loading trial
+            db_cached_fpaths = list(self.cache_dir.glob(f'*{self.settings_file_suffix}'))
             db_cached_fpaths = sorted(db_cached_fpaths, key=lambda x: "latest" not in x.stem) # prioritize files ending with latest
             if len(db_cached_fpaths) > 0:
                 self.cached_settings_fname = db_cached_fpaths[0].name
@@ -48,19 +73,28 @@ class CachedDataHandler:
         # Try loading cached_settings_fname
         if not successful_loading and self.cached_settings_fname is not None:
             try:
-                cached_db = _jsonshelve.FlatShelf(self.cached_settings_fpath)
-                with cached_db:
-                    _ = dict(cached_db)
-                cached_db.close()
+                self._store = self._open_store()
                 successful_loading = True
             except Exception as e:
-                print(f'\nFailed to load .json cached settings file\n{db_cached_fpaths[0]}\n{type(e).__name__}: {str(e)}')
+                print(f'\nFailed to load {self.settings_file_suffix} cached settings file\n{self.cached_settings_fpath}\n{type(e).__name__}: {str(e)}')
 
         if not successful_loading: # Creates a new cached database as a default
-            self.cached_settings_fname = 'cached_db.json'
+            self.cached_settings_fname = f'cached_db{self.settings_file_suffix}'
+            self._store = self._open_store()
+
+        _open_cache_handlers.add(self)
 
         print(f'Cached data file located at {self.cached_settings_fpath}')
 
+    def _open_store(self):
+        """ Loads the settings file once, reads and writes are then served from memory """
+        return _jsonshelve.WriteBackShelf(
+            self._shelf_cls(str(self.cached_settings_fpath)),
+            flush_delay=self.flush_delay)
+
+    @property
+    def settings_file_suffix(self):
+        return self._shelf_cls.FILE_SUFFIX
 
     def is_cached_filename_existent(self, cache_fname):
         exists = (self.cache_dir / cache_fname).exists()
@@ -70,6 +104,46 @@ class CachedDataHandler:
     def cached_settings_fpath(self):
         return self.cache_dir / self.cached_settings_fname
 
+    @property
+    def stats(self):
+        """ Read / write / flush counts of the settings store """
+        return dict(self._store.stats)
+
+    def flush(self):
+        """ Write pending settings changes to disk """
+        self._store.flush()
+
+    def close(self):
+        """ Flush pending settings changes and release the settings file """
+        _open_cache_handlers.discard(self)
+        self._store.close()
+
+    @property
+    def settings_version_fpath(self):
+        """ Version stamp bumped by every save of the settings file (by any process) """
+        return pathlib.Path(self._store.version_filename)
+
+    def has_external_changes(self):
+        """ Cheap check for settings saved by another process (eg. a batch planning script) since the last sync """
+        return self._store.has_external_changes()
+
+    def diff_attributes(self, other_cache):
+        """ Sorted ids of the attributes whose stored values differ between this handler and other_cache (missing on either side included) """
+        attributes = self._store.subtree_items('')
+        other_attributes = other_cache._store.subtree_items('')
+        changed_attribute_ids = [
+            attk for attk in attributes.keys() | other_attributes.keys()
+            if attk not in attributes or attk not in other_attributes or attributes[attk] != other_attributes[attk]
+        ]
+        return sorted(changed_attribute_ids)
+
+    def sync(self):
+        """ Load the settings saved by other processes, returns the ids of the changed attributes """
+        changed_attribute_ids = self._store.sync()
+        for attribute_str_id in changed_attribute_ids:
+            self._arrays.pop(attribute_str_id, None)
+        return changed_attribute_ids
+
     def _attribute_str_id(self, attribute_id):
         if isinstance(attribute_id, str):
             attribute_str_id = attribute_id
@@ -77,39 +151,206 @@ class CachedDataHandler:
             attribute_str_id = '.'.join(attribute_id)
         return attribute_str_id
 
-    def set_attr(self, attribute_id, value):
-        attribute_str_id = self._attribute_str_id(attribute_id)
+    # --- numpy arrays side-store ---
 
-        cached_db = _jsonshelve.FlatShelf(self.cached_settings_fpath)
-        with cached_db:
-            cached_db[attribute_str_id] = value
-        cached_db.close()
+    @property
+    def arrays_dir(self):
+        """ Directory of the .npy files holding the arrays of the current settings file """
+        return self.cache_dir / f'{self.cached_settings_fpath.stem}.arrays'
+
+    def _is_array_ref(self, value):
+        return isinstance(value, dict) and self._NDARRAY_REF_KEY in value
+
+    def _remove_array_file(self, value):
+        if self._is_array_ref(value):
+            try:
+                (self.arrays_dir / value[self._NDARRAY_REF_KEY]).unlink()
+            except OSError: # Missing or still memory-mapped (Windows) -> left behind
+                pass
+
+    def _store_array(self, attribute_str_id, array):
+        """ Writes array to its own .npy file and returns the reference stored in the settings file """
+        self.arrays_dir.mkdir(exist_ok=True)
+        # Unique file name: a previous version of the array may still be memory-mapped
+        array_fname = re.sub(r'[^\w.-]', '_', attribute_str_id) + f'.{uuid.uuid4().hex[:8]}.npy'
+        tmp_fpath = self.arrays_dir / f'{array_fname}.tmp'
+        with open(tmp_fpath, 'wb') as f:
+            np.save(f, array, allow_pickle=False)
+        os.replace(tmp_fpath, self.arrays_dir / array_fname)
+
+        array = array.copy()
+        array.flags.writeable = False
+        self._arrays[attribute_str_id] = array
+        return {self._NDARRAY_REF_KEY: array_fname, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+    def _load_array(self, attribute_str_id, array_ref):
+        if attribute_str_id not in self._arrays:
+            array_fpath = self.arrays_dir / array_ref[self._NDARRAY_REF_KEY]
+            nbytes = np.dtype(array_ref['dtype']).itemsize * int(np.prod(array_ref['shape']))
+            mmap_mode = 'r' if nbytes >= self.array_mmap_threshold else None
+            array = np.load(array_fpath, mmap_mode=mmap_mode, allow_pickle=False)
+            array.flags.writeable = False
+            self._arrays[attribute_str_id] = array
+        return self._arrays[attribute_str_id]
+
+    def _decode_value(self, attribute_str_id, value):
+        if self._is_array_ref(value):
+            return self._load_array(attribute_str_id, value) # Read-only, shared -> no copy
+        return _jsonshelve.json_copy(value) # Callers are free to mutate the returned value
+
+    def set_attr(self, attribute_id, value, call_site=None):
+        """ Stores value under attribute_id. numpy arrays are saved losslessly to a .npy side-store
+        Returns the stored value as get_attr would return it (eg. tuples as lists, read-only arrays)
+        call_site: name of the caller (module / armature) recorded by the access profiler """
+        attribute_str_id = self._attribute_str_id(attribute_id)
+        if self.profiler.enabled:
+            st_time = time.perf_counter()
+            stored_value = self._set_attr(attribute_str_id, value)
+            self.profiler.record(attribute_str_id, 'set', time.perf_counter() - st_time, call_site)
+            return stored_value
+        return self._set_attr(attribute_str_id, value)
+
+    def _set_attr(self, attribute_str_id, value):
+        if attribute_str_id in self._store:
+            previous_value = self._store[attribute_str_id]
+            if self._is_array_ref(previous_value):
+                self._arrays.pop(attribute_str_id, None)
+                self._remove_array_file(previous_value)
+        if isinstance(value, np.ndarray):
+            encoded_value = self._store_array(attribute_str_id, value)
+        else:
+            # JSON round trip -> same stored types (eg. tuples as lists) as when reading the file back
+            encoded_value = json.loads(json.dumps(value))
+        self._store[attribute_str_id] = encoded_value
+        return self._decode_value(attribute_str_id, encoded_value)
+
+    def get_attr(self, attribute_id, default_value=None, call_site=None):
+        """ Value of attribute_id, set to default_value if missing. numpy arrays are returned as read-only (possibly memory-mapped) arrays
+        call_site: name of the caller (module / armature) recorded by the access profiler """
+        attribute_str_id = self._attribute_str_id(attribute_id)
+        if self.profiler.enabled:
+            st_time = time.perf_counter()
+            value = self._get_attr(attribute_str_id, default_value)
+            self.profiler.record(attribute_str_id, 'get', time.perf_counter() - st_time, call_site)
+            return value
+        return self._get_attr(attribute_str_id, default_value)
+
+    def _get_attr(self, attribute_str_id, default_value):
+        if attribute_str_id in self._store:
+            return self._decode_value(attribute_str_id, self._store[attribute_str_id])
+        else:
+            self._set_attr(attribute_str_id, default_value)
+            return self._get_attr(attribute_str_id, None) if isinstance(default_value, np.ndarray) else default_value
 
-    def get_attr(self, attribute_id, default_value=None):
+    def peek_attr(self, attribute_id, default_value=None):
+        """ Value of attribute_id, default_value if missing (unlike get_attr, missing attributes are not written) """
         attribute_str_id = self._attribute_str_id(attribute_id)
+        if attribute_str_id in self._store:
+            return self._decode_value(attribute_str_id, self._store[attribute_str_id])
+        return default_value
 
-        cached_db = _jsonshelve.FlatShelf(self.cached_settings_fpath)
-        with cached_db:
-            if attribute_str_id in cached_db:
-                value = cached_db[attribute_str_id]
-            else:
-                cached_db[attribute_str_id] = default_value
-                value = default_value
-        cached_db.close()
-        return value
-            
     def get_attr_unique_childs(self, attribute_prefix):
-        
-        cached_db = _jsonshelve.FlatShelf(self.cached_settings_fpath)
-        with cached_db:
-            attributes_keys = list(cached_db.keys())
-            attkeys_with_prefix = [attk.replace(attribute_prefix, '') for attk in attributes_keys if attk.startswith(attribute_prefix)]
-            attkeys_with_prefix_splitted = [[k for k in attk.split('.') if len(k)>0] for attk in attkeys_with_prefix if len(attk)>0]
-        cached_db.close()
-
-        unique_child_names = np.unique([attk[0] for attk in attkeys_with_prefix_splitted])
+        """ Sorted names of the direct children of attribute_prefix (eg. stl item names of 'mesh_handler') """
+        attribute_str_id = self._attribute_str_id(attribute_prefix)
+        unique_child_names = np.array(self._store.child_names(attribute_str_id), dtype=str)
         return unique_child_names
 
+    def get_attr_subtree(self, attribute_id):
+        """ Values of all the attributes under attribute_id, read in one lookup.
+        Returns a dict keyed by attribute ids relative to attribute_id (eg. {'visible': True, ...} for ['armature', armature_name]) """
+        attribute_str_id = self._attribute_str_id(attribute_id)
+        subtree = self._store.subtree_items(attribute_str_id)
+        prefix_len = len('.'.join(_jsonshelve.KeyTrie.split(attribute_str_id)))
+        return {attk[prefix_len:].lstrip('.'): self._decode_value(attk, value) for attk, value in subtree.items()}
+
+    def delete_attr_subtree(self, attribute_id):
+        """ Delete attribute_id and all the attributes under it. Returns the number of deleted attributes """
+        attribute_str_id = self._attribute_str_id(attribute_id)
+        subtree = self._store.subtree_items(attribute_str_id)
+        self._store.delete_subtree(attribute_str_id)
+        for attk, value in subtree.items():
+            self._arrays.pop(attk, None)
+            self._remove_array_file(value)
+        return len(subtree)
+
+    def export_attr_subtree(self, attribute_id, fpath=None):
+        """ {attribute id: value} of attribute_id and all the attributes under it, optionally saved as a flat JSON settings file (arrays as nested lists) """
+        attribute_str_id = self._attribute_str_id(attribute_id)
+        exported_attributes = {attk: self._decode_value(attk, value) for attk, value in self._store.subtree_items(attribute_str_id).items()}
+        if fpath is not None:
+            _jsonshelve.atomic_write(str(fpath), json.dumps(exported_attributes, indent=4, default=lambda array: array.tolist()))
+        return exported_attributes
+
+
+class SettingsAccessProfiler:
+    """ Records, per settings key, the number of reads / writes, their cumulative latency and the modules or armatures requesting them.
+    Disabled by default, enable it with start() """
+
+    def __init__(self, cache_handler):
+        self.cache_handler = cache_handler
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.key_stats = {} # {attribute_str_id: {'count': {op: n}, 'time': {op: s}, 'call_sites': {call_site: n}}}
+        self._start_store_stats = self.cache_handler.stats if self.cache_handler._store is not None else {}
+        self._start_time = time.perf_counter()
+
+    def start(self):
+        self.reset()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def record(self, attribute_str_id, operation, duration, call_site=None):
+        """ operation: 'get', 'set' or 'cached get' (served by a caching layer above the settings handler) """
+        key_stats = self.key_stats.setdefault(attribute_str_id, {'count': {}, 'time': {}, 'call_sites': {}})
+        key_stats['count'][operation] = key_stats['count'].get(operation, 0) + 1
+        key_stats['time'][operation] = key_stats['time'].get(operation, 0) + duration
+        call_site = str(call_site)
+        key_stats['call_sites'][call_site] = key_stats['call_sites'].get(call_site, 0) + 1
+
+    def summary(self):
+        """ Profiled keys sorted by cumulative latency + settings store reads / writes / flushes during profiling """
+        keys_summary = [
+            {
+                'key': attribute_str_id,
+                'count': sum(key_stats['count'].values()),
+                'time': sum(key_stats['time'].values()),
+                **{f'{op} count': n for op, n in key_stats['count'].items()},
+                'call_sites': dict(sorted(key_stats['call_sites'].items(), key=lambda x: -x[1])),
+            }
+            for attribute_str_id, key_stats in self.key_stats.items()
+        ]
+        store_stats = self.cache_handler.stats
+        return {
+            'duration': time.perf_counter() - self._start_time,
+            'store': {stat: n - self._start_store_stats.get(stat, 0) for stat, n in store_stats.items()},
+            'keys': sorted(keys_summary, key=lambda x: -x['time']),
+        }
+
+    def report(self, top_n=20):
+        """ Human readable summary of the top_n keys by cumulative latency """
+        summary = self.summary()
+        lines = [
+            f"Settings access over {summary['duration']:.1f} s | store " + ', '.join(f'{stat}: {n}' for stat, n in summary['store'].items()),
+            f"{'key':<60} {'count':>8} {'total':>10} {'per call':>10}  call sites",
+        ]
+        for key_summary in summary['keys'][:top_n]:
+            call_sites = ', '.join(f'{site} ({n})' for site, n in list(key_summary['call_sites'].items())[:3])
+            lines.append(
+                f"{key_summary['key'][-60:]:<60} {key_summary['count']:>8} {key_summary['time'] * 1e3:>8.2f}ms "
+                f"{key_summary['time'] / key_summary['count'] * 1e6:>8.1f}us  {call_sites}")
+        return '\n'.join(lines)
+
+    def dump_json(self, fpath):
+        """ Writes the summary to fpath """
+        pathlib.Path(fpath).parent.mkdir(parents=True, exist_ok=True)
+        with open(fpath, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+        return fpath
+
 
 class AffineTransforms:
     """ Collection of affine transform function (Scale, Translate, Rotate)"""
@@ -162,6 +403,82 @@ class AffineTransforms:
         tmat[3, axii] = translation_norm
         return tmat
 
+    # --- Batched transforms -> stacked (N, 4, 4) matrices ---
+
+    def scale_mats(self, scaling_ratios):
+        """ scaling_ratios: (N,) isotropic or (N, 3) per axis ratios """
+        scaling_ratios = np.asarray(scaling_ratios, dtype=float)
+        if scaling_ratios.ndim == 1:
+            scaling_ratios = np.repeat(scaling_ratios[:, None], 3, axis=1)
+        scale_mats = np.zeros((len(scaling_ratios), 4, 4))
+        scale_mats[:, np.arange(3), np.arange(3)] = scaling_ratios
+        scale_mats[:, 3, 3] = 1
+        return scale_mats
+
+    def rot_mats(self, rot_axis='x', thetas=0, angular_units='degrees'):
+        """ thetas: (N,) angles around rot_axis, same conventions as rot_mat """
+        rot_axis=rot_axis.lower(); angular_units=angular_units.lower() # Force args in lowercase
+        thetas = np.atleast_1d(np.asarray(thetas, dtype=float))
+        if angular_units=='degrees':
+            thetas=np.deg2rad(thetas)
+        elif angular_units!='radians':
+            raise Exception('Unknown angular units.  Please use radians or degrees.')
+
+        # (i, j) indices of the cos / sin terms of the (transposed) basic homogenous matrix
+        if rot_axis == 'x':
+            ii, jj = 1, 2
+        elif rot_axis == 'y':
+            ii, jj = 2, 0
+        elif rot_axis == 'z':
+            ii, jj = 0, 1
+        else:
+            raise Exception('Unknown axis of rotation.  Please use x, y, or z.')
+        cos_thetas, sin_thetas = np.cos(thetas), np.sin(thetas)
+        rot_mats = np.repeat(np.eye(4)[None], len(thetas), axis=0)
+        rot_mats[:, ii, ii] = cos_thetas
+        rot_mats[:, jj, jj] = cos_thetas
+        rot_mats[:, ii, jj] = sin_thetas
+        rot_mats[:, jj, ii] = -sin_thetas
+        return rot_mats
+
+    def translat_mats(self, translation_axis='x', translation_norms=1):
+        """ translation_norms: (N,) offsets along translation_axis """
+        axii = 0 if translation_axis=='x' else 1 if translation_axis=='y' else 2 if translation_axis=='z' else None
+        if axii is None:
+            raise ValueError('translation_axis must contain x, y, or z characters')
+        translation_norms = np.atleast_1d(np.asarray(translation_norms, dtype=float))
+        tmats = np.repeat(np.eye(4)[None], len(translation_norms), axis=0)
+        tmats[:, 3, axii] = translation_norms
+        return tmats
+
+    def compose(self, *tmats):
+        """ Chains (4, 4) and / or (N, 4, 4) transforms (row vectors -> first transform applied first), broadcasting over N """
+        composed_tmat = np.eye(4)
+        for tmat in tmats:
+            tmat = np.asarray(tmat)
+            if composed_tmat.ndim == 3 and tmat.shape in ((4, 4), (1, 4, 4)): # (N, 4, 4) @ (4, 4) as a single (4N, 4) @ (4, 4) BLAS product
+                composed_tmat = (composed_tmat.reshape(-1, 4) @ tmat.reshape(4, 4)).reshape(composed_tmat.shape)
+            else:
+                composed_tmat = np.matmul(composed_tmat, tmat)
+        return composed_tmat
+
+    def apply_tmats(self, tmats, points):
+        """ Applies (4, 4) or (N, 4, 4) transforms to (M, 3) points -> (M, 3) or (N, M, 3) transformed points """
+        points = np.asarray(points, dtype=float)
+        homogeneous_points = np.concatenate([points, np.ones((*points.shape[:-1], 1))], axis=-1)
+        return np.einsum('...mi,...ij->...mj', homogeneous_points, tmats)[..., :3]
+
+
+class TransformStrSyntaxError(ValueError):
+    """ Malformed token in a transform str, token and its index in the str are kept as attributes """
+
+    def __init__(self, transform_str, token, token_index, reason):
+        self.transform_str = transform_str
+        self.token = token
+        self.token_index = token_index
+        self.reason = reason
+        super().__init__(f"Invalid transform '{token}' (token {token_index} of '{transform_str}'): {reason}")
+
 
 class AffineTransformsFromStr(AffineTransforms):
 
@@ -176,64 +493,96 @@ class AffineTransformsFromStr(AffineTransforms):
             Sy30 (apply a 30 scaling ratio along y)
     
     Transform operations need to be sepated by a space
+
+    Transform strs are compiled once (parsed into an op list + precomposed matrix) and kept in a bounded LRU cache
     """
 
+    COMPILED_CACHE_SIZE = 256
+
+    def __init__(self):
+        self._compile_transform_str_cached = functools.lru_cache(maxsize=self.COMPILED_CACHE_SIZE)(self._compile_transform_str)
+
+    def parse_transform_token(self, str_tr):
+        """ 'Tx50um' -> ('translation', 'x', 5e-05), raises ValueError if the token is malformed """
+        if str_tr.startswith('R'):
+            if not str_tr.endswith('deg'):
+                raise ValueError('rotation angles are expected in degrees (eg. Rz12deg)')
+            op, axis, str_value = 'rotation', str_tr[1:2], str_tr[2:-3]
+        elif str_tr.startswith('T'):
+            if not str_tr.endswith('m'):
+                raise ValueError('translations are expected in meters (eg. Tx50um)')
+            op, axis, str_value = 'translation', str_tr[1:2], str_tr[2:-1].replace('u', 'µ')
+        elif str_tr.startswith('S'):
+            if str_tr[1:2] in ('x', 'y', 'z'):
+                op, axis, str_value = 'scale', str_tr[1], str_tr[2:]
+            else:
+                op, axis, str_value = 'scale', None, str_tr[1:]
+        else:
+            raise ValueError('unknown transform, expected R (rotation), T (translation) or S (scale)')
+
+        if op != 'scale' and axis not in ('x', 'y', 'z'):
+            raise ValueError(f"unknown axis '{axis}', expected x, y or z")
+        try:
+            value = si_parse(str_value)
+        except Exception:
+            raise ValueError(f"unable to parse value '{str_value}'")
+        return (op, axis, value)
+
+    def transform_op2mat(self, transform_op):
+        op, axis, value = transform_op
+        if op == 'rotation':
+            return self.rot_mat(axis, value)
+        elif op == 'translation':
+            return self.translat_mat(axis, value)
+        elif axis is None: # Isotropic scaling
+            return self.scale_mat(float(value))
+        else:
+            xyz_scale = np.array([1, 1, 1], dtype=float)
+            xyz_scale['xyz'.index(axis)] = value
+            return self.scale_mat(xyz_scale)
+
+    def _compile_transform_str(self, ef_tr_str):
+        transform_ops, syntax_errors = [], []
+        for token_index, str_tr in enumerate(ef_tr_str.split(' ')):
+            if str_tr == '': # Repeated spaces
+                continue
+            try:
+                transform_ops.append(self.parse_transform_token(str_tr))
+            except ValueError as e:
+                syntax_errors.append(TransformStrSyntaxError(ef_tr_str, str_tr, token_index, str(e)))
+        transform_mat = self.compose(*[self.transform_op2mat(transform_op) for transform_op in transform_ops])
+        transform_mat.setflags(write=False) # Shared by every caller of the LRU cache
+        return tuple(transform_ops), transform_mat, tuple(syntax_errors)
+
+    def compile_transform_str(self, ef_tr_str, raise_errors=False):
+        """ Returns (transform ops, precomposed transform matrix) of ef_tr_str, malformed tokens are skipped (or raised as TransformStrSyntaxError) """
+        if ef_tr_str is None:
+            return (), np.eye(4)
+        transform_ops, transform_mat, syntax_errors = self._compile_transform_str_cached(ef_tr_str)
+        if raise_errors and len(syntax_errors) > 0:
+            raise syntax_errors[0]
+        return transform_ops, transform_mat.copy()
+
+    def transform_mat_from_str(self, ef_tr_str, raise_errors=False):
+        """ Single (4, 4) matrix equivalent to the chained transforms of ef_tr_str """
+        return self.compile_transform_str(ef_tr_str, raise_errors=raise_errors)[1]
+
     def str_trans2trans_mat(self, str_trans):
         try:
-            trans_axis = str_trans[1]
-            trans_dist = si_parse(str_trans[2:-1].replace('u', 'µ'))
-            trans_mat = self.translat_mat(trans_axis, trans_dist)
-        except:
+            trans_mat = self.transform_op2mat(self.parse_transform_token(str_trans))
+        except ValueError:
             trans_mat = None
         return trans_mat
 
     def str_rot2rot_mat(self, str_rot):
-        try:
-            rot_axis = str_rot[1]
-            rot_angle = si_parse(str_rot[2:-3])
-            rot_mat = self.rot_mat(rot_axis, rot_angle)
-        except:
-            rot_mat = None
-        return rot_mat
-    
+        return self.str_trans2trans_mat(str_rot)
+
     def str_scale2scale_mat(self, str_scale):
-        try:
-            scale_axis = str_scale[1]
-            if scale_axis in 'xyz':
-                xyz_scale = np.array([1, 1, 1], dtype=float)
-                scaling_ratio = si_parse(str_scale[2:])
-                if scale_axis in 'x':
-                    xyz_scale[0] = scaling_ratio
-                elif scale_axis in 'y':
-                    xyz_scale[1] = scaling_ratio
-                elif scale_axis in 'z':
-                    xyz_scale[2] = scaling_ratio
-                scale_mat = self.scale_mat(xyz_scale)
-            else:
-                scaling_ratio = si_parse(str_scale[1:])
-                scale_mat = self.scale_mat(scaling_ratio)
-        except:
-            scale_mat = None
-        return scale_mat
+        return self.str_trans2trans_mat(str_scale)
 
-    def transform_matrices_from_str(self, ef_tr_str):
-        transform_matrices = []
-        if ef_tr_str is None:
-            return []
-        for str_tr in ef_tr_str.split(' '):
-            if str_tr.startswith('R') and str_tr.endswith('deg'):
-                rot_mat = self.str_rot2rot_mat(str_tr)
-                if rot_mat is not None:
-                    transform_matrices.append(rot_mat)
-            elif str_tr.startswith('T') and str_tr.endswith('m'):
-                trans_mat = self.str_trans2trans_mat(str_tr)
-                if trans_mat is not None:
-                    transform_matrices.append(trans_mat)
-            elif str_tr.startswith('S'):
-                scale_mat = self.str_scale2scale_mat(str_tr)
-                if scale_mat is not None:
-                    transform_matrices.append(scale_mat)
-        return transform_matrices
+    def transform_matrices_from_str(self, ef_tr_str, raise_errors=False):
+        transform_ops, _ = self.compile_transform_str(ef_tr_str, raise_errors=raise_errors)
+        return [self.transform_op2mat(transform_op) for transform_op in transform_ops]
 
 
 af_tr = AffineTransforms()
@@ -262,6 +611,85 @@ def constrain_scaling_along_local_axis(tmat, scale, scaling_axis_index):
     constrained_tmat[:3, 0] = scaled_x_axis
     return constrained_tmat
 
+def half_space_mask(grid_tmat, grid_shape, plane_origin, plane_normal, n_threads=1, chunk_size=16):
+    """
+    Bool mask of the voxels of a grid lying on the plane_normal side of a plane, without materializing voxel coordinates.
+    The plane test (([i, j, k, 1] @ grid_tmat)[:3] - plane_origin) . plane_normal is affine in the (i, j, k) indices
+    and is evaluated by broadcasting 1D per axis terms, over chunks of chunk_size first axis slices (optionally in n_threads threads).
+    Parameters:
+        grid_tmat (np.array): 4x4 voxel indices to coordinates transform matrix (row vectors convention).
+        grid_shape (tuple): (ni, nj, nk) grid shape.
+    Returns:
+        np.array: (ni, nj, nk) bool mask.
+    """
+    grid_tmat = np.asarray(grid_tmat, dtype=float)
+    plane_normal = np.asarray(plane_normal, dtype=float)
+    axes_steps = grid_tmat[:3, :3] @ plane_normal # Plane test increment per voxel index along each axis
+    offset = (grid_tmat[3, :3] - np.asarray(plane_origin, dtype=float)) @ plane_normal
+
+    i_terms = np.arange(grid_shape[0]) * axes_steps[0]
+    jk_terms = (np.arange(grid_shape[1]) * axes_steps[1])[:, None] + (np.arange(grid_shape[2]) * axes_steps[2])[None, :] + offset
+    mask = np.empty(tuple(grid_shape), dtype=bool)
+
+    def fill_chunk(chunk_start):
+        chunk_slice = slice(chunk_start, min(chunk_start + chunk_size, grid_shape[0]))
+        np.greater(i_terms[chunk_slice, None, None] + jk_terms[None], 0, out=mask[chunk_slice])
+
+    chunk_starts = range(0, grid_shape[0], chunk_size)
+    if n_threads > 1: # NumPy releases the GIL on the chunks arithmetic
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(fill_chunk, chunk_starts))
+    else:
+        for chunk_start in chunk_starts:
+            fill_chunk(chunk_start)
+    return mask
+
+# ----- uint8 colormap lookup tables -----
+
+@functools.lru_cache(maxsize=64)
+def _colormap_lut(cmap_name):
+    cmap = plt.get_cmap(cmap_name)
+    if cmap.N != 256:
+        cmap = cmap.resampled(256)
+    lut = cmap(np.arange(256), bytes=True)
+    lut.setflags(write=False)
+    return lut
+
+def colormap_lut(cmap_name, alpha=None):
+    """
+    (256, 4) uint8 RGBA lookup table of a matplotlib colormap, indexed by quantize_to_uint8 outputs.
+    Parameters:
+        alpha: None (colormap alpha), scalar or (256,) alpha values in [0, 255] (eg. an opacity ramp).
+    """
+    lut = _colormap_lut(cmap_name).copy()
+    if alpha is not None:
+        lut[:, 3] = np.clip(np.rint(alpha), 0, 255)
+    return lut
+
+def quantize_to_uint8(volume, vmin=None, vmax=None, out=None, chunk_size=2**22):
+    """
+    Quantizes a scalar volume into uint8 colormap indices (same binning as matplotlib colormaps, NaN -> 0).
+    Processed by chunks of chunk_size elements to avoid full size float64 temporaries (out: optional C-contiguous uint8 array).
+    """
+    volume = np.asarray(volume)
+    vmin = np.nanmin(volume) if vmin is None else vmin
+    vmax = np.nanmax(volume) if vmax is None else vmax
+    scale = 256 / (vmax - vmin) if vmax > vmin else 0
+    if out is None:
+        out = np.empty(volume.shape, dtype=np.uint8)
+    raveled_volume, raveled_out = volume.reshape(-1), out.reshape(-1)
+    for chunk_start in range(0, raveled_volume.size, chunk_size):
+        chunk = raveled_volume[chunk_start:chunk_start + chunk_size].astype(np.float32)
+        chunk -= vmin
+        chunk *= scale
+        np.clip(np.nan_to_num(chunk, copy=False), 0, 255, out=chunk)
+        raveled_out[chunk_start:chunk_start + chunk_size] = chunk # Floor by uint8 casting
+    return out
+
+def apply_colormap_lut(indices, lut, out=None):
+    """ (..., 4) uint8 RGBA volume gathered from a (256, 4) lookup table, out: optional preallocated RGBA volume filled in place """
+    return np.take(lut, indices, axis=0, out=out, mode='clip') # uint8 indices are always in range, 'clip' avoids buffering out
+
 # ----- QT misc classes ------
 
 class AcceptRejectDialog(pyqtw.QDialog):
@@ -285,6 +713,30 @@ class AcceptRejectDialog(pyqtw.QDialog):
 
 # ----- misc helper functions -----
 
+@functools.lru_cache(maxsize=1024)
+def compile_args_expression(expression):
+    """ Compiles an armature args expression (eg. "csts['L1']*2") once.
+    Returns (code object, frozenset of the csts keys read by the expression), keys are None if csts is accessed dynamically (eg. csts[name]) """
+    expression_ast = ast.parse(expression.strip(), mode='eval')
+    csts_keys = set()
+    resolved_csts_nodes = set() # ids of the csts Name nodes read with a constant key
+    for node in ast.walk(expression_ast):
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == 'csts':
+            if isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str):
+                csts_keys.add(node.slice.value)
+                resolved_csts_nodes.add(id(node.value))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Name) \
+                and node.func.value.id == 'csts' and node.func.attr == 'get' \
+                and len(node.args) > 0 and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+            csts_keys.add(node.args[0].value)
+            resolved_csts_nodes.add(id(node.func.value))
+    csts_name_nodes = [node for node in ast.walk(expression_ast) if isinstance(node, ast.Name) and node.id == 'csts']
+    if any(id(node) not in resolved_csts_nodes for node in csts_name_nodes):
+        csts_keys = None
+    else:
+        csts_keys = frozenset(csts_keys)
+    return compile(expression_ast, '<args expression>', 'eval'), csts_keys
+
 def recursive_key_finder(nested_dict, target_key='_is_editable'):
     def recursive_search(d, parent_keys=None):
         if parent_keys is None:
@@ -459,6 +911,8 @@ class GlItemsToggler:
 
 class NamedGLViewWidget(gl.GLViewWidget):
 
+    camera_changed = pyqtc.pyqtSignal() # Emitted after camera moves (eg. atlas level of detail update)
+
     def __init__(self, parent_viewer, **kwargs):
         self.parent_viewer = parent_viewer
         super().__init__(**kwargs)
@@ -486,6 +940,18 @@ class NamedGLViewWidget(gl.GLViewWidget):
         super().addItem(item)
         self.gl_items_toggler.update_list_view()
 
+    def setCameraPosition(self, *args, **kwargs):
+        super().setCameraPosition(*args, **kwargs)
+        self.camera_changed.emit()
+
+    def wheelEvent(self, ev):
+        super().wheelEvent(ev)
+        self.camera_changed.emit()
+
+    def mouseReleaseEvent(self, ev):
+        super().mouseReleaseEvent(ev)
+        self.camera_changed.emit()
+
     def removeItem(self, item):
         super().removeItem(item)
         self.gl_items_toggler.update_list_view()
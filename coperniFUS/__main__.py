@@ -4,9 +4,11 @@ import argparse
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--assets_dir_path', dest='assets_dir_path', type=str, help='Specify the directory from which armature assets (stl mesh files, reference images, etc.) will be loaded. Defaults to coperniFUS/example_assets if no path is provided')
+    parser.add_argument('--settings_backend', dest='settings_backend', type=str, default='json', choices=['json', 'sqlite', 'journal'], help='Storage format of the cached settings files. Existing .json settings are migrated on first use of the sqlite backend, journal reads them as is. Defaults to json')
+    parser.add_argument('--watch_settings', dest='watch_settings_file', action='store_true', help='Apply the cached settings changes saved by other processes (eg. batch planning scripts) to the running viewer')
     args = parser.parse_args()
 
-    coperniFUSviewer(assets_dir_path=args.assets_dir_path)
+    coperniFUSviewer(assets_dir_path=args.assets_dir_path, settings_backend=args.settings_backend, watch_settings_file=args.watch_settings_file)
 
 if __name__ == '__main__':
     sys.exit(main())
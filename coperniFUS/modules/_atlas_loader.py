@@ -0,0 +1,120 @@
+import configparser, os, pathlib, queue, shutil, tarfile, threading, traceback, urllib.request, uuid
+from bg_atlasapi.bg_atlas import BrainGlobeAtlas
+from brainglobe_atlasapi import config as brainglobe_config, descriptors as brainglobe_descriptors
+
+
+class AtlasLoadCanceled(Exception):
+    pass
+
+
+def mirror_url(mirror, fname):
+    """ URL of fname on an atlas mirror: BrainGlobe like remote url base ('.../{}') or local directory """
+    if '{}' in str(mirror):
+        return str(mirror).format(fname)
+    return (pathlib.Path(mirror).resolve() / fname).as_uri()
+
+
+def read_last_versions(mirror):
+    """ {atlas_name: last version} listed by the mirror last_versions.conf """
+    with urllib.request.urlopen(mirror_url(mirror, 'last_versions.conf')) as conf_file:
+        last_versions_conf = configparser.ConfigParser()
+        last_versions_conf.read_string(conf_file.read().decode())
+    return dict(last_versions_conf['atlases'])
+
+
+def download_atlas(atlas_name, version, mirror, brainglobe_dir, report_progress, cancel_event, chunk_size=2**20):
+    """ Downloads and extracts {atlas_name}_v{version}.tar.gz from mirror into brainglobe_dir
+    Archive and extracted files go through temporary paths in brainglobe_dir (canceled downloads leave no partial atlas) """
+    atlas_full_name = f'{atlas_name}_v{version}'
+    brainglobe_dir = pathlib.Path(brainglobe_dir)
+    brainglobe_dir.mkdir(parents=True, exist_ok=True)
+    tmp_archive_fpath = brainglobe_dir / f'.{atlas_full_name}.{uuid.uuid4().hex}.tar.gz'
+    tmp_extract_dir = brainglobe_dir / f'.{atlas_full_name}.{uuid.uuid4().hex}.partial'
+    try:
+        with urllib.request.urlopen(mirror_url(mirror, f'{atlas_full_name}.tar.gz')) as response, open(tmp_archive_fpath, 'wb') as archive_file:
+            archive_size = int(response.headers.get('Content-Length', 0))
+            downloaded_size = 0
+            while chunk := response.read(chunk_size):
+                if cancel_event.is_set():
+                    raise AtlasLoadCanceled(atlas_name)
+                archive_file.write(chunk)
+                downloaded_size += len(chunk)
+                progress_str = f' ({downloaded_size / archive_size:.0%})' if archive_size > 0 else ''
+                report_progress(f'Downloading {atlas_full_name}{progress_str}')
+
+        with tarfile.open(tmp_archive_fpath) as archive:
+            members = archive.getmembers()
+            for ii, member in enumerate(members):
+                if cancel_event.is_set():
+                    raise AtlasLoadCanceled(atlas_name)
+                if hasattr(tarfile, 'data_filter'):
+                    archive.extract(member, tmp_extract_dir, filter='data')
+                else:
+                    archive.extract(member, tmp_extract_dir)
+                report_progress(f'Extracting {atlas_full_name} ({(ii + 1) / len(members):.0%})')
+        for extracted_path in tmp_extract_dir.iterdir(): # Atlas folder ({atlas_name}_v{version})
+            os.replace(extracted_path, brainglobe_dir / extracted_path.name)
+    finally:
+        tmp_archive_fpath.unlink(missing_ok=True)
+        shutil.rmtree(tmp_extract_dir, ignore_errors=True)
+
+
+class AtlasLoader:
+    """ Loads (and downloads) a BrainGlobe atlas on a worker thread
+
+    Worker messages are put in a queue drained by poll() from the Qt thread: ('progress', str), ('loaded', (bg_atlas, prepared)),
+    ('canceled', atlas_name) or ('error', str). prepare_fn(bg_atlas, report_progress, cancel_event) is run by the worker after
+    the atlas is loaded (eg. volumes computation), its return value is sent with the loaded atlas.
+    mirror: BrainGlobe like remote url base or local directory holding {atlas_name}_v{version}.tar.gz archives and last_versions.conf
+    """
+
+    def __init__(self, brainglobe_dir=None, mirror=None):
+        self.brainglobe_dir = pathlib.Path(brainglobe_dir) if brainglobe_dir is not None else brainglobe_config.get_brainglobe_dir()
+        self.mirror = mirror if mirror is not None else brainglobe_descriptors.remote_url_base
+        self.messages = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, atlas_name, download=False, prepare_fn=None):
+        self.thread = threading.Thread(target=self._load, args=(atlas_name, download, prepare_fn), daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """ Worker stops at its next cancellation check (download chunk, extracted file or preparation step) """
+        self.cancel_event.set()
+
+    def poll(self):
+        """ Worker messages received since last call (non blocking) """
+        messages = []
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def _report_progress(self, message):
+        self.messages.put(('progress', message))
+
+    def _load(self, atlas_name, download, prepare_fn):
+        try:
+            if download:
+                self._report_progress(f'Retrieving {atlas_name} version')
+                version = read_last_versions(self.mirror)[atlas_name]
+                download_atlas(atlas_name, version, self.mirror, self.brainglobe_dir, self._report_progress, self.cancel_event)
+
+            self._report_progress(f'Loading {atlas_name}')
+            bg_atlas = BrainGlobeAtlas(atlas_name, brainglobe_dir=self.brainglobe_dir, check_latest=False, print_authors=False)
+            if self.cancel_event.is_set():
+                raise AtlasLoadCanceled(atlas_name)
+
+            prepared = prepare_fn(bg_atlas, self._report_progress, self.cancel_event) if prepare_fn is not None else None
+            self.messages.put(('loaded', (bg_atlas, prepared)))
+        except AtlasLoadCanceled:
+            self.messages.put(('canceled', atlas_name))
+        except Exception as error:
+            traceback.print_exc()
+            self.messages.put(('error', f'{atlas_name} loading failed: {error}'))
@@ -0,0 +1,79 @@
+import os
+import uuid
+import numpy as np
+
+
+def save_npy_atomic(fpath, array, slab_size=32):
+    """ Saves array as .npy through a temporary file (readers never see partially written files)
+    Lazy arrays (eg. dask) are computed and written by slabs of slab_size along the first axis """
+    tmp_fpath = fpath.with_suffix(f'.{uuid.uuid4().hex}.tmp')
+    if isinstance(array, np.ndarray):
+        with open(tmp_fpath, 'wb') as npy_file:
+            np.save(npy_file, array)
+    else:
+        npy_volume = np.lib.format.open_memmap(tmp_fpath, mode='w+', dtype=array.dtype, shape=array.shape)
+        for slab_start in range(0, array.shape[0], slab_size):
+            npy_volume[slab_start:slab_start + slab_size] = np.asarray(array[slab_start:slab_start + slab_size])
+        npy_volume.flush()
+        del npy_volume
+    os.replace(tmp_fpath, fpath)
+
+
+def _block_slabs(volume, slab_size):
+    # Yields (output slice, (n0, 2, n1, 2, n2, 2) blocks) over slabs of the first axis, odd axes are edge padded
+    n_out = (volume.shape[0] + 1) // 2
+    for out_start in range(0, n_out, slab_size):
+        slab = np.asarray(volume[2 * out_start: 2 * (out_start + slab_size)])
+        slab = np.pad(slab, [(0, n_voxels % 2) for n_voxels in slab.shape], mode='edge')
+        blocks = slab.reshape(slab.shape[0] // 2, 2, slab.shape[1] // 2, 2, slab.shape[2] // 2, 2)
+        yield slice(out_start, out_start + blocks.shape[0]), blocks
+
+
+def block_mean_reduce(volume, slab_size=32):
+    """ 2x2x2 block means of a uint8 volume -> (ceil(ni / 2), ceil(nj / 2), ceil(nk / 2)) uint8 volume """
+    reduced_volume = np.empty(tuple((n_voxels + 1) // 2 for n_voxels in volume.shape), dtype=np.uint8)
+    for out_slice, blocks in _block_slabs(volume, slab_size):
+        reduced_volume[out_slice] = (blocks.sum(axis=(1, 3, 5), dtype=np.uint16) + 4) // 8
+    return reduced_volume
+
+
+def select_pyramid_level(voxel_size, pixel_size, n_levels, pixels_per_voxel=1.5, region_shape=None, max_voxels=None):
+    """ Coarsest pyramid level whose voxels span at most pixels_per_voxel screen pixels (pixel_size: world size of a pixel at the focal point)
+    made coarser until the region_shape (level 0 voxels) rendered at this level fits in max_voxels """
+    level = 0
+    while level + 1 < n_levels and voxel_size * 2**(level + 1) <= pixel_size * pixels_per_voxel:
+        level += 1
+    if region_shape is not None and max_voxels is not None:
+        while level + 1 < n_levels and np.prod(np.ceil(np.asarray(region_shape) / 2**level)) > max_voxels:
+            level += 1
+    return level
+
+
+class AtlasPyramid:
+    """ Mipmap pyramid of an atlas volume, level k voxels cover 2**k level 0 voxels along each axis
+
+    Levels are computed once by block reduction of the previous level, saved as .npy files in pyramid_dir and memory-mapped.
+    level0_fn: callable returning the (possibly lazy) level 0 volume (only called when it is not on disk yet)
+    """
+
+    def __init__(self, pyramid_dir, volume_name, level0_fn, reduce_fn, n_levels):
+        self.pyramid_dir = pyramid_dir
+        self.volume_name = volume_name
+        self.level0_fn = level0_fn
+        self.reduce_fn = reduce_fn
+        self.n_levels = n_levels
+        self._levels = {}
+
+    def level_fpath(self, level):
+        return self.pyramid_dir / f'{self.volume_name}_{level}.npy'
+
+    def level(self, level):
+        if level not in self._levels:
+            level_fpath = self.level_fpath(level)
+            if not level_fpath.exists():
+                level_volume = self.level0_fn() if level == 0 else self.reduce_fn(self.level(level - 1))
+                self.pyramid_dir.mkdir(parents=True, exist_ok=True)
+                save_npy_atomic(level_fpath, level_volume)
+                del level_volume
+            self._levels[level] = np.load(level_fpath, mmap_mode='r')
+        return self._levels[level]
@@ -0,0 +1,57 @@
+import os, shutil, uuid
+import numpy as np
+import dask.array as da
+import tifffile
+import zarr
+
+
+class TiffPagesVolume:
+    """ Multi-page tiff volume (one page per first axis index) read by slabs of pages: volume[start:stop] """
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        with tifffile.TiffFile(fpath) as tiff_file:
+            self.shape = tuple(tiff_file.series[0].shape)
+            self.dtype = tiff_file.series[0].dtype
+
+    def __getitem__(self, pages_slice):
+        with tifffile.TiffFile(self.fpath) as tiff_file:
+            pages = tiff_file.series[0].pages
+            return np.stack([pages[ii].asarray() for ii in range(*pages_slice.indices(self.shape[0]))])
+
+
+def lazy_tiff_volume(fpath):
+    """ Tiff volume read by slabs of pages, or fully loaded if its pages are not first axis slices """
+    with tifffile.TiffFile(fpath) as tiff_file:
+        series = tiff_file.series[0]
+        paged_volume = len(series.shape) == 3 and len(series.pages) == series.shape[0]
+    return TiffPagesVolume(fpath) if paged_volume else tifffile.imread(fpath)
+
+
+def convert_to_zarr(volume, zarr_path, chunks):
+    """ Writes volume (numpy, dask or zarr array) to a chunked zarr store, slab by slab along the first axis
+    The store is written to a temporary path then renamed (interrupted conversions leave no partial store) """
+    tmp_zarr_path = zarr_path.with_name(f'.{zarr_path.name}.{uuid.uuid4().hex}.partial')
+    zarr_volume = zarr.open(str(tmp_zarr_path), mode='w', shape=volume.shape, chunks=chunks, dtype=volume.dtype)
+    try:
+        for slab_start in range(0, volume.shape[0], chunks[0]):
+            zarr_volume[slab_start:slab_start + chunks[0]] = np.asarray(volume[slab_start:slab_start + chunks[0]])
+        os.replace(tmp_zarr_path, zarr_path)
+    except OSError: # Store converted meanwhile (eg. by another process)
+        if not zarr_path.exists():
+            raise
+    finally:
+        shutil.rmtree(tmp_zarr_path, ignore_errors=True)
+
+
+def lazy_zarr_volume(zarr_path, volume_fn, chunks):
+    """ dask array backed by the zarr store at zarr_path, converted from volume_fn() on first use """
+    if not zarr_path.exists():
+        zarr_path.parent.mkdir(parents=True, exist_ok=True)
+        convert_to_zarr(volume_fn(), zarr_path, chunks)
+    return da.from_zarr(str(zarr_path))
+
+
+def lazy_volume_range(volume):
+    """ (min, max) of a dask volume, computed in a single pass over its chunks """
+    return da.compute(volume.min(), volume.max())
@@ -5,13 +5,18 @@ objects).
 Project Source: https://github.com/sampsyo/jsonshelve.git
 """
 
-import json, collections, os
-# import sqlite3
+import json, collections.abc, os, threading, tempfile, sqlite3, pathlib, time, random, hashlib
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
 # try:
 #     import cPickle as pickle
 # except ImportError:
 #     import pickle
 
+_DELETED = object() # Marks keys deleted but not yet saved
+
 
 class JSONShelf(collections.abc.MutableMapping):
     # Object lifetime.
@@ -20,10 +25,29 @@ class JSONShelf(collections.abc.MutableMapping):
         """Persist the current in-memory state of the mapping."""
         raise NotImplementedError
 
+    def prepare_save(self):
+        """In-memory part of save(): captures the state to persist and returns
+        it for write_prepared(), which does the disk I/O and may run while the
+        mapping is modified again. Defaults to a full save()."""
+        self.save()
+        return None
+
+    def write_prepared(self, prepared):
+        """Disk part of save(), prepared by prepare_save()."""
+        pass
+
     def close(self):
         """Close any opened resources."""
         pass
 
+    def reload(self):
+        """Re-read the state saved to disk (eg. by another process)."""
+        pass
+
+    def keys_with_prefix(self, prefix):
+        """List the keys starting with prefix."""
+        return [key for key in self if key.startswith(prefix)]
+
     def __del__(self):
         self.close()
 
@@ -56,6 +80,9 @@ class MemoryShelf(JSONShelf):
         """Dump self.data to the file."""
         raise NotImplementedError
 
+    def reload(self):
+        self.load()
+
     # Pass mapping methods on to underlying store.
     def __getitem__(self, key):
         return self.data[key]
@@ -72,13 +99,378 @@ class MemoryShelf(JSONShelf):
 class FlatShelf(MemoryShelf):
     """A shelf backed by a single flat JSON file.
     """
+    FILE_SUFFIX = '.json'
+
     def load(self):
         with open(self.filename) as f:
             self.data = json.load(f)
 
     def save(self):
-        with open(self.filename, 'w') as f:
-            json.dump(self.data, f, indent=4)
+        self.write_prepared(self.prepare_save())
+
+    def prepare_save(self):
+        return dict(self.data) # Values are replaced, not mutated, by writes
+
+    def write_prepared(self, data):
+        atomic_write(self.filename, json.dumps(data, indent=4))
+
+
+class KeyTrie:
+    """Index of dotted keys (``armature.<name>.<param>``) by path segment.
+
+    Listing the children or the keys under a given path costs a walk of that
+    subtree only, instead of a scan of every key.
+    """
+    _KEY_END = None # Marks nodes that are keys themselves (segments are str)
+
+    def __init__(self, keys=()):
+        self.root = {}
+        for key in keys:
+            self.add(key)
+
+    @staticmethod
+    def split(key):
+        return [segment for segment in key.split('.') if len(segment) > 0]
+
+    def _node(self, prefix):
+        node = self.root
+        for segment in self.split(prefix):
+            node = node.get(segment)
+            if node is None:
+                return None
+        return node
+
+    def add(self, key):
+        node = self.root
+        for segment in self.split(key):
+            node = node.setdefault(segment, {})
+        node[self._KEY_END] = True
+
+    def discard(self, key):
+        segments = self.split(key)
+        path = [self.root]
+        for segment in segments:
+            node = path[-1].get(segment)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].pop(self._KEY_END, None)
+        # Prune the branches left empty
+        for segment, parent in zip(reversed(segments), reversed(path[:-1])):
+            if len(parent[segment]) > 0:
+                break
+            del parent[segment]
+
+    def children(self, prefix):
+        """Sorted names of the direct children of prefix."""
+        node = self._node(prefix)
+        if node is None:
+            return []
+        return sorted(segment for segment in node if segment is not self._KEY_END)
+
+    def keys(self, prefix):
+        """Keys of the subtree rooted at prefix (prefix itself included)."""
+        node = self._node(prefix)
+        if node is None:
+            return []
+        keys = []
+        stack = [(self.split(prefix), node)]
+        while stack:
+            segments, node = stack.pop()
+            for segment, child in node.items():
+                if segment is self._KEY_END:
+                    keys.append('.'.join(segments))
+                else:
+                    stack.append((segments + [segment], child))
+        return keys
+
+
+class WriteBackShelf(JSONShelf):
+    """A resident, thread-safe front for another shelf.
+
+    Reads and writes are served by the (already loaded) backing shelf, while
+    persistence to disk is coalesced: the first write after a flush arms a
+    timer and every write made before it fires is saved in a single
+    backend.save() call run on a background thread. Keys are also indexed
+    in a KeyTrie for subtree queries.
+
+    Several processes can share the file: saves are made under a FileLock
+    (``<filename>.lock``) and bump a version stamp (``<filename>.version``)
+    listing the keys they changed. A save first reloads the backing shelf
+    if another process saved since, local writes winning over theirs.
+    """
+    VERSION_LOG_LENGTH = 64 # Saves whose changed keys are kept in the version stamp
+
+    def __init__(self, backend, flush_delay=.5):
+        self.backend = backend
+        self.file_lock = FileLock(backend.filename + '.lock')
+        self.backend.file_lock = self.file_lock
+        self.version_filename = backend.filename + '.version'
+        self.key_index = KeyTrie(backend.keys())
+        self.flush_delay = flush_delay
+        self.stats = {'reads': 0, 'writes': 0, 'flushes': 0}
+        self._lock = threading.RLock()
+        self._flush_timer = None
+        self._dirty_keys = {} # Ordered set of keys written since the last flush
+        self._external_changes = set() # Keys saved by other processes, not yet returned by sync()
+        self._closed = False
+        with self.file_lock:
+            self.version = read_version_stamp(self.version_filename)['version']
+            self._version_stat = _file_stat(self.version_filename)
+
+    def _schedule_flush(self):
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _sync(self):
+        """Reload the backing shelf if another process saved it (file lock held).
+        Returns the keys they changed."""
+        stamp = read_version_stamp(self.version_filename)
+        self._version_stat = _file_stat(self.version_filename)
+        if stamp['version'] == self.version:
+            return set()
+
+        logged_changes = {version: keys for version, keys in stamp['log']}
+        missed_versions = range(self.version + 1, stamp['version'] + 1)
+        changes_logged = all(version in logged_changes for version in missed_versions)
+        changed_keys = set(key for version in missed_versions for key in logged_changes.get(version, []))
+        if not changes_logged: # Too far behind -> any key may have changed
+            changed_keys.update(self.backend.keys())
+
+        pending_values = {key: (self.backend[key] if key in self.backend else _DELETED) for key in self._dirty_keys}
+        self.backend.reload()
+        for key, value in pending_values.items():
+            if value is _DELETED:
+                self.backend.pop(key, None)
+            else:
+                self.backend[key] = value
+        if not changes_logged:
+            changed_keys.update(self.backend.keys())
+
+        self.key_index = KeyTrie(self.backend.keys())
+        self.version = stamp['version']
+        return changed_keys - set(self._dirty_keys)
+
+    def _write_version_stamp(self, changed_keys):
+        """Bump the version stamp (file lock held, after _sync)."""
+        version = self.version + 1
+        log = read_version_stamp(self.version_filename)['log'][-(self.VERSION_LOG_LENGTH - 1):]
+        log.append([version, sorted(changed_keys)])
+        atomic_write(self.version_filename, json.dumps({'version': version, 'log': log}))
+        with self._lock:
+            self.version = version
+            self._version_stat = _file_stat(self.version_filename)
+
+    def flush(self):
+        """Persist pending writes now.
+        The pending state is captured with the mapping locked, the disk I/O is
+        then made without it so that reads and writes are not blocked meanwhile.
+        Locks are always taken in the file lock, then mapping lock order."""
+        with self.file_lock: # Also serializes flushes
+            with self._lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if len(self._dirty_keys) == 0:
+                    return
+                self._external_changes.update(self._sync())
+                prepared = self.backend.prepare_save()
+                flushed_keys, self._dirty_keys = self._dirty_keys, {}
+                self.stats['flushes'] += 1
+            self.backend.write_prepared(prepared)
+            self._write_version_stamp(flushed_keys)
+
+    def has_external_changes(self):
+        """Whether another process saved the file since it was last synced.
+        Costs a stat() call as long as the version stamp is untouched."""
+        with self._lock:
+            if len(self._external_changes) > 0:
+                return True
+            if _file_stat(self.version_filename) == self._version_stat:
+                return False
+            return read_version_stamp(self.version_filename)['version'] != self.version
+
+    def sync(self):
+        """Adopt the changes saved by other processes, pending local writes
+        are kept on top. Returns the sorted list of changed keys."""
+        if _file_stat(self.version_filename) != self._version_stat:
+            with self.file_lock, self._lock:
+                self._external_changes.update(self._sync())
+        with self._lock:
+            changed_keys = sorted(self._external_changes)
+            self._external_changes = set()
+            return changed_keys
+
+    def save(self):
+        self.flush()
+
+    def close(self):
+        with self.file_lock, self._lock:
+            if not self._closed:
+                self.flush()
+                self.backend.close()
+                self.file_lock.close()
+                self._closed = True
+
+    def keys(self):
+        with self._lock:
+            return list(self.backend.keys())
+
+    def keys_with_prefix(self, prefix):
+        with self._lock:
+            return self.backend.keys_with_prefix(prefix)
+
+    def child_names(self, prefix):
+        with self._lock:
+            return self.key_index.children(prefix)
+
+    def subtree_keys(self, prefix):
+        with self._lock:
+            return self.key_index.keys(prefix)
+
+    def subtree_items(self, prefix):
+        """{key: value} of the subtree rooted at prefix, read at once."""
+        with self._lock:
+            self.stats['reads'] += 1
+            return {key: self.backend[key] for key in self.key_index.keys(prefix)}
+
+    def delete_subtree(self, prefix):
+        """Delete the subtree rooted at prefix, returns the deleted keys."""
+        with self._lock:
+            deleted_keys = self.key_index.keys(prefix)
+            for key in deleted_keys:
+                del self[key]
+            return deleted_keys
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.backend
+
+    def __getitem__(self, key):
+        with self._lock:
+            self.stats['reads'] += 1
+            return self.backend[key]
+    def __setitem__(self, key, value):
+        with self._lock:
+            self.stats['writes'] += 1
+            self.backend[key] = value
+            self.key_index.add(key)
+            self._dirty_keys[key] = None
+            self._schedule_flush()
+    def __delitem__(self, key):
+        with self._lock:
+            self.stats['writes'] += 1
+            del self.backend[key]
+            self.key_index.discard(key)
+            self._dirty_keys[key] = None
+            self._schedule_flush()
+    def __iter__(self):
+        return iter(self.keys())
+    def __len__(self):
+        with self._lock:
+            return len(self.backend)
+
+
+class FileLock:
+    """Advisory inter-process lock on a lock file.
+
+    The lock is re-entrant and also serializes the threads of the process
+    (flock / msvcrt locks are held per file descriptor, not per thread).
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                if self._fd is None:
+                    self._fd = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+                if os.name == 'nt':
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    while True:
+                        try:
+                            msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError: # LK_LOCK gives up after 10 attempts
+                            continue
+                else:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            if os.name == 'nt':
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def close(self):
+        with self._thread_lock:
+            if self._fd is not None and self._depth == 0:
+                os.close(self._fd)
+                self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def read_version_stamp(filename):
+    """Content of a version stamp file, {'version': 0, 'log': []} if missing."""
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'version': 0, 'log': []}
+
+
+def _file_stat(filename):
+    try:
+        st = os.stat(filename)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+        return None
+
+
+def atomic_write(filename, text):
+    """Write text to filename through a temporary file so that a crash
+    mid-write never leaves a truncated file behind."""
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(dir=dirname, prefix=os.path.basename(filename) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def json_copy(value):
+    """Fast deep copy of a JSON-like structure (dicts, lists, scalars)."""
+    if isinstance(value, dict):
+        return {k: json_copy(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [json_copy(v) for v in value]
+    return value
 
 
 # class PickleShelf(MemoryShelf):
@@ -93,63 +485,426 @@ class FlatShelf(MemoryShelf):
 #             pickle.dump(self.data, f)
 
 
-# class SQLiteShelf(JSONShelf):
-#     """A shelf backed by an SQLite database.
-#     """
-#     def __init__(self, filename):
-#         self.conn = sqlite3.connect(filename)
-#         self.conn.execute(
-#             "CREATE TABLE IF NOT EXISTS jsonshelve (key TEXT, value TEXT)"
-#         )
+class SQLiteShelf(JSONShelf):
+    """A shelf backed by an SQLite database.
 
-#     def close(self):
-#         self.conn.close()
+    The database runs in WAL mode: reads are indexed single-key lookups,
+    writes are buffered and applied as single-row upserts in one short
+    transaction by save(), so that no write lock is held between saves.
+    """
+    FILE_SUFFIX = '.sqlite'
 
-#     def save(self):
-#         self.conn.commit()
-
-#     def __getitem__(self, key):
-#         c = self.conn.execute(
-#             "SELECT value FROM jsonshelve WHERE key = ? LIMIT 1", (key,)
-#         )
-#         row = c.fetchone()
-#         c.close()
-#         if not row:
-#             raise KeyError()
-#         return json.loads(row[0])
-
-#     def __setitem__(self, key, value):
-#         self.conn.execute(
-#             "INSERT OR REPLACE INTO jsonshelve (key, value) VALUES (?, ?)",
-#             (key, json.dumps(value))
-#         )
-
-#     def __delitem__(self, key):
-#         c = self.conn.execute(
-#             "DELETE FROM jsonshelve WHERE key = ?", (key,)
-#         )
-#         if not c.rowcount:
-#             # No row was deleted.
-#             raise KeyError()
-
-#     def __iter__(self):
-#         c = self.conn.execute("SELECT key FROM jsonshelve")
-
-#         # This is somewhat dangerous: we allow client code to execute
-#         # while the cursor is still open. This means it's possible for
-#         # the client to create "dangling" cursors that lock the database
-#         # indefinitely. For this reason, this iterator should *only* be
-#         # used in a for loop or immediately passed to list() to avoid
-#         # exceptional conditions causing inadvertent locking.
-#         for row in c:
-#             yield row[0]
-#         c.close()
-
-#         # The less-efficient but safer alternative is:
-#         # return iter([r[0] for r in c])
-
-#     def __len__(self):
-#         c = self.conn.execute(
-#             "SELECT COUNT(*) FROM jsonshelve"
-#         )
-#         return c.fetchone()[0]
+    def __init__(self, filename):
+        self.filename = filename
+        self._pending = {} # {key: value or _DELETED} written by the next save()
+        self._saving = {} # Pending values being written by write_prepared(), still served from memory
+        # Connection is shared with WriteBackShelf flush thread (serialized by its lock)
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jsonshelve (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.save()
+            self.conn.close()
+            self.conn = None
+
+    def save(self):
+        self.write_prepared(self.prepare_save())
+
+    def prepare_save(self):
+        self._saving, self._pending = {**self._saving, **self._pending}, {}
+        return self._saving
+
+    def write_prepared(self, saving):
+        with self.conn: # Single transaction
+            self.conn.executemany(
+                "INSERT INTO jsonshelve (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                [(key, json.dumps(value)) for key, value in saving.items() if value is not _DELETED]
+            )
+            self.conn.executemany(
+                "DELETE FROM jsonshelve WHERE key = ?",
+                [(key,) for key, value in saving.items() if value is _DELETED]
+            )
+        if self._saving is saving:
+            self._saving = {}
+
+    def _unsaved(self, key):
+        # Value of key not yet written to the database (_DELETED included), None if it has none
+        for unsaved_values in (self._pending, self._saving):
+            if key in unsaved_values:
+                return (unsaved_values[key],)
+        return None
+
+    def _with_pending(self, keys, prefix=''):
+        keys = set(keys)
+        for key, value in {**self._saving, **self._pending}.items():
+            if value is _DELETED:
+                keys.discard(key)
+            elif key.startswith(prefix):
+                keys.add(key)
+        return sorted(keys)
+
+    def keys_with_prefix(self, prefix):
+        if len(prefix) == 0:
+            return list(self)
+        # Range scan on the primary key index: prefix <= key < next(prefix)
+        upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        c = self.conn.execute(
+            "SELECT key FROM jsonshelve WHERE key >= ? AND key < ?", (prefix, upper_bound)
+        )
+        keys = [row[0] for row in c]
+        c.close()
+        return self._with_pending(keys, prefix)
+
+    def __contains__(self, key):
+        unsaved = self._unsaved(key)
+        if unsaved is not None:
+            return unsaved[0] is not _DELETED
+        c = self.conn.execute(
+            "SELECT 1 FROM jsonshelve WHERE key = ? LIMIT 1", (key,)
+        )
+        row = c.fetchone()
+        c.close()
+        return row is not None
+
+    def __getitem__(self, key):
+        unsaved = self._unsaved(key)
+        if unsaved is not None:
+            if unsaved[0] is _DELETED:
+                raise KeyError(key)
+            return unsaved[0]
+        c = self.conn.execute(
+            "SELECT value FROM jsonshelve WHERE key = ? LIMIT 1", (key,)
+        )
+        row = c.fetchone()
+        c.close()
+        if not row:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self._pending[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._pending[key] = _DELETED
+
+    def __iter__(self):
+        # Keys are fetched at once so that no cursor is left open (and the
+        # database locked) if the client stops iterating early.
+        c = self.conn.execute("SELECT key FROM jsonshelve")
+        keys = [row[0] for row in c]
+        c.close()
+        return iter(self._with_pending(keys))
+
+    def __len__(self):
+        if len(self._pending) > 0 or len(self._saving) > 0:
+            return len(list(self))
+        c = self.conn.execute(
+            "SELECT COUNT(*) FROM jsonshelve"
+        )
+        return c.fetchone()[0]
+
+
+class JournalShelf(MemoryShelf):
+    """A shelf made of a flat JSON snapshot and an append-only journal.
+
+    Every save() appends one JSON line per key modified since the previous
+    save to ``<filename>.journal``, so that the disk cost of a write is the
+    size of its record. The journal is replayed on top of the snapshot when
+    loading and, once it outgrows both the snapshot and compact_threshold
+    bytes, is folded into a fresh snapshot by a background thread. The
+    snapshot is a regular FlatShelf file.
+    """
+    FILE_SUFFIX = '.json'
+    JOURNAL_SUFFIX = '.journal'
+
+    def __init__(self, filename, compact_threshold=2**18):
+        self.journal_filename = filename + self.JOURNAL_SUFFIX
+        self.compact_threshold = compact_threshold
+        self.file_lock = threading.RLock() # Replaced by an inter-process lock by WriteBackShelf
+        self._modified_keys = {} # Ordered set of keys to journal on next save
+        self._journal_lock = threading.RLock()
+        self._journal = None
+        self._journal_size = 0
+        self._snapshot_size = 0
+        self._compactor = None
+        super().__init__(filename)
+
+    @staticmethod
+    def _snapshot_digest(text):
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_filename):
+            return []
+        records = []
+        valid_size = 0
+        with open(self.journal_filename, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError
+                    records.append(json.loads(line))
+                except ValueError:
+                    break # Truncated by a crash mid-append: records after it are not trusted
+                valid_size += len(line)
+        if valid_size < os.path.getsize(self.journal_filename):
+            # Drop the partial record so that new ones are appended after the last valid one
+            with open(self.journal_filename, 'r+b') as f:
+                f.truncate(valid_size)
+        return records
+
+    def _read_files(self):
+        """Returns the data stored on disk (snapshot + journal), the snapshot
+        text and whether the journal applies to this snapshot."""
+        with open(self.filename) as f:
+            snapshot_text = f.read()
+        data = json.loads(snapshot_text)
+
+        records = self._read_journal()
+        digest = self._snapshot_digest(snapshot_text)
+        # Replay the journal only if it was written on top of this snapshot, or if a
+        # compaction to this snapshot was interrupted before the journal was reset
+        # (records hold whole values so replaying already folded ones is harmless).
+        journal_applies = len(records) > 0 and (
+            records[0].get('snapshot') == digest
+            or any(record.get('compacted_to') == digest for record in records)
+        )
+        if journal_applies:
+            for record in records:
+                if 'key' not in record:
+                    continue
+                if record.get('deleted', False):
+                    data.pop(record['key'], None)
+                else:
+                    data[record['key']] = record['value']
+        return data, snapshot_text, journal_applies
+
+    def load(self):
+        with self._journal_lock:
+            self.data, snapshot_text, journal_applies = self._read_files()
+            self._snapshot_size = len(snapshot_text)
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if journal_applies:
+                self._open_journal()
+            else: # Missing, or stale journal (snapshot rewritten by a FlatShelf)
+                self._reset_journal(self._snapshot_digest(snapshot_text))
+
+    def _open_journal(self):
+        self._journal = open(self.journal_filename, 'a')
+        self._journal_size = self._journal.tell()
+
+    def _reset_journal(self, digest):
+        if self._journal is not None:
+            self._journal.close()
+        atomic_write(self.journal_filename, json.dumps({'snapshot': digest}) + '\n')
+        self._open_journal()
+
+    def _append_to_journal(self, text):
+        self._journal.write(text)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal_size += len(text)
+
+    def save(self):
+        self.write_prepared(self.prepare_save())
+
+    def prepare_save(self):
+        """Journal records of the keys modified since the previous save."""
+        with self._journal_lock:
+            if self._journal is None: # New file
+                snapshot_text = json.dumps(self.data, indent=4)
+                atomic_write(self.filename, snapshot_text)
+                self._snapshot_size = len(snapshot_text)
+                self._reset_journal(self._snapshot_digest(snapshot_text))
+                self._modified_keys.clear()
+                return ''
+            records_text = ''
+            for key in self._modified_keys:
+                if key in self.data:
+                    records_text += json.dumps({'key': key, 'value': self.data[key]}) + '\n'
+                else:
+                    records_text += json.dumps({'key': key, 'deleted': True}) + '\n'
+            self._modified_keys.clear()
+            return records_text
+
+    def _reopen_replaced_journal(self):
+        # Journal compacted (replaced) by another process: the opened one is unlinked.
+        # The snapshot folds the journal records -> the loaded data is still current.
+        try:
+            journal_replaced = not os.path.samestat(os.fstat(self._journal.fileno()), os.stat(self.journal_filename))
+        except OSError:
+            journal_replaced = True
+        if journal_replaced:
+            self._journal.close()
+            self._open_journal()
+            self._snapshot_size = os.path.getsize(self.filename)
+
+    def write_prepared(self, records_text):
+        if len(records_text) == 0:
+            return
+        with self.file_lock, self._journal_lock:
+            self._reopen_replaced_journal()
+            self._append_to_journal(records_text)
+            if self._journal_size > max(self.compact_threshold, self._snapshot_size):
+                self.compact(background=True)
+
+    def compact(self, background=False):
+        """Fold the journal into a fresh snapshot."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return # Already compacting
+        if background:
+            self._compactor = threading.Thread(target=self._compact, daemon=True)
+            self._compactor.start()
+        else:
+            self._compact()
+
+    def _compact(self):
+        # The new snapshot is built from the files rather than from self.data: the
+        # journal may hold records appended by other processes sharing the file.
+        with self.file_lock, self._journal_lock:
+            if self._journal is None:
+                return # Closed meanwhile
+            data, _, _ = self._read_files()
+            snapshot_text = json.dumps(data, indent=4)
+            digest = self._snapshot_digest(snapshot_text)
+            self._append_to_journal(json.dumps({'compacted_to': digest}) + '\n')
+            atomic_write(self.filename, snapshot_text)
+            self._reset_journal(digest)
+            self._snapshot_size = len(snapshot_text)
+
+    def close(self):
+        if self._journal is None:
+            return
+        self.save()
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self._modified_keys[key] = None
+    def __delitem__(self, key):
+        del self.data[key]
+        self._modified_keys[key] = None
+
+
+SHELF_BACKENDS = {
+    'json': FlatShelf,
+    'sqlite': SQLiteShelf,
+    'journal': JournalShelf,
+}
+
+
+def migrate_json_shelves(directory, backend='sqlite', overwrite=False):
+    """One-shot conversion of every flat JSON shelf (*.json) of directory to
+    another backend. Existing target files are kept unless overwrite is set.
+    Returns the list of written files."""
+    target_cls = SHELF_BACKENDS[backend]
+    migrated_fpaths = []
+    for json_fpath in sorted(pathlib.Path(directory).glob('*' + FlatShelf.FILE_SUFFIX)):
+        target_fpath = json_fpath.with_suffix(target_cls.FILE_SUFFIX)
+        if target_fpath == json_fpath or (target_fpath.exists() and not overwrite):
+            continue
+        src_shelf = FlatShelf(str(json_fpath))
+        if target_fpath.exists():
+            target_fpath.unlink()
+        target_shelf = target_cls(str(target_fpath))
+        for key, value in src_shelf.data.items():
+            target_shelf[key] = value
+        target_shelf.save()
+        target_shelf.close()
+        migrated_fpaths.append(target_fpath)
+    return migrated_fpaths
+
+
+def benchmark_shelf_backends(directory, n_keys=2000, value_size=200, n_ops=500, seed=0):
+    """Time typical settings access patterns for every backend.
+
+    Keys are dotted ids (``armature.<name>.<param>``) holding ~value_size
+    characters of JSON. Returns {backend: {operation: seconds per operation}}.
+    The 'json (reopen per access)' entry reproduces opening, parsing and
+    rewriting the whole file on each access.
+    """
+    rng = random.Random(seed)
+    keys = [f'armature.arm{ii // 20}.param{ii % 20}' for ii in range(n_keys)]
+    payload = {'args': ['x', 0.0], 'script': 'x' * value_size}
+    read_keys = [rng.choice(keys) for _ in range(n_ops)]
+    prefixes = [f'armature.arm{rng.randrange(n_keys // 20)}' for _ in range(max(n_ops // 10, 1))]
+
+    def time_per_op(func, items):
+        st_time = time.perf_counter()
+        for item in items:
+            func(item)
+        return (time.perf_counter() - st_time) / max(len(items), 1)
+
+    results = {}
+    for backend, shelf_cls in SHELF_BACKENDS.items():
+        fpath = os.path.join(directory, f'benchmark_{backend}{shelf_cls.FILE_SUFFIX}')
+        if os.path.exists(fpath):
+            os.remove(fpath)
+        shelf = shelf_cls(fpath)
+        for key in keys:
+            shelf[key] = payload
+        shelf.save()
+        shelf.close()
+
+        st_time = time.perf_counter()
+        shelf = WriteBackShelf(shelf_cls(fpath), flush_delay=3600)
+        open_time = time.perf_counter() - st_time
+
+        def write_and_flush(key):
+            shelf[key] = payload
+            shelf.flush()
+
+        results[backend] = {
+            'open': open_time,
+            'read': time_per_op(lambda key: shelf[key], read_keys),
+            'write + flush': time_per_op(write_and_flush, read_keys),
+            'prefix scan': time_per_op(shelf.keys_with_prefix, prefixes),
+        }
+        shelf.close()
+
+        if shelf_cls is FlatShelf:
+            def reopen_read(key):
+                reopened_shelf = FlatShelf(fpath)
+                with reopened_shelf:
+                    reopened_shelf[key]
+
+            def reopen_write(key):
+                reopened_shelf = FlatShelf(fpath)
+                with reopened_shelf:
+                    reopened_shelf[key] = payload
+
+            results['json (reopen per access)'] = {
+                'open': open_time,
+                'read': time_per_op(reopen_read, read_keys[:max(n_ops // 10, 1)]),
+                'write + flush': time_per_op(reopen_write, read_keys[:max(n_ops // 10, 1)]),
+                'prefix scan': time_per_op(lambda prefix: FlatShelf(fpath).keys_with_prefix(prefix), prefixes),
+            }
+        for sidecar_suffix in ['', JournalShelf.JOURNAL_SUFFIX, '.lock', '.version']:
+            if os.path.exists(fpath + sidecar_suffix):
+                os.remove(fpath + sidecar_suffix)
+    return results
+
+
+if __name__ == '__main__':
+    # python -m coperniFUS.modules._jsonshelve [n_keys]
+    import sys
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bench_results = benchmark_shelf_backends(tmp_dir, n_keys=int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
+    for backend, timings in bench_results.items():
+        print(f'{backend:>26} | ' + ' | '.join(f'{op}: {t * 1e6:10.1f} us' for op, t in timings.items()))
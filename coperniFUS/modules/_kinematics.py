@@ -0,0 +1,230 @@
+import ast
+import numpy as np
+
+
+class KinematicTree:
+    """ Forward kinematics graph of the stereotaxic frame joints.
+
+    Each node holds a local (4, 4) transform matrix (row vectors convention) and caches its compound matrix
+    (local @ parent compound). Editing a node only marks its subtree dirty, compound matrices are recomputed
+    lazily on read, walking up to the closest up-to-date ancestor.
+
+    Local matrices are fetched from a per-node callable, called again only once the node has been invalidated.
+    Invariant: the descendants of a dirty node are dirty.
+    """
+
+    def __init__(self):
+        self._parents = {} # {node_id: parent_node_id or None}
+        self._children = {} # {node_id: [child_node_id, ...]}
+        self._local_tmat_fns = {} # {node_id: callable returning the node local transform matrix}
+        self._local_tmats = {}
+        self._compound_tmats = {}
+        self._compound_versions = {} # {node_id: value of n_recomputed when the compound matrix last changed}
+        self._dirty = set() # Nodes whose compound matrix needs to be recomputed
+        self._stale_locals = set() # Nodes whose local matrix needs to be fetched again
+        self.n_recomputed = 0 # Compound matrices recomputed since creation
+
+    def __contains__(self, node_id):
+        return node_id in self._parents
+
+    def node_ids(self):
+        return list(self._parents.keys())
+
+    def parent_id(self, node_id):
+        return self._parents[node_id]
+
+    def children_ids(self, node_id):
+        return list(self._children[node_id])
+
+    def add_node(self, node_id, parent_id=None, local_tmat_fn=None):
+        """ local_tmat_fn: callable returning the local transform matrix of the node (identity if None) """
+        if node_id in self:
+            raise KeyError(f'{node_id} already in kinematic tree')
+        self._parents[node_id] = None
+        self._children[node_id] = []
+        self._local_tmat_fns[node_id] = local_tmat_fn
+        self.invalidate(node_id)
+        self.set_parent(node_id, parent_id)
+
+    def remove_node(self, node_id):
+        """ Children of the removed node become roots """
+        for child_id in self.children_ids(node_id):
+            self.set_parent(child_id, None)
+        self.set_parent(node_id, None)
+        for node_dict in (self._parents, self._children, self._local_tmat_fns, self._local_tmats, self._compound_tmats, self._compound_versions):
+            node_dict.pop(node_id, None)
+        self._dirty.discard(node_id)
+        self._stale_locals.discard(node_id)
+
+    def set_parent(self, node_id, parent_id):
+        if self._parents[node_id] == parent_id:
+            return
+        if parent_id is not None:
+            if parent_id not in self:
+                raise KeyError(f'{parent_id} not in kinematic tree')
+            ancestor_id = parent_id
+            while ancestor_id is not None: # Reject cycles
+                if ancestor_id == node_id:
+                    raise ValueError(f'{parent_id} is a descendant of {node_id}')
+                ancestor_id = self._parents[ancestor_id]
+        if self._parents[node_id] is not None:
+            self._children[self._parents[node_id]].remove(node_id)
+        self._parents[node_id] = parent_id
+        if parent_id is not None:
+            self._children[parent_id].append(node_id)
+        self.mark_dirty(node_id)
+
+    def invalidate(self, node_id):
+        """ The local matrix of node_id changed -> fetched again on next read, its subtree is marked dirty """
+        self._stale_locals.add(node_id)
+        self.mark_dirty(node_id)
+
+    def mark_dirty(self, node_id):
+        nodes_to_visit = [node_id]
+        while len(nodes_to_visit) > 0:
+            visited_node_id = nodes_to_visit.pop()
+            if visited_node_id in self._dirty: # Subtree already dirty
+                continue
+            self._dirty.add(visited_node_id)
+            nodes_to_visit.extend(self._children[visited_node_id])
+
+    def is_dirty(self, node_id):
+        return node_id in self._dirty
+
+    def local_tmat(self, node_id):
+        if node_id in self._stale_locals:
+            local_tmat_fn = self._local_tmat_fns[node_id]
+            self._local_tmats[node_id] = np.eye(4) if local_tmat_fn is None else local_tmat_fn()
+            self._stale_locals.discard(node_id)
+        return self._local_tmats[node_id]
+
+    def compound_tmat(self, node_id):
+        """ Transform matrix of node_id in the frame coordinates (read-only array) """
+        if node_id not in self._dirty:
+            return self._compound_tmats[node_id]
+
+        # Walk up to the closest up-to-date ancestor
+        dirty_path = []
+        path_node_id = node_id
+        while path_node_id is not None and path_node_id in self._dirty:
+            dirty_path.append(path_node_id)
+            path_node_id = self._parents[path_node_id]
+        parent_tmat = np.eye(4) if path_node_id is None else self._compound_tmats[path_node_id]
+
+        # Recompute down to node_id
+        for path_node_id in reversed(dirty_path):
+            parent_tmat = self.local_tmat(path_node_id) @ parent_tmat
+            parent_tmat.setflags(write=False)
+            self.n_recomputed += 1
+            if path_node_id not in self._compound_tmats or not np.array_equal(parent_tmat, self._compound_tmats[path_node_id]):
+                self._compound_versions[path_node_id] = self.n_recomputed
+            self._compound_tmats[path_node_id] = parent_tmat
+            self._dirty.discard(path_node_id)
+        return parent_tmat
+
+    def compound_version(self, node_id):
+        """ Monotonic version of the compound matrix of node_id, changes only when its value changes """
+        self.compound_tmat(node_id)
+        return self._compound_versions[node_id]
+
+
+def damped_least_squares_steps(jacobians, errors, damping=1e-3):
+    """ Batched damped least-squares (Levenberg-Marquardt) steps for inverse kinematics
+    jacobians: (M, R, P) residuals derivatives with respect to the P params, errors: (M, R) residuals
+    returns (M, P) steps dx minimizing |J dx + e|² + damping * trace(JᵀJ) / P * |dx|² (damping relative to the Jacobian scale) """
+    jacobians_t = np.swapaxes(jacobians, -1, -2)
+    normal_mats = jacobians_t @ jacobians
+    n_params = normal_mats.shape[-1]
+    damping_terms = damping * np.trace(normal_mats, axis1=-2, axis2=-1) / n_params + np.finfo(float).tiny
+    normal_mats = normal_mats + damping_terms[..., None, None] * np.eye(n_params)
+    return -np.linalg.solve(normal_mats, jacobians_t @ errors[..., None])[..., 0]
+
+
+class ReachabilityMap:
+    """ Voxel grid of the positions reached by an armature end, with the joint params values reaching each voxel
+
+    Voxel indices (i, j, k) are mapped to the frame coordinates by grid_tmat (row vectors convention, eg. atlas brain_atlas_tmat)
+    For each reached voxel, the params values of the sampled configuration closest to the voxel center are kept.
+    """
+
+    def __init__(self, grid_tmat, grid_shape, params):
+        self.grid_tmat = np.asarray(grid_tmat, dtype=float)
+        self._inv_grid_tmat = np.linalg.inv(self.grid_tmat)
+        self.grid_shape = tuple(int(n_voxels) for n_voxels in grid_shape)
+        self.params = list(params)
+        self.reachable = np.zeros(self.grid_shape, dtype=bool)
+        self.params_values = np.full(self.grid_shape + (len(self.params),), np.nan, dtype=np.float32)
+        self.voxel_distances = np.full(self.grid_shape, np.inf, dtype=np.float32) # Distance (in voxels) of the kept configuration to the voxel center
+
+    @staticmethod
+    def box_grid_tmat(box_min, voxel_size):
+        """ grid_tmat of a box grid starting at box_min (3,) with cubic voxels """
+        grid_tmat = np.eye(4)
+        grid_tmat[np.arange(3), np.arange(3)] = voxel_size
+        grid_tmat[3, :3] = box_min
+        return grid_tmat
+
+    def voxel_coords(self, positions):
+        """ (N, 3) frame positions -> (N, 3) continuous voxel coordinates """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        return np.concatenate([positions, np.ones((len(positions), 1))], axis=-1) @ self._inv_grid_tmat[:, :3]
+
+    def _flat_voxel_indices(self, positions):
+        # (N, 3) positions -> (N,) flat voxel indices (-1 outside of the grid), (N,) distances to the voxel centers
+        voxel_coords = self.voxel_coords(positions)
+        voxel_indices = np.rint(voxel_coords).astype(int)
+        in_grid = np.all((voxel_indices >= 0) & (voxel_indices < self.grid_shape), axis=-1)
+        flat_indices = np.full(len(voxel_indices), -1)
+        flat_indices[in_grid] = np.ravel_multi_index(voxel_indices[in_grid].T, self.grid_shape)
+        return flat_indices, np.linalg.norm(voxel_coords - voxel_indices, axis=-1)
+
+    def add_configurations(self, positions, params_values):
+        """ Marks the voxels of (N, 3) end positions as reachable, params_values: (N, P) params values of the configurations """
+        flat_indices, voxel_distances = self._flat_voxel_indices(positions)
+        params_values = np.asarray(params_values).reshape(len(flat_indices), len(self.params))
+        in_grid = np.flatnonzero(flat_indices >= 0)
+
+        # Closest configuration to each voxel center
+        in_grid = in_grid[np.lexsort((voxel_distances[in_grid], flat_indices[in_grid]))]
+        sorted_flat_indices = flat_indices[in_grid]
+        closest = in_grid[np.r_[True, sorted_flat_indices[1:] != sorted_flat_indices[:-1]]]
+        closest = closest[voxel_distances[closest] < self.voxel_distances.ravel()[flat_indices[closest]]]
+
+        voxel_indices = np.unravel_index(flat_indices[closest], self.grid_shape)
+        self.reachable[voxel_indices] = True
+        self.params_values[voxel_indices] = params_values[closest]
+        self.voxel_distances[voxel_indices] = voxel_distances[closest]
+
+    def lookup(self, positions):
+        """ (N, 3) frame positions -> (N,) reachability, (N, P) params values reaching their voxel (NaN if unreachable) """
+        flat_indices, _ = self._flat_voxel_indices(positions)
+        in_grid = flat_indices >= 0
+        reachable = np.zeros(len(flat_indices), dtype=bool)
+        reachable[in_grid] = self.reachable.ravel()[flat_indices[in_grid]]
+        params_values = np.full((len(flat_indices), len(self.params)), np.nan)
+        params_values[in_grid] = self.params_values.reshape(-1, len(self.params))[flat_indices[in_grid]]
+        return reachable, params_values
+
+    @property
+    def reachable_positions(self):
+        """ (N, 3) frame positions of the reachable voxels centers """
+        voxel_indices = np.argwhere(self.reachable)
+        return np.concatenate([voxel_indices, np.ones((len(voxel_indices), 1))], axis=-1) @ self.grid_tmat[:, :3]
+
+    def save(self, fpath):
+        np.savez_compressed(
+            fpath,
+            grid_tmat=self.grid_tmat,
+            params=np.array([repr(param) for param in self.params]),
+            reachable=self.reachable,
+            params_values=self.params_values,
+            voxel_distances=self.voxel_distances)
+
+    @classmethod
+    def load(cls, fpath):
+        with np.load(fpath) as npz_file:
+            reachability_map = cls(npz_file['grid_tmat'], npz_file['reachable'].shape, [ast.literal_eval(str(param)) for param in npz_file['params']])
+            reachability_map.reachable = npz_file['reachable']
+            reachability_map.params_values = npz_file['params_values']
+            reachability_map.voxel_distances = npz_file['voxel_distances']
+        return reachability_map
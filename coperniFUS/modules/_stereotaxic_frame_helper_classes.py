@@ -252,7 +252,7 @@ class ArmatureParamsEditorWidget:
         gui_elems['_value_editor'][1].setText(si_format(new_value, format_str='{value} {prefix}'+unit))
         self.armature_object._update_armature_dict_value(nested_keys, new_value)
 
-        self.parent_viewer.update_rendered_view()
+        self.parent_viewer.update_armatures_rendered_view()
 
     def value_edited(self, param_gui_order_ii):
         gui_elems = self.armature_params_editor_gui_elements_dict[param_gui_order_ii]
@@ -271,7 +271,7 @@ class ArmatureParamsEditorWidget:
         gui_elems['_value_editor'][1].setText(si_format(new_value, format_str='{value} {prefix}'+unit))
         self.armature_object._update_armature_dict_value(nested_keys, new_value)
 
-        self.parent_viewer.update_rendered_view()
+        self.parent_viewer.update_armatures_rendered_view()
 
     @property
     def armature_params_editor_gui_elements_dict(self):
@@ -0,0 +1,133 @@
+import numpy as np
+
+
+class StructureVoxelIndex:
+    """ Sparse voxel index of the atlas annotation structures
+
+    Voxels of each annotation label are stored as runs along the last atlas axis: (i, j, k_start, k_stop, hemisphere),
+    runs are split at hemisphere changes. Structure voxels (flat indices) and masks are rasterized from the runs of the
+    structure labels (eg. a structure and its descendants) at a cost proportional to the structure size.
+    """
+
+    def __init__(self, atlas_shape, labels, label_offsets, runs, run_hemispheres, bboxes):
+        self.atlas_shape = tuple(int(n_voxels) for n_voxels in atlas_shape)
+        self.labels = labels # (L,) sorted annotation labels
+        self.label_offsets = label_offsets # (L + 1,) runs of labels[ii] are runs[label_offsets[ii]:label_offsets[ii + 1]]
+        self.runs = runs # (R, 4) int32 (i, j, k_start, k_stop)
+        self.run_hemispheres = run_hemispheres # (R,) uint8
+        self.bboxes = bboxes # (L, 2, 3) first / last voxel indices of each label
+
+    @classmethod
+    def from_annotation(cls, annotation, hemispheres, slab_size=16):
+        """ Builds the index from the (memory-mapped) annotation and hemispheres volumes, processed by slabs of the first axis """
+        n_i, n_j, n_k = annotation.shape
+        slabs_runs, slabs_labels, slabs_hemispheres = [], [], []
+        for i_start in range(0, n_i, slab_size):
+            slab_labels = np.asarray(annotation[i_start:i_start + slab_size]).reshape(-1, n_k)
+            slab_hemispheres = np.asarray(hemispheres[i_start:i_start + slab_size]).reshape(-1, n_k)
+            run_starts = np.ones(slab_labels.shape, dtype=bool)
+            run_starts[:, 1:] = (slab_labels[:, 1:] != slab_labels[:, :-1]) | (slab_hemispheres[:, 1:] != slab_hemispheres[:, :-1])
+            rows, k_starts = np.nonzero(run_starts)
+            k_stops = np.full(len(k_starts), n_k)
+            same_row = rows[1:] == rows[:-1]
+            k_stops[:-1][same_row] = k_starts[1:][same_row]
+
+            run_labels = slab_labels[rows, k_starts]
+            in_structure = run_labels != 0 # Background
+            slabs_runs.append(np.stack([i_start + rows // n_j, rows % n_j, k_starts, k_stops], axis=-1)[in_structure].astype(np.int32))
+            slabs_labels.append(run_labels[in_structure])
+            slabs_hemispheres.append(slab_hemispheres[rows, k_starts][in_structure].astype(np.uint8))
+
+        run_labels = np.concatenate(slabs_labels)
+        sorting = np.argsort(run_labels, kind='stable')
+        run_labels, runs, run_hemispheres = run_labels[sorting], np.concatenate(slabs_runs)[sorting], np.concatenate(slabs_hemispheres)[sorting]
+        labels, label_starts = np.unique(run_labels, return_index=True)
+        label_offsets = np.append(label_starts, len(run_labels))
+
+        bboxes = np.empty((len(labels), 2, 3), dtype=np.int32)
+        if len(labels) > 0:
+            bboxes[:, 0] = np.minimum.reduceat(runs[:, :3], label_starts, axis=0)
+            bboxes[:, 1] = np.maximum.reduceat(runs[:, [0, 1, 3]] - [0, 0, 1], label_starts, axis=0)
+        return cls(annotation.shape, labels, label_offsets, runs, run_hemispheres, bboxes)
+
+    def _label_indices(self, structure_ids):
+        # Indices in self.labels of the structure_ids present in the annotation
+        structure_ids = np.unique(np.asarray(structure_ids, dtype=self.labels.dtype))
+        label_indices = np.clip(np.searchsorted(self.labels, structure_ids), 0, max(len(self.labels) - 1, 0))
+        return label_indices[self.labels[label_indices] == structure_ids] if len(self.labels) > 0 else label_indices[:0]
+
+    def structure_runs(self, structure_ids, hemisphere=None):
+        """ (R, 4) (i, j, k_start, k_stop) runs of structure_ids voxels (restricted to hemisphere if not None) """
+        label_indices = self._label_indices(structure_ids)
+        runs_slices = [slice(self.label_offsets[ii], self.label_offsets[ii + 1]) for ii in label_indices]
+        runs = np.concatenate([self.runs[run_slice] for run_slice in runs_slices] + [np.empty((0, 4), dtype=np.int32)])
+        if hemisphere is not None:
+            run_hemispheres = np.concatenate([self.run_hemispheres[run_slice] for run_slice in runs_slices] + [np.empty(0, dtype=np.uint8)])
+            runs = runs[run_hemispheres == hemisphere]
+        return runs
+
+    def structure_bbox(self, structure_ids):
+        """ (2, 3) first / last voxel indices of structure_ids, None if absent from the annotation """
+        label_indices = self._label_indices(structure_ids)
+        if len(label_indices) == 0:
+            return None
+        return np.array([self.bboxes[label_indices, 0].min(axis=0), self.bboxes[label_indices, 1].max(axis=0)])
+
+    @staticmethod
+    def _runs_voxels(rows, k_starts, k_stops, shape):
+        # Flat indices (in a volume of shape) of the voxels [k_start, k_stop) of each (i, j) row
+        non_empty = k_stops > k_starts
+        rows, k_starts, run_lengths = rows[non_empty], k_starts[non_empty], (k_stops - k_starts)[non_empty]
+        if len(run_lengths) == 0:
+            return np.empty(0, dtype=np.intp)
+        run_first_voxels = np.ravel_multi_index((rows[:, 0], rows[:, 1], k_starts), shape)
+        run_offsets = np.cumsum(run_lengths) - run_lengths
+        return np.repeat(run_first_voxels - run_offsets, run_lengths) + np.arange(run_lengths.sum())
+
+    @staticmethod
+    def _voxels_mask(voxels, shape):
+        mask = np.zeros(shape, dtype=bool)
+        mask.ravel()[voxels] = True
+        return mask
+
+    def subsampled_shape(self, stride):
+        return tuple(-(-n_voxels // stride) for n_voxels in self.atlas_shape)
+
+    def subsampled_voxels(self, structure_ids, stride=1, hemisphere=None):
+        """ Flat indices of the structure_ids voxels in the atlas subsampled as [::stride, ::stride, ::stride] """
+        runs = self.structure_runs(structure_ids, hemisphere=hemisphere)
+        runs = runs[np.all(runs[:, :2] % stride == 0, axis=-1)]
+        return self._runs_voxels(runs[:, :2] // stride, -(-runs[:, 2] // stride), -(-runs[:, 3] // stride), self.subsampled_shape(stride))
+
+    def subsampled_mask(self, structure_ids, stride=1, hemisphere=None):
+        return self._voxels_mask(self.subsampled_voxels(structure_ids, stride=stride, hemisphere=hemisphere), self.subsampled_shape(stride))
+
+    def block_voxels(self, structure_ids, level, crop_start, crop_stop, hemisphere=None):
+        """ Flat indices of the level voxels (2**level atlas voxels blocks) holding structure_ids voxels, in the [crop_start, crop_stop) level voxels crop """
+        crop_start, crop_stop = np.asarray(crop_start), np.asarray(crop_stop)
+        runs = self.structure_runs(structure_ids, hemisphere=hemisphere)
+        runs = np.column_stack([runs[:, :3] >> level, ((runs[:, 3] - 1) >> level) + 1]) # Blocks overlapped by the runs
+        in_crop = np.all((runs[:, :2] >= crop_start[:2]) & (runs[:, :2] < crop_stop[:2]), axis=-1)
+        runs = runs[in_crop] - np.r_[crop_start, crop_start[2]]
+        return self._runs_voxels(
+            runs[:, :2], np.maximum(runs[:, 2], 0), np.minimum(runs[:, 3], crop_stop[2] - crop_start[2]),
+            tuple(crop_stop - crop_start))
+
+    def block_mask(self, structure_ids, level, crop_start, crop_stop, hemisphere=None):
+        block_voxels = self.block_voxels(structure_ids, level, crop_start, crop_stop, hemisphere=hemisphere)
+        return self._voxels_mask(block_voxels, tuple(np.asarray(crop_stop) - np.asarray(crop_start)))
+
+    def save(self, fpath):
+        np.savez(
+            fpath,
+            atlas_shape=np.array(self.atlas_shape),
+            labels=self.labels,
+            label_offsets=self.label_offsets,
+            runs=self.runs,
+            run_hemispheres=self.run_hemispheres,
+            bboxes=self.bboxes)
+
+    @classmethod
+    def load(cls, fpath):
+        with np.load(fpath) as npz_file:
+            return cls(**{key: npz_file[key] for key in npz_file.files})
@@ -24,6 +24,7 @@ class AnatLandmarksCalib(Module):
             'Calibrated': 'cal_anatomical_landmarks_coords',
         }
         self._landmarks_calib_tmat = None
+        self.landmarks_calib_tmat_version = 0 # Incremented when the calibration matrix is applied / disabled
         self._landmarks_gl_items = {}
 
     # --- Required module attributes ---
@@ -94,6 +95,14 @@ class AnatLandmarksCalib(Module):
             self.get_user_param('cal_anatomical_landmarks_coords'),
             landmark_name_prefix='Calibrated')
         
+    def on_cached_params_changed(self, param_ids):
+        # Landmarks may have been added or renamed -> rebuild gl items
+        self.delete_rendered_object()
+        self.add_rendered_object()
+        self.landmark_selector.clear()
+        self.update_landmark_selector_elements()
+        self.update_calib_tmat_btn_status()
+
     # --- Module specific attributes ---
         
     @property
@@ -187,6 +196,7 @@ class AnatLandmarksCalib(Module):
 
         landmarks_hash = self._get_anat_landmarks_dicts_hash()
         self._landmarks_calib_tmat = (calibration_tmat, landmarks_hash) # tmat + hash for version tracking
+        self.landmarks_calib_tmat_version += 1
         self.parent_viewer.update_rendered_view()
         self.update_calib_tmat_btn_status()
 
@@ -201,6 +211,7 @@ class AnatLandmarksCalib(Module):
     def disable_calibration_tmat(self):
         landmarks_hash = None
         self._landmarks_calib_tmat = (np.eye(4), landmarks_hash) # tmat + hash for version tracking
+        self.landmarks_calib_tmat_version += 1
         self.parent_viewer.update_rendered_view()
         self.update_calib_tmat_btn_status()
 
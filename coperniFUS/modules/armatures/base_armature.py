@@ -1,5 +1,6 @@
 from coperniFUS import *
 from coperniFUS.modules.stereotaxic_frame import *
+from coperniFUS.modules import _jsonshelve
 
 class Armature:
 
@@ -82,17 +83,24 @@ class Armature:
         self.armature_name = clean_string(armature_display_name)
         self.stereotax_frame_instance = stereotax_frame_instance
         self.armature_display_name = armature_display_name
-        self.highlighted_in_render = False
-        self.current_render_hash = None
+        self._highlighted_in_render = False
+        self.current_render_versions = None # Dependency versions of the current render
+        # Monotonic versions of the render inputs
+        self._visible_version = 0
+        self._config_version = 0
+        self._csts_version = 0
+        self._params_version = 0 # Cached params changed from outside of the armature
+        self._highlight_version = 0
         self.gl_object = None
+        self._armature_user_params = None # (cache, {param_name: value}) hydrated from the cached settings
 
         # # Reset aramatures configuration dicts with default ones
         # self.armature_config_csts = self._DEFAULT_PARAMS['armature_config_csts']
         # self.uneval_armature_config_dict = self._DEFAULT_PARAMS['uneval_armature_config_dict']
         self.tooltip_on_armature = False
-        self.parent_transform_mat = None
-        self._end_transform_mat = None
         self._armature_config_dict = None # armature_config_dict dictionary with evaluated args expressions
+        self._kinematic_joint_ids = None # Joints registered in the stereotaxic frame kinematic tree
+        self._kinematics_uptodate = False
 
         self.params_editor_widget = ArmatureParamsEditorWidget(
             parent_viewer=self.parent_viewer,
@@ -101,23 +109,52 @@ class Armature:
 
     # --- Armature specific cache wrapper ---
 
+    @property
+    def armature_user_params(self):
+        """ All the cached params of the armature, hydrated in a single subtree read """
+        if self._armature_user_params is None or self._armature_user_params[0] is not self.parent_viewer.cache:
+            self._armature_user_params = (
+                self.parent_viewer.cache,
+                self.parent_viewer.cache.get_attr_subtree(['armature', self.armature_name])
+            )
+        return self._armature_user_params[1]
+
     def get_armature_user_param(self, param_name, default_value=None):
         """ Armature specific cache wrapper """
+        profiler = self.parent_viewer.cache.profiler
+        if param_name in self.armature_user_params:
+            if profiler.enabled:
+                st_time = time.perf_counter()
+                param_value = _jsonshelve.json_copy(self.armature_user_params[param_name])
+                profiler.record(f'armature.{self.armature_name}.{param_name}', 'cached get', time.perf_counter() - st_time, self.armature_display_name)
+                return param_value
+            return _jsonshelve.json_copy(self.armature_user_params[param_name])
         if default_value is None and param_name in self._DEFAULT_PARAMS:
             default_value = self._DEFAULT_PARAMS[param_name]
         param_value = self.parent_viewer.cache.get_attr(
             ['armature', self.armature_name, param_name],
-            default_value = default_value
+            default_value = default_value,
+            call_site = self.armature_display_name
         )
+        self.armature_user_params[param_name] = _jsonshelve.json_copy(param_value)
         return param_value
 
     def set_armature_user_param(self, param_name, param_value):
         """ Armature specific cache wrapper """
-        self.parent_viewer.cache.set_attr(
+        self.armature_user_params[param_name] = self.parent_viewer.cache.set_attr(
             ['armature', self.armature_name, param_name],
-            param_value
+            param_value,
+            call_site = self.armature_display_name
         )
 
+    def on_cached_params_changed(self, param_names):
+        """ Called when cached parameters of the armature were changed from outside of it (eg. by another process) """
+        self._armature_user_params = None # Rehydrate on next access
+        self._params_version += 1
+        if 'armature_config_csts' in param_names:
+            self._csts_version += 1
+        self.armature_config_dict = None
+
     # --- Required armature attributes ---
 
     def add_render(self):
@@ -167,11 +204,17 @@ class Armature:
     @property
     def end_transform_mat(self):
         """ returns the transform matrix of the last joint in the armature """
-        self.compute_armature_coords()
-        self._end_transform_mat = list(self.armature_transf_mat.values())[-1]['transf_mat']
-        if self._end_transform_mat is None:
-            self._end_transform_mat = np.eye(4)
-        return self._end_transform_mat
+        self._update_kinematics()
+        return self.kinematic_tree.compound_tmat(self._kinematic_node_id('_end')).copy()
+
+    @property
+    def parent_transform_mat(self):
+        """ returns the end transform matrix of the parent armature (None if the armature has no parent) """
+        self._update_kinematics()
+        parent_node_id = self.kinematic_tree.parent_id(self._kinematic_node_id('_origin'))
+        if parent_node_id is None:
+            return None
+        return self.kinematic_tree.compound_tmat(parent_node_id).copy()
 
     @property
     def armature_tooltip_tmat(self):
@@ -194,28 +237,27 @@ class Armature:
         return _editable_params_values
 
     @property
-    def _params_hash(self):
-        phash = object_list_hash([ # attributes tracked change
-            self.visible,
-            self.armature_config_csts,
-            self.armature_config_dict,
-            self.parent_transform_mat,
-            self.highlighted_in_render,
-            self.parent_viewer.slicing_plane_normal_vect,
-            self.parent_viewer.anat_calib.landmarks_calib_tmat
-        ])
-        return phash
-    
+    def dependency_versions(self):
+        """ Versions of the render inputs (incremented on change), useful to debug stale renders """
+        self._update_kinematics()
+        return {
+            'visible': self._visible_version,
+            'params': self._params_version,
+            'config': self._config_version,
+            'constants': self._csts_version,
+            'parent_transform': self.kinematic_tree.compound_version(self._kinematic_node_id('_origin')),
+            'highlight': self._highlight_version,
+            'slicing_plane': self.parent_viewer.slicing_plane_version,
+            'calibration': self.parent_viewer.anat_calib.landmarks_calib_tmat_version,
+        }
+
     def _accept_render_update(self):
         # Call once the render has been updated
-        self.current_render_hash = self._params_hash
+        self.current_render_versions = tuple(self.dependency_versions.values())
 
     @property
     def _is_render_uptodate(self):
-        _is_render_uptodate = False
-        if self.current_render_hash == self._params_hash:
-            _is_render_uptodate = True
-        return _is_render_uptodate
+        return self.current_render_versions == tuple(self.dependency_versions.values())
 
     @property
     def visible(self):
@@ -223,8 +265,20 @@ class Armature:
 
     @visible.setter
     def visible(self, value):
+        if value != self.visible:
+            self._visible_version += 1
         self.set_armature_user_param('visible', value)
 
+    @property
+    def highlighted_in_render(self):
+        return self._highlighted_in_render
+
+    @highlighted_in_render.setter
+    def highlighted_in_render(self, value):
+        if value != self._highlighted_in_render:
+            self._highlight_version += 1
+        self._highlighted_in_render = value
+
     @property
     def rgba_color(self):
         return self.get_armature_user_param('rgba_color')
@@ -239,16 +293,47 @@ class Armature:
 
     @armature_config_csts.setter
     def armature_config_csts(self, value):
+        previous_csts = self.armature_config_csts
+        self._csts_version += 1
         self.set_armature_user_param('armature_config_csts', value)
+        if self._armature_config_dict is not None: # Only re-evaluate the args depending on the changed constants
+            changed_csts_keys = [kk for kk in previous_csts.keys() | value.keys() if kk not in previous_csts or kk not in value or previous_csts[kk] != value[kk]]
+            previous_armature_config_dict = self._armature_config_dict
+            self._armature_config_dict = self.evaluate_armature_config_dict(
+                self.uneval_armature_config_dict, self.armature_config_csts,
+                changed_csts_keys=changed_csts_keys, evaluated_armature_config_dict=previous_armature_config_dict)
+            self._config_version += 1
+            if self._kinematics_uptodate:
+                for joint_id in self._kinematic_joint_ids:
+                    if self.get_joint_transforms(joint_id) != self.get_joint_transforms(joint_id, previous_armature_config_dict):
+                        self.kinematic_tree.invalidate(self._kinematic_node_id(joint_id))
 
     @property
     def uneval_armature_config_dict(self):
-        return self.get_armature_user_param('uneval_armature_config_dict')
+        uneval_armature_config_dict = self.get_armature_user_param('uneval_armature_config_dict')
+        for param_id, value in self.knob_values.items(): # Apply knob edits
+            param_flat_dict = uneval_armature_config_dict
+            try:
+                for nested_key in param_id.split('&&'):
+                    param_flat_dict = param_flat_dict[nested_key]
+                param_flat_dict['args'][1] = value
+            except (KeyError, IndexError, TypeError): # Knob no longer in the configuration
+                pass
+        return uneval_armature_config_dict
 
     @uneval_armature_config_dict.setter
     def uneval_armature_config_dict(self, value):
+        # Knob edits are included in the full configuration -> dropped
+        self.parent_viewer.cache.delete_attr_subtree(['armature', self.armature_name, 'knob_values'])
+        for param_name in [param_name for param_name in self.armature_user_params if param_name.startswith('knob_values.')]:
+            self.armature_user_params.pop(param_name)
         self.set_armature_user_param('uneval_armature_config_dict', value)
 
+    @property
+    def knob_values(self):
+        """ {'&&'.join(nested_keys): value} of the args edited from the parameters editor, stored apart from uneval_armature_config_dict """
+        return {param_name[len('knob_values.'):]: value for param_name, value in self.armature_user_params.items() if param_name.startswith('knob_values.')}
+
     def get_joints(self, armature_config_dict=None):
         if armature_config_dict is None:
             armature_config_dict = self.armature_config_dict
@@ -267,63 +352,85 @@ class Armature:
             armature_joint_transforms = {}
         return armature_joint_transforms
     
-    def evaluate_armature_config_dict(self, uneval_armature_config_dict, armature_constants_dict, raise_errors=False):
-        evaluated_armature_config_dict = copy.deepcopy(uneval_armature_config_dict) # Deep copy for "inplace" str args evaluation
+    def evaluate_armature_config_dict(self, uneval_armature_config_dict, armature_constants_dict, raise_errors=False, changed_csts_keys=None, evaluated_armature_config_dict=None, vectorized=False):
+        """ Evaluates the str args expressions of uneval_armature_config_dict (compiled once, see compile_args_expression)
+        changed_csts_keys + evaluated_armature_config_dict: only the expressions reading changed_csts_keys are evaluated again, in a copy of evaluated_armature_config_dict
+        vectorized: armature_constants_dict values may be NumPy arrays, args depending on them are evaluated to arrays (eg. for compute_batched_armature_coords) """
+        incremental = changed_csts_keys is not None and evaluated_armature_config_dict is not None
+        if incremental:
+            changed_csts_keys = set(changed_csts_keys)
+            evaluated_armature_config_dict = _jsonshelve.json_copy(evaluated_armature_config_dict)
+        else:
+            evaluated_armature_config_dict = _jsonshelve.json_copy(uneval_armature_config_dict) # Copy for "inplace" str args evaluation
         args_nested_keys = recursive_key_finder(uneval_armature_config_dict, target_key='args') # Grab all 'args' keys from armature_config_dict
 
-        for nested_keys, _ in args_nested_keys:
+        for nested_keys, uneval_args in args_nested_keys:
+            if not (isinstance(uneval_args, list) and len(uneval_args) >= 2): # if args contains 2 elements
+                continue
+            if incremental and not isinstance(uneval_args[1], str): # Constant arg, already validated
+                continue
+
             param_flat_dict = evaluated_armature_config_dict
             for nested_key in nested_keys:
                 param_flat_dict = param_flat_dict[nested_key]
-
             args = param_flat_dict['args']
-            if isinstance(args, list) and len(args) >= 2: # if args contains 2 elements
-                    
-                if isinstance(args[1], str): # and is a str -> evaluate str
-                    try:
-                        evaluated_arg = eval(args[1], {'csts': armature_constants_dict, 'np': np})
-                        args[1] = evaluated_arg
-                    except Exception as e:
-                        err_msg = f'Error in args expression in {self.armature_display_name} {"/".join(nested_keys)} -> {args}\n{type(e).__name__}: {str(e)}'
-                        if raise_errors:
-                            raise ValueError(err_msg)
-                        else:
-                            print(err_msg)
-
-                else:
-                    # Test validity of arg values (int or float are expected appart from string args for evaluation)
-                    if not (isinstance(args[1], int) or isinstance(args[1], float)):
-                        err_msg = f'Unsupported args expression in {self.armature_display_name} {"/".join(nested_keys)} -> {args}'
-                        if raise_errors:
-                            raise ValueError(err_msg)
-                        else:
-                            print(err_msg)
+
+            if isinstance(uneval_args[1], str): # and is a str -> evaluate str
+                try:
+                    args_code, args_csts_keys = compile_args_expression(uneval_args[1])
+                    if incremental and args_csts_keys is not None and args_csts_keys.isdisjoint(changed_csts_keys):
+                        continue # Independent of the changed constants
+                    evaluated_arg = eval(args_code, {'csts': armature_constants_dict, 'np': np})
+                    args[1] = evaluated_arg
+                except Exception as e:
+                    err_msg = f'Error in args expression in {self.armature_display_name} {"/".join(nested_keys)} -> {uneval_args}\n{type(e).__name__}: {str(e)}'
+                    if raise_errors:
+                        raise ValueError(err_msg)
+                    else:
+                        print(err_msg)
+
+            else:
+                # Test validity of arg values (int or float are expected appart from string args for evaluation)
+                if not (isinstance(args[1], int) or isinstance(args[1], float) or (vectorized and isinstance(args[1], np.ndarray))):
+                    err_msg = f'Unsupported args expression in {self.armature_display_name} {"/".join(nested_keys)} -> {args}'
+                    if raise_errors:
+                        raise ValueError(err_msg)
+                    else:
+                        print(err_msg)
         return evaluated_armature_config_dict
 
+    def batched_args_values(self, armature_constants_batch):
+        """ Vectorized args evaluation for a batch of constants values
+        armature_constants_batch: {csts_key: (N,) values}, other constants keep their current value
+        returns {(joint_id, transform_id): (N,) values} of the joint args depending on the batched constants, see compute_batched_armature_coords """
+        armature_constants_dict = {**self.armature_config_csts, **{kk: np.asarray(vv) for kk, vv in armature_constants_batch.items()}}
+        batched_armature_config_dict = self.evaluate_armature_config_dict(
+            self.uneval_armature_config_dict, armature_constants_dict,
+            changed_csts_keys=armature_constants_batch.keys(),
+            evaluated_armature_config_dict=self.armature_config_dict,
+            vectorized=True)
+        args_values = {}
+        for joint_id in self.get_joints(batched_armature_config_dict):
+            for transform_id, transform_args in self.get_joint_transforms(joint_id, batched_armature_config_dict).items():
+                if isinstance(transform_args[1], np.ndarray):
+                    args_values[(joint_id, transform_id)] = transform_args[1]
+        return args_values
+
     def _update_armature_dict_value(self, nested_keys, value):
+        """ Single editable arg update (eg. knob increment): the value is persisted under its own settings key, the evaluated
+        configuration is updated in place and only the edited joint kinematics are invalidated """
+        self.set_armature_user_param(f'knob_values.{"&&".join(nested_keys)}', value)
 
-        # --- uneval dict update ---
-        uneval_armature_config_dict_copy = copy.deepcopy(self.uneval_armature_config_dict)
-        # Recurse through the dict copy based on nested_keys
-        param_flat_dict = uneval_armature_config_dict_copy
+        if self._armature_config_dict is None: # Evaluated on next access
+            return
+        param_flat_dict = self._armature_config_dict
         for nested_key in nested_keys:
             param_flat_dict = param_flat_dict[nested_key]
-        # Apply the value
         param_flat_dict['args'][1] = value
-        # Update the actual dict
-        self.uneval_armature_config_dict = uneval_armature_config_dict_copy
+        self._config_version += 1
+        if self._kinematics_uptodate and nested_keys[0] == '_armature_joints':
+            self.kinematic_tree.invalidate(self._kinematic_node_id(nested_keys[1])) # Only the edited joint subtree is recomputed
 
-        # --- evaluated dict update ---
-        armature_config_dict_copy = copy.deepcopy(self.armature_config_dict)
-        # Recurse through the dict copy based on nested_keys
-        param_flat_dict = armature_config_dict_copy
-        for nested_key in nested_keys:
-            param_flat_dict = param_flat_dict[nested_key]
-        # Apply the value
-        param_flat_dict['args'][1] = value
-        # Update the actual dict
-        self.armature_config_dict = armature_config_dict_copy
-    
     @property
     def armature_config_dict(self):
         if self._armature_config_dict is None:
@@ -333,12 +440,71 @@ class Armature:
     @armature_config_dict.setter
     def armature_config_dict(self, value):
         self._armature_config_dict = value
+        self._config_version += 1
+        self._kinematics_uptodate = False # Joint matrices refreshed on next read
 
-    def compute_armature_coords(self):
-        if self.parent_transform_mat is None:
-            origin_transform_mat = np.eye(4) # (0, 0, 0) -> default if no parent armature
+    # --- Forward kinematics ---
+
+    @property
+    def kinematic_tree(self):
+        return self.stereotax_frame_instance.kinematic_tree
+
+    def _kinematic_node_id(self, joint_id):
+        return (self.armature_display_name, joint_id)
+
+    def joint_transform_mat(self, joint_id):
+        """ Local transform matrix of a joint (chained joint transforms) """
+        joint_transfmat = np.eye(4)
+        for transform_id in self.get_joint_transforms(joint_id):
+            transform_args = self.armature_config_dict['_armature_joints'][joint_id][transform_id]['args']
+            if transform_id.startswith('translation'):
+                joint_transfmat = joint_transfmat @ af_tr.translat_mat(*transform_args)
+            elif transform_id.startswith('rotation'):
+                joint_transfmat = joint_transfmat @ af_tr.rot_mat(*transform_args)
+        return joint_transfmat
+
+    def update_kinematic_tree(self):
+        """ Registers the armature joints chain (_origin -> joints -> _end nodes) in the stereotaxic frame kinematic tree
+        Once armature_config_dict changed, joint matrices are invalidated (dirty subtrees are recomputed on read) """
+        if self._kinematics_uptodate and self._kinematic_node_id('_origin') in self.kinematic_tree:
+            return
+        kinematic_tree = self.kinematic_tree
+        joint_ids = self.get_joints()
+        origin_node_id, end_node_id = self._kinematic_node_id('_origin'), self._kinematic_node_id('_end')
+
+        if joint_ids != self._kinematic_joint_ids or origin_node_id not in kinematic_tree:
+            # (Re)build the joints chain, the _origin / _end nodes are kept to preserve inheritance links
+            for node_id in kinematic_tree.node_ids():
+                if node_id[0] == self.armature_display_name and node_id not in (origin_node_id, end_node_id):
+                    kinematic_tree.remove_node(node_id)
+            if origin_node_id not in kinematic_tree:
+                kinematic_tree.add_node(origin_node_id)
+            parent_node_id = origin_node_id
+            for joint_id in joint_ids:
+                kinematic_tree.add_node(self._kinematic_node_id(joint_id), parent_node_id, functools.partial(self.joint_transform_mat, joint_id))
+                parent_node_id = self._kinematic_node_id(joint_id)
+            if end_node_id not in kinematic_tree:
+                kinematic_tree.add_node(end_node_id, parent_node_id)
+            else:
+                kinematic_tree.set_parent(end_node_id, parent_node_id)
+            self._kinematic_joint_ids = joint_ids
         else:
-            origin_transform_mat = self.parent_transform_mat
+            for joint_id in joint_ids:
+                kinematic_tree.invalidate(self._kinematic_node_id(joint_id))
+        self._kinematics_uptodate = True
+
+    def _update_kinematics(self):
+        # Joints of the armature and of its parent armatures (their compound matrices depend on them only)
+        self.update_kinematic_tree()
+        parent_node_id = self.kinematic_tree.parent_id(self._kinematic_node_id('_origin'))
+        while parent_node_id is not None and parent_node_id[0] in self.stereotax_frame_instance.armatures_objects:
+            parent_armature = self.stereotax_frame_instance.armatures_objects[parent_node_id[0]]
+            parent_armature.update_kinematic_tree()
+            parent_node_id = self.kinematic_tree.parent_id(parent_armature._kinematic_node_id('_origin'))
+
+    def compute_armature_coords(self):
+        self._update_kinematics()
+        origin_transform_mat = self.kinematic_tree.compound_tmat(self._kinematic_node_id('_origin'))
 
         self.armature_transf_mat = {
             'Origin': {
@@ -347,26 +513,86 @@ class Armature:
             }
         }
 
-        parent_transf = origin_transform_mat
-        for joint_id in self.get_joints():
-            joint_transfmat = np.eye(4)
-            for transform_id in self.get_joint_transforms(joint_id):
-                transform_args = self.armature_config_dict['_armature_joints'][joint_id][transform_id]['args']
-                if transform_id.startswith('translation'):
-                    joint_transfmat = joint_transfmat @ af_tr.translat_mat(*transform_args)
-                elif transform_id.startswith('rotation'):
-                    joint_transfmat = joint_transfmat @ af_tr.rot_mat(*transform_args)
-
-            compound_transf = joint_transfmat @ parent_transf
+        for joint_id in self._kinematic_joint_ids:
+            compound_transf = self.kinematic_tree.compound_tmat(self._kinematic_node_id(joint_id))
             self.armature_transf_mat[joint_id] = {
                 'transf_mat': compound_transf,
                 'link_end_loc': compound_transf[3],
             }
-            parent_transf = compound_transf
 
             # DEGUG MODE
             # self.parent_viewer.add_debug_trihedra(self.armature_transf_mat[joint_id]['transf_mat'])
 
         frame_joints = np.array([transforms['link_end_loc'][:3] for _, transforms in self.armature_transf_mat.items()])
 
-        return frame_joints
\ No newline at end of file
+        return frame_joints
+
+    def compute_batched_armature_coords(self, args_values, parent_transform_mats=None):
+        """ Forward kinematics for N armature configurations at once
+        args_values: {(joint_id, transform_id): (N,) values} overriding the transform args values (the current values are used for other transforms)
+        parent_transform_mats: (4, 4) or (N, 4, 4) origin transform matrices (defaults to parent_transform_mat)
+        returns {joint_id: (N, 4, 4) compound transform matrices}, 'Origin' included """
+        args_values = {transform_key: np.atleast_1d(np.asarray(values, dtype=float)) for transform_key, values in args_values.items()}
+        n_configs = max([len(values) for values in args_values.values()], default=1)
+
+        if parent_transform_mats is None:
+            parent_transform_mats = np.eye(4) if self.parent_transform_mat is None else self.parent_transform_mat
+        parent_transform_mats = np.asarray(parent_transform_mats, dtype=float)
+        if parent_transform_mats.ndim == 3:
+            n_configs = max(n_configs, len(parent_transform_mats))
+        parent_transf = np.broadcast_to(parent_transform_mats, (n_configs, 4, 4))
+        batched_armature_transf_mat = {'Origin': parent_transf}
+
+        for joint_id in self.get_joints():
+            joint_transfmats = []
+            for transform_id in self.get_joint_transforms(joint_id):
+                transform_args = list(self.armature_config_dict['_armature_joints'][joint_id][transform_id]['args'])
+                transform_args[1] = args_values.get((joint_id, transform_id), transform_args[1])
+                if transform_id.startswith('translation'):
+                    joint_transfmats.append(af_tr.translat_mats(*transform_args))
+                elif transform_id.startswith('rotation'):
+                    joint_transfmats.append(af_tr.rot_mats(*transform_args))
+
+            parent_transf = af_tr.compose(*joint_transfmats, parent_transf)
+            batched_armature_transf_mat[joint_id] = parent_transf
+
+        return batched_armature_transf_mat
+
+    def batched_end_transform_mats(self, args_values, parent_transform_mats=None):
+        """ (N, 4, 4) transform matrices of the last joint in the armature for N configurations (see compute_batched_armature_coords) """
+        return list(self.compute_batched_armature_coords(args_values, parent_transform_mats).values())[-1]
+
+    # --- Configurations sweep ---
+
+    @property
+    def editable_joint_params(self):
+        """ {param label: (joint_id, transform_id)} of the editable joint transforms (eg. 'AP knob', 'AP tilt') """
+        editable_joint_params = {}
+        for joint_id in self.get_joints():
+            for transform_id in self.get_joint_transforms(joint_id):
+                transform_dict = self.armature_config_dict['_armature_joints'][joint_id][transform_id]
+                if transform_dict.get('_is_editable', False):
+                    editable_joint_params[transform_dict.get('_param_label', f'{joint_id} {transform_id}')] = (joint_id, transform_id)
+        return editable_joint_params
+
+    def joint_param_key(self, param):
+        """ param: editable param label (see editable_joint_params) or (joint_id, transform_id) -> (joint_id, transform_id) """
+        if isinstance(param, tuple):
+            joint_id, transform_id = param
+            if joint_id in self.get_joints() and transform_id in self.get_joint_transforms(joint_id):
+                return param
+        elif param in self.editable_joint_params:
+            return self.editable_joint_params[param]
+        raise KeyError(f'Unknown joint parameter {param} in {self.armature_display_name}')
+
+    def sweep_end_transforms(self, params_values, grid=True):
+        """ End transform matrices for a sweep of the armature joint params, see StereotaxicFrame.sweep_end_transforms
+        params_values: {param label or (joint_id, transform_id): values} """
+        return self.stereotax_frame_instance.sweep_end_transforms(
+            self.armature_display_name,
+            {(self.armature_display_name, param): values for param, values in params_values.items()},
+            grid=grid)
+
+    def sweep_tooltip_positions(self, params_values, grid=True):
+        """ (..., 3) tooltip positions for a sweep of the armature joint params (see sweep_end_transforms) """
+        return self.sweep_end_transforms(params_values, grid=grid)[..., 3, :3]
\ No newline at end of file
@@ -252,11 +252,10 @@ mesh = extrusion.to_mesh()
             else:
                 p_amp_alpha = 20
 
-            p_amp_norm_func = plt.Normalize(vmin=0, vmax=vmax)
-            self.p_amp_rgba = plt.cm.viridis(p_amp_norm_func(p_amp_AS_xyz)) * 255
-
-            self.p_amp_rgba[:, :, :, 3] = (p_amp_alpha * p_amp_norm_func(p_amp_AS_xyz)).astype(int)
-            self.p_amp_AS_vol = gl.GLVolumeItem(self.p_amp_rgba.astype(int), smooth=True, glOptions='additive')
+            # uint8 RGBA gathered from a viridis lookup table with an opacity ramp
+            p_amp_lut = colormap_lut('viridis', alpha=p_amp_alpha * np.arange(256) / 255)
+            self.p_amp_rgba = apply_colormap_lut(quantize_to_uint8(p_amp_AS_xyz, vmin=0, vmax=vmax), p_amp_lut)
+            self.p_amp_AS_vol = gl.GLVolumeItem(self.p_amp_rgba, smooth=True, glOptions='additive')
             self.parent_viewer.gl_view.addItem(self.p_amp_AS_vol, name=f'k-Wave AS pressure field')
             self.p_amp_AS_vol.setDepthValue(2)
 
@@ -657,11 +656,10 @@ mesh = extrusion.to_mesh()
             else:
                 p_amp_alpha = 20
 
-            p_amp_norm_func = plt.Normalize(vmin=0, vmax=vmax)
-            self.p_amp_rgba = plt.cm.viridis(p_amp_norm_func(p_amp_3D_xyz)) * 255
-
-            self.p_amp_rgba[:, :, :, 3] = (p_amp_alpha * p_amp_norm_func(p_amp_3D_xyz)).astype(int)
-            self.p_amp_3D_vol = gl.GLVolumeItem(self.p_amp_rgba.astype(int), smooth=True, glOptions='additive')
+            # uint8 RGBA gathered from a viridis lookup table with an opacity ramp
+            p_amp_lut = colormap_lut('viridis', alpha=p_amp_alpha * np.arange(256) / 255)
+            self.p_amp_rgba = apply_colormap_lut(quantize_to_uint8(p_amp_3D_xyz, vmin=0, vmax=vmax), p_amp_lut)
+            self.p_amp_3D_vol = gl.GLVolumeItem(self.p_amp_rgba, smooth=True, glOptions='additive')
             self.parent_viewer.gl_view.addItem(self.p_amp_3D_vol, name=f'k-Wave 3D pressure field')
             self.p_amp_3D_vol.setDepthValue(2)
 
@@ -1049,11 +1047,10 @@ mesh = extrusion.to_mesh()
             else:
                 p_amp_alpha = 20
 
-            p_amp_norm_func = plt.Normalize(vmin=0, vmax=vmax)
-            self.p_amp_rgba = plt.cm.viridis(p_amp_norm_func(p_amp_AS_xyz)) * 255
-
-            self.p_amp_rgba[:, :, :, 3] = (p_amp_alpha * p_amp_norm_func(p_amp_AS_xyz)).astype(int)
-            self.p_amp_AS_vol = gl.GLVolumeItem(self.p_amp_rgba.astype(int), smooth=True, glOptions='additive')
+            # uint8 RGBA gathered from a viridis lookup table with an opacity ramp
+            p_amp_lut = colormap_lut('viridis', alpha=p_amp_alpha * np.arange(256) / 255)
+            self.p_amp_rgba = apply_colormap_lut(quantize_to_uint8(p_amp_AS_xyz, vmin=0, vmax=vmax), p_amp_lut)
+            self.p_amp_AS_vol = gl.GLVolumeItem(self.p_amp_rgba, smooth=True, glOptions='additive')
             self.parent_viewer.gl_view.addItem(self.p_amp_AS_vol, name=f'k-Wave AS pressure field')
             self.p_amp_AS_vol.setDepthValue(2)
 
@@ -1259,11 +1256,10 @@ mesh = extrusion.to_mesh()
             else:
                 p_amp_alpha = 20
 
-            p_amp_norm_func = plt.Normalize(vmin=0, vmax=vmax)
-            self.p_amp_rgba = plt.cm.viridis(p_amp_norm_func(p_amp_3D_xyz)) * 255
-
-            self.p_amp_rgba[:, :, :, 3] = (p_amp_alpha * p_amp_norm_func(p_amp_3D_xyz)).astype(int)
-            self.p_amp_3D_vol = gl.GLVolumeItem(self.p_amp_rgba.astype(int), smooth=True, glOptions='additive')
+            # uint8 RGBA gathered from a viridis lookup table with an opacity ramp
+            p_amp_lut = colormap_lut('viridis', alpha=p_amp_alpha * np.arange(256) / 255)
+            self.p_amp_rgba = apply_colormap_lut(quantize_to_uint8(p_amp_3D_xyz, vmin=0, vmax=vmax), p_amp_lut)
+            self.p_amp_3D_vol = gl.GLVolumeItem(self.p_amp_rgba, smooth=True, glOptions='additive')
             self.parent_viewer.gl_view.addItem(self.p_amp_3D_vol, name=f'k-Wave AS-3D pressure field')
             self.p_amp_3D_vol.setDepthValue(2)
 
@@ -60,13 +60,9 @@ class STLMeshArmature(Armature):
 
     def update_stl_item_transform_matrix(self):
         if 'transform_str' in self.armature_config_dict['_stl_mesh'] and self.armature_config_dict['_stl_mesh']['transform_str'] is not None:
-            transforms_matrices = af_tr_from_str.transform_matrices_from_str(self.armature_config_dict['_stl_mesh']['transform_str'])
+            stl_item_tmat = af_tr_from_str.transform_mat_from_str(self.armature_config_dict['_stl_mesh']['transform_str'])
         else:
-            transforms_matrices = [np.eye(4)]
-
-        stl_item_tmat = np.eye(4)
-        for tr_mat in transforms_matrices:
-                stl_item_tmat = stl_item_tmat @ tr_mat
+            stl_item_tmat = np.eye(4)
         stl_item_tmat = stl_item_tmat @ self.end_transform_mat
 
         self.mesh_handler.stl_item_tmat = stl_item_tmat
@@ -248,13 +244,9 @@ mesh.apply_transform(z_translate_tmat)
 
     def update_stl_item_transform_matrix(self):
         if 'transform_str' in self.armature_config_dict['_stl_mesh'] and self.armature_config_dict['_stl_mesh']['transform_str'] is not None:
-            transforms_matrices = af_tr_from_str.transform_matrices_from_str(self.armature_config_dict['_stl_mesh']['transform_str'])
+            stl_item_tmat = af_tr_from_str.transform_mat_from_str(self.armature_config_dict['_stl_mesh']['transform_str'])
         else:
-            transforms_matrices = [np.eye(4)]
-
-        stl_item_tmat = np.eye(4)
-        for tr_mat in transforms_matrices:
-                stl_item_tmat = stl_item_tmat @ tr_mat
+            stl_item_tmat = np.eye(4)
         stl_item_tmat = stl_item_tmat @ self.end_transform_mat
 
         self.mesh_handler.stl_item_tmat = stl_item_tmat
@@ -593,13 +585,9 @@ mesh = extrusion.to_mesh()
 
     def update_boolean_mask_transform_matrix(self):
         if ('_boolean_mask' in self.armature_config_dict) and ('transform_str' in self.armature_config_dict['_boolean_mask']) and (self.armature_config_dict['_boolean_mask']['transform_str'] is not None):
-            transforms_matrices = af_tr_from_str.transform_matrices_from_str(self.armature_config_dict['_boolean_mask']['transform_str'])
+            bmask_tmat = self.end_transform_mat @ af_tr_from_str.transform_mat_from_str(self.armature_config_dict['_boolean_mask']['transform_str'])
         else:
-            transforms_matrices = [np.eye(4)]
-
-        bmask_tmat = self.end_transform_mat
-        for tr_mat in transforms_matrices:
-                bmask_tmat = bmask_tmat @ tr_mat
+            bmask_tmat = self.end_transform_mat
 
         self.bool_mask_mesh_handler.stl_item_tmat = bmask_tmat
 
@@ -1,5 +1,9 @@
 from coperniFUS import *
 from coperniFUS.modules.module_base import Module
+from coperniFUS.modules._atlas_pyramid import AtlasPyramid, block_mean_reduce, save_npy_atomic, select_pyramid_level
+from coperniFUS.modules._structure_index import StructureVoxelIndex
+from coperniFUS.modules._atlas_loader import AtlasLoadCanceled, AtlasLoader
+from coperniFUS.modules._atlas_zarr import lazy_tiff_volume, lazy_volume_range, lazy_zarr_volume
 
 
 class BrainAtlas(Module):
@@ -8,13 +12,31 @@ class BrainAtlas(Module):
         'default_atlas_name': 'whs_sd_rat_39um',
         'highlighted_structure': 'Select structure',
         'highlighted_structure_hemisphere': 'Both',
+        'highlighted_structures': [], # [[structure name, hemisphere ('Both', '1' or '2'), [r, g, b]], ...]
         'atlas_transforms_str' : 'Rx0deg Tz0um',
         'subsampling_stride': 10,
+        'level_of_detail': False, # Opt-in: saved subsampling_stride settings are honoured until enabled
         'black_threshold': 5,
         'alpha': .1
     }
 
-    def __init__(self, parent_viewer, skip_online_atlas_retreival=False, **kwargs) -> None:
+    ATLAS_ZARR_CHUNKS = (32, 128, 128) # Chunks of the atlas volumes zarr stores (slabs along the first axis are read / written at once)
+    CACHED_INDEX_VOLUMES = 8 # uint8 colormap index volumes kept in the cache directory (least recently used ones are deleted)
+    SLICING_PLANE_N_THREADS = 4 # Threads evaluating the slicing plane mask
+    HIGHLIGHT_COLORMAP = 'tab10' # Colors of newly highlighted structures are cycled through this colormap
+
+    # Level of detail (LOD) rendering from the atlas pyramids, subsampling_stride is ignored when level_of_detail is enabled
+    LOD_N_LEVELS = 6 # Pyramid levels (level k voxels span 2**k atlas voxels)
+    LOD_PIXELS_PER_VOXEL = 1.5 # Coarsest level whose voxels span at most this many screen pixels is rendered
+    LOD_MAX_RENDERED_VOXELS = 2**24 # Coarser levels are rendered if the visible region exceeds this voxel count
+    LOD_VIEW_MARGIN = 1.5 # Rendered region half width relative to the view half width
+    LOD_CROP_BLOCK = 32 # Crop bounds are snapped to multiples of this many voxels (pan without reloading the volume)
+    LOD_CAMERA_DEBOUNCE_MS = 150
+
+    ATLAS_LOADER_POLL_MS = 100 # Atlas loader worker messages polling interval
+
+    def __init__(self, parent_viewer, skip_online_atlas_retreival=False, atlas_mirror=None, **kwargs) -> None:
+        """ atlas_mirror: BrainGlobe like remote url base or local directory atlases are downloaded from (BrainGlobe GIN repository if None) """
         super().__init__(parent_viewer, 'atlas', **kwargs)
 
         if 'running_test' in self.module_kwargs and self.module_kwargs['running_test']:
@@ -22,29 +44,34 @@ class BrainAtlas(Module):
             self._DEFAULT_PARAMS['default_atlas_name'] = 'example_mouse_100um' # TODO example_mouse_100um as default
 
         self.skip_online_atlas_retreival = skip_online_atlas_retreival
+        self.atlas_mirror = atlas_mirror
         self.init_attributes()
 
     def init_attributes(self):
         self._available_atlases = None
-        self._raw_highlighted_structure_volume = None
-        self._raw_atlas_rgba_volume = None
+        self.atlas_loader = None
+        self._highlighted_voxels = None
+        self._atlas_index_volume = None
+        self._reference_pyramid = None
+        self._structure_index = None
+        self.render_level = None # (pyramid level, crop start, crop stop) of the level of detail render
         self._atlas_rgba_volume = None
-        self._tmat_version_hash = None
         self._brain_atlas_tmat = None
         self.atlas_glvol = None
         self.bg_atlas = None
         self.bg_atlas_structures = {'Select structure': None}
-
-        self._atlas_voxel_coordinates = None
         self._slicing_plane_mask = None
 
     # --- Atlas specific cache wrapper ---
     
-    def get_user_param(self, param_name, default_value=None):
-        if self.bg_atlas is not None:
+    def get_user_param(self, param_name, default_value=None, atlas_name=None):
+        """ atlas_name: read the parameter of another atlas than the loaded one """
+        if atlas_name is None and self.bg_atlas is not None:
+            atlas_name = self.bg_atlas.atlas_name
+        if atlas_name is not None:
             param_value = super().get_user_param(
                 param_name,
-                additional_identifiers=[self.bg_atlas.atlas_name],
+                additional_identifiers=[atlas_name],
                 default_value=default_value)
         else:
             param_value = self._DEFAULT_PARAMS[param_name]
@@ -81,6 +108,19 @@ class BrainAtlas(Module):
         self.dock_layout.addWidget(self.subsampling_stride_editor, 0, 1, 1, 1) # Y, X, w, h
         self.subsampling_stride_editor.setToolTip('Atlas subsampling stride<br>Use 1 to show the altas in its full resolution, larger strides will however improve performances.')
 
+        self.level_of_detail_checkbox = pyqtw.QCheckBox('Auto LOD')
+        self.level_of_detail_checkbox.setChecked(self._DEFAULT_PARAMS['level_of_detail'])
+        self.level_of_detail_checkbox.toggled.connect(self._on_level_of_detail_toggled)
+        self.dock_layout.addWidget(self.level_of_detail_checkbox, 0, 3, 1, 1) # Y, X, w, h
+        self.level_of_detail_checkbox.setToolTip('Automatic level of detail<br>The atlas resolution and rendered region follow the camera zoom, the subsampling stride is ignored.')
+
+        # Camera moves -> level of detail update (debounced)
+        self._camera_changed_timer = pyqtc.QTimer()
+        self._camera_changed_timer.setSingleShot(True)
+        self._camera_changed_timer.setInterval(self.LOD_CAMERA_DEBOUNCE_MS)
+        self._camera_changed_timer.timeout.connect(self._on_camera_changed)
+        self.parent_viewer.gl_view.camera_changed.connect(self._camera_changed_timer.start)
+
         self.atlas_transform_editor = pyqtw.QLineEdit(str(self._DEFAULT_PARAMS['atlas_transforms_str']))
         self.atlas_transform_editor.editingFinished.connect(functools.partial(self._parse_editor, self.atlas_transform_editor, 'atlas_transforms_str', '', 'str'))
         self.dock_layout.addWidget(self.atlas_transform_editor, 0, 2, 1, 1) # Y, X, w, h
@@ -105,6 +145,21 @@ class BrainAtlas(Module):
         self.highlight_structure_btn.clicked.connect(self._highlight_structure_btn_pressed)
         self.highlight_structure_btn.setEnabled(False)
         self.dock_layout.addWidget(self.highlight_structure_btn, 1, 2, 1, 1)
+        self.highlight_structure_btn.setToolTip('Add the selected structure to the highlighted structures (or remove it if already highlighted).<br>Each structure is highlighted with its own color.')
+
+        self.clear_highlights_btn = pyqtw.QPushButton('Clear Highlights')
+        self.clear_highlights_btn.clicked.connect(self._clear_highlights_btn_pressed)
+        self.clear_highlights_btn.setEnabled(False)
+        self.dock_layout.addWidget(self.clear_highlights_btn, 1, 3, 1, 1)
+
+        # Atlas loading (worker thread messages polled from the Qt thread)
+        self.cancel_atlas_loading_btn = pyqtw.QPushButton('Cancel Loading')
+        self.cancel_atlas_loading_btn.clicked.connect(self.cancel_atlas_loading)
+        self.cancel_atlas_loading_btn.setEnabled(False)
+        self.dock_layout.addWidget(self.cancel_atlas_loading_btn, 0, 4, 1, 1)
+        self._atlas_loader_timer = pyqtc.QTimer()
+        self._atlas_loader_timer.setInterval(self.ATLAS_LOADER_POLL_MS)
+        self._atlas_loader_timer.timeout.connect(self._poll_atlas_loader)
 
         self.update_atlas_selector()
 
@@ -121,6 +176,19 @@ class BrainAtlas(Module):
             self.update_atlas_transform()
             self.atlas_glvol.setData(self.atlas_rgba_volume)
 
+    def on_cached_params_changed(self, param_ids):
+        loaded_atlas_name = self.bg_atlas.atlas_name if self.bg_atlas is not None else None
+        default_atlas_name = self.parent_viewer.cache.get_attr('atlas.default_atlas_name', default_value=self._DEFAULT_PARAMS['default_atlas_name'])
+        if default_atlas_name != loaded_atlas_name and f'offline_{default_atlas_name}' in self.available_atlases:
+            # Other atlas -> selector change triggers _add_atlas
+            self.atlas_selector.setCurrentIndex(list(self.available_atlases.keys()).index(f'offline_{default_atlas_name}'))
+        elif loaded_atlas_name is not None and any(param_id.startswith(f'{loaded_atlas_name}.') for param_id in param_ids):
+            self.update_structure_selector()
+            self.update_atlas_user_params_editors()
+            self.render_level = None
+            self._slicing_plane_mask = None
+            self.update_rendered_object()
+
     # --- Module specific attributes ---
 
     def _parse_editor(self, src_editor, param_name, unit='', param_type='float'):
@@ -132,6 +200,8 @@ class BrainAtlas(Module):
             edited_value = si_parse(edited_text_nounit.replace('u', 'µ'))
         else: # raw str
             edited_value = src_editor.text()
+        if param_name.endswith('transforms_str'):
+            self.parent_viewer.show_transform_str_errors(edited_value)
         self.set_user_param(param_name, edited_value)
         self.parent_viewer.update_rendered_view()
 
@@ -172,126 +242,384 @@ class BrainAtlas(Module):
         self._available_atlases = value
 
     def _add_atlas(self):
+        self._stop_atlas_loader()
         self.delete_rendered_object()
         self.init_attributes()
 
         selected_atlas_description = self.atlas_selector.currentText()
-
-        # def download_atlas_wrapper(online_atlas_name):
-        #     bg_atlas = BrainGlobeAtlas(online_atlas_name, check_latest=True)
-        #     self._add_atlas()
+        atlas_name, download = None, False
 
         if selected_atlas_description is None:
             pass # TODO msg in status bar
         elif selected_atlas_description.endswith('(DOWNLOADED)'):
-            offline_atlas_name = selected_atlas_description.split(' | ')[0]
-            self.parent_viewer.statusBar().showMessage(f'Loading offline {offline_atlas_name}', self.parent_viewer._STATUS_BAR_MSG_TIMEOUT)
-            self.bg_atlas = BrainGlobeAtlas(offline_atlas_name, check_latest=False)
+            atlas_name = selected_atlas_description.split(' | ')[0]
         elif selected_atlas_description.endswith('(online)'):
             online_atlas_name = selected_atlas_description.split(' | ')[0]
             
             dialog = AcceptRejectDialog(parent=self.parent_viewer, title='Proceed with Brain Atlas download?', msg=f'Do you want to download {online_atlas_name} ?\nThis might take a few minutes')
             dialog_result = dialog.exec()
             if dialog_result == 1:
-                self.parent_viewer.statusBar().showMessage(f'Downloading {online_atlas_name}')
-                
-                # TODO reimplement threaded download
-                # self.threaded_atlas_download = threading.Thread(
-                #     target=download_atlas_wrapper,
-                #     args=(online_atlas_name,))
-                # self.threaded_atlas_download.start()
-                # TODO allow thread interruption
-                self.bg_atlas = BrainGlobeAtlas(online_atlas_name, check_latest=True)
-                
+                atlas_name, download = online_atlas_name, True
             else:
                 self.parent_viewer.statusBar().showMessage('Atlas Download Canceled!', self.parent_viewer._STATUS_BAR_MSG_TIMEOUT)
 
-        if self.bg_atlas is not None:
+        if atlas_name is not None:
+            # Download, loading and volumes computation in a worker thread
+            self.atlas_loader = AtlasLoader(mirror=self.atlas_mirror)
+            self.atlas_loader.start(atlas_name, download=download, prepare_fn=functools.partial(
+                self._prepare_atlas,
+                level_of_detail=self.get_user_param('level_of_detail', atlas_name=atlas_name),
+                subsampling_stride=self.get_user_param('subsampling_stride', atlas_name=atlas_name)))
+            self.parent_viewer.statusBar().showMessage(f'Loading {atlas_name}')
+            self.cancel_atlas_loading_btn.setEnabled(True)
+            self._atlas_loader_timer.start()
+        else:
+            self.update_atlas_selector()
+
+    @property
+    def atlas_loading(self):
+        return self.atlas_loader is not None
+
+    def _stop_atlas_loader(self):
+        if self.atlas_loader is not None:
+            self.atlas_loader.cancel() # Worker messages are discarded from now on
+            self.atlas_loader = None
+            self._atlas_loader_timer.stop()
+            self.cancel_atlas_loading_btn.setEnabled(False)
+
+    def cancel_atlas_loading(self):
+        if self.atlas_loader is not None:
+            self._stop_atlas_loader()
+            self.parent_viewer.statusBar().showMessage('Atlas loading canceled', self.parent_viewer._STATUS_BAR_MSG_TIMEOUT)
+            self.update_atlas_selector()
+
+    def _prepare_atlas(self, bg_atlas, report_progress, cancel_event, level_of_detail=False, subsampling_stride=1):
+        """ Atlas loader worker step: structures list, structure index and rendered reference volumes (cached on disk)
+        Runs outside of the Qt thread, results are assigned by _on_atlas_loaded """
+        prepared = {'structures': self.structure_selector_items(bg_atlas)}
+
+        report_progress(f'Indexing {bg_atlas.atlas_name} structures')
+        prepared['structure_index'] = self.load_structure_index(bg_atlas)
+
+        if level_of_detail:
+            prepared['reference_pyramid'] = self.make_reference_pyramid(bg_atlas)
+            for level in range(self.LOD_N_LEVELS):
+                if cancel_event.is_set():
+                    raise AtlasLoadCanceled(bg_atlas.atlas_name)
+                report_progress(f'Computing {bg_atlas.atlas_name} level of detail {level + 1}/{self.LOD_N_LEVELS}')
+                prepared['reference_pyramid'].level(level)
+        else:
+            if cancel_event.is_set():
+                raise AtlasLoadCanceled(bg_atlas.atlas_name)
+            report_progress(f'Computing {bg_atlas.atlas_name} volume')
+            prepared['atlas_index_volume'] = self.load_index_volume(bg_atlas, subsampling_stride)
+        return prepared
+
+    def _poll_atlas_loader(self):
+        atlas_loader = self.atlas_loader
+        if atlas_loader is None:
+            self._atlas_loader_timer.stop()
+            return
+
+        for message_type, message in atlas_loader.poll():
+            if message_type == 'progress':
+                self.parent_viewer.statusBar().showMessage(message)
+            elif message_type == 'loaded':
+                self._on_atlas_loaded(*message)
+            elif message_type == 'canceled':
+                self.parent_viewer.statusBar().showMessage(f'{message} loading canceled', self.parent_viewer._STATUS_BAR_MSG_TIMEOUT)
+            elif message_type == 'error':
+                self.parent_viewer.statusBar().showMessage(message, self.parent_viewer._STATUS_BAR_MSG_TIMEOUT)
+
+        if atlas_loader is self.atlas_loader and not atlas_loader.is_running and atlas_loader.messages.empty(): # Worker done
+            self.atlas_loader = None
+            self._atlas_loader_timer.stop()
+            self.cancel_atlas_loading_btn.setEnabled(False)
+            self.update_atlas_selector()
+
+    def _on_atlas_loaded(self, bg_atlas, prepared):
+        self.bg_atlas = bg_atlas
+        self._structure_index = prepared['structure_index']
+        self._reference_pyramid = prepared.get('reference_pyramid')
+        self._atlas_index_volume = prepared.get('atlas_index_volume')
+
+        # Set transform str for rat atlas on blank projects
+        if self.bg_atlas.atlas_name == 'whs_sd_rat_39um' and self.get_user_param('atlas_transforms_str') == self._DEFAULT_PARAMS['atlas_transforms_str']:
+            self.set_user_param('atlas_transforms_str', 'S1.15 Rx-89.3deg Rz180deg Ry-5deg Ty.55mm Tx-5.5mm Tz-9.3mm')
+
+        self.update_structure_selector(prepared['structures'])
+        self.update_atlas_user_params_editors()
+        self.parent_viewer.cache.set_attr('atlas.default_atlas_name', self.bg_atlas.atlas_name)
+        self.parent_viewer.statusBar().clearMessage()
+
+        # TODO -> tranfer to add_rendered_object ???
+        self.atlas_glvol = gl.GLVolumeItem(self.atlas_rgba_volume, smooth=True, glOptions='translucent')
+        self.parent_viewer.gl_view.addItem(self.atlas_glvol, name='Brain atlas')
+        self.atlas_glvol.setDepthValue(1) # GL volumes -> render tree foreground
+        self.update_atlas_transform()
 
-            # Set transform str for rat atlas on blank projects
-            if self.bg_atlas.atlas_name == 'whs_sd_rat_39um' and self.get_user_param('atlas_transforms_str') == self._DEFAULT_PARAMS['atlas_transforms_str']:
-                self.set_user_param('atlas_transforms_str', 'S1.15 Rx-89.3deg Rz180deg Ry-5deg Ty.55mm Tx-5.5mm Tz-9.3mm')
+    @property
+    def atlas_shape(self):
+        return self.atlas_index_volume.shape
 
-            self.update_structure_selector()
-            self.update_atlas_user_params_editors()
-            self.parent_viewer.cache.set_attr('atlas.default_atlas_name', self.bg_atlas.atlas_name)
+    @property
+    def level_of_detail(self):
+        return self.get_user_param('level_of_detail')
 
-            # TODO -> tranfer to add_rendered_object ???
-            self.atlas_glvol = gl.GLVolumeItem(self.atlas_rgba_volume, smooth=True, glOptions='translucent')
-            self.parent_viewer.gl_view.addItem(self.atlas_glvol, name='Brain atlas')
-            self.atlas_glvol.setDepthValue(1) # GL volumes -> render tree foreground
-            self.update_atlas_transform()
+    @property
+    def rendered_stride(self):
+        """ Atlas voxels spanned by a rendered voxel """
+        if self.level_of_detail:
+            return 2**self.current_render_level[0]
+        return self.get_user_param('subsampling_stride')
+
+    @staticmethod
+    def atlas_full_name(bg_atlas):
+        return f'{bg_atlas.atlas_name}_v{bg_atlas.metadata.get("version", "")}'
+
+    def lazy_atlas_volume(self, bg_atlas, volume_name):
+        """ Atlas volume ('reference', 'annotation' or 'hemispheres') as a lazy dask array backed by a chunked zarr store of the cache directory
+        Stores are converted on first use from the atlas tiff files, read one slab of pages at a time """
+        def source_volume():
+            tiff_fpath = bg_atlas.root_dir / f'{volume_name}.tiff'
+            if tiff_fpath.exists():
+                return lazy_tiff_volume(tiff_fpath)
+            return getattr(bg_atlas, volume_name) # Generated by BrainGlobe (eg. hemispheres of symmetric atlases)
+
+        zarr_path = self.parent_viewer.cache.cache_dir / 'atlas_zarr' / self.atlas_full_name(bg_atlas) / f'{volume_name}.zarr'
+        return lazy_zarr_volume(zarr_path, source_volume, chunks=self.ATLAS_ZARR_CHUNKS)
+
+    def make_reference_pyramid(self, bg_atlas):
+        """ Block mean pyramid of the uint8 quantized atlas reference """
+        def quantized_reference(): # Lazy, quantized chunk by chunk
+            reference = self.lazy_atlas_volume(bg_atlas, 'reference')
+            vmin, vmax = lazy_volume_range(reference)
+            return reference.map_blocks(quantize_to_uint8, vmin=vmin, vmax=vmax, dtype=np.uint8)
+
+        return AtlasPyramid(
+            self.parent_viewer.cache.cache_dir / 'atlas_pyramids' / self.atlas_full_name(bg_atlas), 'reference',
+            level0_fn=quantized_reference,
+            reduce_fn=block_mean_reduce,
+            n_levels=self.LOD_N_LEVELS)
 
-        self.update_atlas_selector()
+    @property
+    def reference_pyramid(self):
+        if self._reference_pyramid is None:
+            self._reference_pyramid = self.make_reference_pyramid(self.bg_atlas)
+        return self._reference_pyramid
+
+    def load_structure_index(self, bg_atlas):
+        """ Sparse voxel index of the atlas structures, built once per atlas version and saved in the cache directory """
+        index_fpath = self.parent_viewer.cache.cache_dir / 'atlas_structure_index' / f'{self.atlas_full_name(bg_atlas)}.npz'
+        if index_fpath.exists():
+            return StructureVoxelIndex.load(index_fpath)
+        structure_index = StructureVoxelIndex.from_annotation(
+            self.lazy_atlas_volume(bg_atlas, 'annotation'),
+            self.lazy_atlas_volume(bg_atlas, 'hemispheres'),
+            slab_size=self.ATLAS_ZARR_CHUNKS[0])
+        index_fpath.parent.mkdir(parents=True, exist_ok=True)
+        tmp_index_fpath = index_fpath.with_suffix(f'.{uuid.uuid4().hex}.tmp')
+        with open(tmp_index_fpath, 'wb') as index_file:
+            structure_index.save(index_file)
+        os.replace(tmp_index_fpath, index_fpath) # Atomic write
+        return structure_index
 
     @property
-    def raw_atlas_rgba_volume(self):
+    def structure_index(self):
+        if self._structure_index is None:
+            self.parent_viewer.statusBar().showMessage('Indexing atlas structures')
+            self._structure_index = self.load_structure_index(self.bg_atlas)
+            self.parent_viewer.statusBar().clearMessage()
+        return self._structure_index
+
+    @property
+    def current_render_level(self):
+        if self.render_level is None:
+            self.render_level = self.select_render_level()
+        return self.render_level
+
+    @property
+    def _render_crop_slices(self):
+        _, crop_start, crop_stop = self.current_render_level
+        return tuple(slice(start, stop) for start, stop in zip(crop_start, crop_stop))
+
+    def _lod_base_tmat(self, level, crop_start):
+        # Voxel indices of a cropped pyramid level -> centered atlas coordinates (blocks centers, before atlas_transforms_str)
+        base_resolution = np.array(self.bg_atlas.resolution) * 1e-6 # um to meters
+        level_resolution = 2**level * base_resolution
+        origin = np.array(crop_start) * level_resolution + base_resolution * (2**level - 1) / 2 - base_resolution * np.array(self.bg_atlas.shape) / 2
+        lod_base_tmat = af_tr.scale_mat(level_resolution)
+        lod_base_tmat = lod_base_tmat @ af_tr.translat_mat('x', origin[0])
+        lod_base_tmat = lod_base_tmat @ af_tr.translat_mat('y', origin[1])
+        lod_base_tmat = lod_base_tmat @ af_tr.translat_mat('z', origin[2])
+        return lod_base_tmat
+
+    def atlas_grid(self, level=0):
+        """ (grid_tmat, grid_shape) of the whole atlas at a pyramid level (2**level atlas voxels blocks), independent of the rendered level of detail """
+        grid_shape = tuple(-(-n_voxels // 2**level) for n_voxels in self.bg_atlas.shape)
+        grid_tmat = self._lod_base_tmat(level, (0, 0, 0)) @ af_tr_from_str.transform_mat_from_str(self.get_user_param('atlas_transforms_str')) @ self.parent_viewer.anat_calib.landmarks_calib_tmat
+        return grid_tmat, grid_shape
+
+    def select_render_level(self):
+        """ (pyramid level, crop start, crop stop) of the level of detail render, picked from the camera distance / field of view and the visible region """
+        gl_view = self.parent_viewer.gl_view
+        base_resolution = np.array(self.bg_atlas.resolution) * 1e-6 # um to meters
+        atlas_shape = np.array(self.bg_atlas.shape)
+        view_half_width = gl_view.opts['distance'] * np.tan(np.deg2rad(gl_view.opts['fov']) / 2)
+        pixel_size = 2 * view_half_width / max(gl_view.width(), 1)
+
+        # Visible region in level 0 voxel indices: bounding box of a cube around the camera center
+        level0_tmat, _ = self.atlas_grid(0)
+        camera_center = np.array([gl_view.opts['center'].x(), gl_view.opts['center'].y(), gl_view.opts['center'].z()])
+        cube_corners = camera_center + self.LOD_VIEW_MARGIN * view_half_width * np.array(list(itertools.product([-1, 1], repeat=3)))
+        corners_voxel_coords = af_tr.apply_tmats(np.linalg.inv(level0_tmat), cube_corners)
+        region_start = np.clip(np.floor(corners_voxel_coords.min(axis=0)), 0, atlas_shape).astype(int)
+        region_stop = np.clip(np.ceil(corners_voxel_coords.max(axis=0)) + 1, 0, atlas_shape).astype(int)
+        if np.any(region_stop <= region_start): # Atlas out of view
+            region_start, region_stop = np.zeros(3, dtype=int), atlas_shape
+
+        level = select_pyramid_level(
+            base_resolution.min(), pixel_size, self.LOD_N_LEVELS,
+            pixels_per_voxel=self.LOD_PIXELS_PER_VOXEL,
+            region_shape=region_stop - region_start,
+            max_voxels=self.LOD_MAX_RENDERED_VOXELS)
+        # Crop snapped to LOD_CROP_BLOCK level voxels (small camera moves keep the same rendered region)
+        level_shape = np.ceil(atlas_shape / 2**level).astype(int)
+        crop_start = (region_start // 2**level) // self.LOD_CROP_BLOCK * self.LOD_CROP_BLOCK
+        crop_stop = np.ceil(np.ceil(region_stop / 2**level) / self.LOD_CROP_BLOCK).astype(int) * self.LOD_CROP_BLOCK
+        crop_stop = np.minimum(crop_stop, level_shape)
+        return (level, tuple(int(ii) for ii in crop_start), tuple(int(ii) for ii in crop_stop))
+
+    def _on_camera_changed(self):
+        if self.atlas_glvol is None or not self.level_of_detail:
+            return
+        render_level = self.select_render_level()
+        if render_level != self.render_level: # Swap the rendered volume only when the level / crop changed
+            self.render_level = render_level
+            self._slicing_plane_mask = None
+            self.update_rendered_object()
+
+    def _on_level_of_detail_toggled(self, checked):
+        self.set_user_param('level_of_detail', checked)
+        self.render_level = None
+        self._slicing_plane_mask = None
+        self.subsampling_stride_editor.setEnabled(not checked)
+        self.parent_viewer.update_rendered_view()
+
+    @property
+    def atlas_index_volume(self):
+        """ uint8 colormap indices of the rendered atlas reference (memory-mapped from the cache directory)
+        level_of_detail: cropped pyramid level, otherwise subsampled with subsampling_stride """
+        if self.level_of_detail:
+            return self.reference_pyramid.level(self.current_render_level[0])[self._render_crop_slices]
+
         subs_stride = self.get_user_param('subsampling_stride')
-        atlas_rgba_vol_id = f'{self.bg_atlas.atlas_name}.{subs_stride}'
+        if self._atlas_index_volume is None or self._atlas_index_volume[0] != (self.atlas_full_name(self.bg_atlas), subs_stride):
+            self._atlas_index_volume = self.load_index_volume(self.bg_atlas, subs_stride)
+        return self._atlas_index_volume[1]
+
+    def load_index_volume(self, bg_atlas, subs_stride):
+        """ ((atlas full name, subs_stride), uint8 colormap indices of the atlas reference subsampled with subs_stride)
+        persisted as .npy in the cache directory and memory-mapped on load """
+        atlas_index_vol_id = f'{bg_atlas.atlas_name}.v{bg_atlas.metadata.get("version", "")}.{subs_stride}'
+        index_vol_cache_dir = self.parent_viewer.cache.cache_dir / 'atlas_volumes'
+        index_vol_fpath = index_vol_cache_dir / f'{bg_atlas.atlas_name}_s{subs_stride}_{object_list_hash(atlas_index_vol_id)[:16]}.npy'
+
+        if not index_vol_fpath.exists():
+            index_vol = quantize_to_uint8(self.lazy_atlas_volume(bg_atlas, 'reference')[::subs_stride, ::subs_stride, ::subs_stride].compute())
+
+            index_vol_cache_dir.mkdir(exist_ok=True)
+            save_npy_atomic(index_vol_fpath, index_vol)
+            del index_vol
+
+            # Keep the most recently used volumes only
+            cached_index_vol_fpaths = sorted(index_vol_cache_dir.glob('*.npy'), key=lambda fpath: fpath.stat().st_mtime, reverse=True)
+            for cached_index_vol_fpath in cached_index_vol_fpaths[self.CACHED_INDEX_VOLUMES:]:
+                try:
+                    cached_index_vol_fpath.unlink(missing_ok=True)
+                except OSError: # Still memory-mapped (Windows)
+                    pass
+        else:
+            index_vol_fpath.touch() # Most recently used
 
-        if self._raw_atlas_rgba_volume is None or self._raw_atlas_rgba_volume[0] != atlas_rgba_vol_id:
+        return ((self.atlas_full_name(bg_atlas), subs_stride), np.load(index_vol_fpath, mmap_mode='r'))
 
-            # Subsample
-            self.ref_atlas = self.bg_atlas.reference[::subs_stride, ::subs_stride, ::subs_stride]
-        
-            atlas_norm_func = plt.Normalize()
-            rgba_vol = plt.cm.Greys_r(atlas_norm_func(self.ref_atlas)) * 255
-            rgba_vol[:, :, :, 3] = self.get_user_param('alpha') * 255
-            rgba_vol[:, :, :, 3][rgba_vol[:, :, :, 0] < self.get_user_param('black_threshold')] = 0 # Set black regions to transparent
+    @property
+    def atlas_lut(self):
+        """ (256, 4) uint8 greyscale lookup table with the atlas opacity, black regions are transparent """
+        lut = colormap_lut('Greys_r', alpha=self.get_user_param('alpha') * 255)
+        lut[lut[:, 0] < self.get_user_param('black_threshold'), 3] = 0 # Set black regions to transparent
+        return lut
 
-            self._raw_atlas_rgba_volume = (atlas_rgba_vol_id, rgba_vol)
-            del rgba_vol
+    @property
+    def raw_atlas_rgba_volume(self):
+        return apply_colormap_lut(self.atlas_index_volume, self.atlas_lut)
 
-        return self._raw_atlas_rgba_volume[1]
+    @property
+    def highlighted_structures(self):
+        """ [[structure name, hemisphere, [r, g, b]], ...] highlighted structures (copy of the persisted list) """
+        return [list(highlighted_structure) for highlighted_structure in self.get_user_param('highlighted_structures')]
 
     @property
-    def raw_highlighted_structure_volume(self):
-        selected_hemisphere = self.get_user_param('highlighted_structure_hemisphere')
-        selected_structure = self.get_user_param('highlighted_structure')
-        subs_stride = self.get_user_param('subsampling_stride')
-        structure_acronym = self.bg_atlas_structures[selected_structure]
+    def highlighted_voxels(self):
+        """ (flat indices of the highlighted voxels in the rendered volume, their labels: 1-based indices in highlighted_structures) """
+        highlighted_structures = [(structure_name, hemisphere) for structure_name, hemisphere, _ in self.highlighted_structures]
+        render_id = self.current_render_level if self.level_of_detail else self.rendered_stride
+        highlighted_voxels_id = f'{self.bg_atlas.atlas_name}.{render_id}.{highlighted_structures}'
+
+        if self._highlighted_voxels is None or self._highlighted_voxels[0] != highlighted_voxels_id:
+            self.parent_viewer.statusBar().showMessage('Loading atlas highlighted structures')
+            highlighted_voxels, highlight_labels = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.uint16)]
+            for highlight_label, (structure_name, selected_hemisphere) in enumerate(highlighted_structures, 1):
+                structure_acronym = self.bg_atlas_structures.get(structure_name)
+                if structure_acronym is None:
+                    continue
+                structure_ids = [self.bg_atlas.structures[acronym]['id'] for acronym in [structure_acronym] + list(self.bg_atlas.get_structure_descendants(structure_acronym))]
+                hemisphere = int(selected_hemisphere) if selected_hemisphere in ('1', '2') else None
+                if self.level_of_detail: # Blocks of the cropped pyramid level holding structure voxels
+                    level, crop_start, crop_stop = self.current_render_level
+                    structure_voxels = self.structure_index.block_voxels(structure_ids, level, crop_start, crop_stop, hemisphere=hemisphere)
+                else:
+                    structure_voxels = self.structure_index.subsampled_voxels(structure_ids, stride=self.rendered_stride, hemisphere=hemisphere)
+                highlighted_voxels.append(structure_voxels)
+                highlight_labels.append(np.full(len(structure_voxels), highlight_label, dtype=np.uint16))
+            self._highlighted_voxels = (highlighted_voxels_id, (np.concatenate(highlighted_voxels), np.concatenate(highlight_labels)))
+            self.parent_viewer.statusBar().clearMessage()
 
-        if structure_acronym is None:
-            return None
-        else:
-            highlighted_structure_vol_id = f'{self.bg_atlas.atlas_name}.{subs_stride}.{structure_acronym}.{selected_hemisphere}'
-
-            if self._raw_highlighted_structure_volume is None or self._raw_highlighted_structure_volume[0] != highlighted_structure_vol_id:
-                self.parent_viewer.statusBar().showMessage('Loading atlas highlighted structure')
-                if selected_hemisphere == 'Both':
-                    hemi_struct = self.bg_atlas.get_structure_mask(structure_acronym)
-                elif selected_hemisphere == '1' or selected_hemisphere == '2':
-                    hemi_struct = self.bg_atlas.get_structure_mask(structure_acronym) * (self.bg_atlas.hemispheres == int(selected_hemisphere)).astype(int)
-                self._raw_highlighted_structure_volume = (
-                    highlighted_structure_vol_id,
-                    hemi_struct[::subs_stride, ::subs_stride, ::subs_stride]
-                )
-                self.parent_viewer.statusBar().clearMessage()
-
-            return self._raw_highlighted_structure_volume[1]
+        return self._highlighted_voxels[1]
+
+    @property
+    def highlight_lut(self):
+        """ (n_highlighted_structures + 1, 4) uint8 label -> RGBA lookup table (label 0 unused) """
+        highlighted_structures = self.highlighted_structures
+        highlight_lut = np.zeros((len(highlighted_structures) + 1, 4), dtype=np.uint8)
+        if len(highlighted_structures) > 0:
+            highlight_lut[1:, :3] = [color for _, _, color in highlighted_structures]
+            highlight_lut[1:, 3] = np.uint8(self.get_user_param('alpha') * 255)
+        return highlight_lut
 
     @property
     def atlas_resolution(self):
-        subs_stride = self.get_user_param('subsampling_stride')
-        atlas_res = subs_stride * np.array(self.bg_atlas.resolution) * 1e-6 # um to meters
+        atlas_res = self.rendered_stride * np.array(self.bg_atlas.resolution) * 1e-6 # um to meters
         return atlas_res
     
     @property
     def brain_atlas_tmat(self):
         if self._brain_atlas_tmat is None:
-            resolution = self.atlas_resolution
-            atlas_shape = self.raw_atlas_rgba_volume.shape
-            self._brain_atlas_tmat = af_tr.scale_mat(resolution)
-            self._brain_atlas_tmat = self._brain_atlas_tmat @ af_tr.translat_mat('x', -(resolution[0] * atlas_shape[0]) / 2)
-            self._brain_atlas_tmat = self._brain_atlas_tmat @ af_tr.translat_mat('y', -(resolution[1] * atlas_shape[1]) / 2)
-            self._brain_atlas_tmat = self._brain_atlas_tmat @ af_tr.translat_mat('z', -(resolution[2] * atlas_shape[2]) / 2)
-
-            atlas_transforms_matrices = af_tr_from_str.transform_matrices_from_str(
+            if self.level_of_detail:
+                level, crop_start, _ = self.current_render_level
+                self._brain_atlas_tmat = self._lod_base_tmat(level, crop_start)
+            else:
+                resolution = self.atlas_resolution
+                atlas_shape = self.atlas_shape
+                self._brain_atlas_tmat = af_tr.scale_mat(resolution)
+                self._brain_atlas_tmat = self._brain_atlas_tmat @ af_tr.translat_mat('x', -(resolution[0] * atlas_shape[0]) / 2)
+                self._brain_atlas_tmat = self._brain_atlas_tmat @ af_tr.translat_mat('y', -(resolution[1] * atlas_shape[1]) / 2)
+                self._brain_atlas_tmat = self._brain_atlas_tmat @ af_tr.translat_mat('z', -(resolution[2] * atlas_shape[2]) / 2)
+
+            self._brain_atlas_tmat = self._brain_atlas_tmat @ af_tr_from_str.transform_mat_from_str(
                 self.get_user_param('atlas_transforms_str')
             )
-
-            for tr_mat in atlas_transforms_matrices:
-                self._brain_atlas_tmat = self._brain_atlas_tmat @ tr_mat
         
         # Apply anatomical landmark calibration transformation
         anatomically_calibrated_brain_atlas_tmat = self._brain_atlas_tmat @ self.parent_viewer.anat_calib.landmarks_calib_tmat
@@ -318,13 +646,19 @@ class BrainAtlas(Module):
 
         self.atlas_selector.currentIndexChanged.connect(self._add_atlas)
 
-    def update_structure_selector(self):
-        sorted_structure_dict = dict(sorted({f"{struct['name']} ({struct['acronym']})": struct['acronym'] for struct in self.bg_atlas.structures_list}.items()))
-        self.bg_atlas_structures = {
+    @staticmethod
+    def structure_selector_items(bg_atlas):
+        """ {selector item: structure acronym} sorted by structure name """
+        sorted_structure_dict = dict(sorted({f"{struct['name']} ({struct['acronym']})": struct['acronym'] for struct in bg_atlas.structures_list}.items()))
+        return {
             **{'Select structure': None},
             **sorted_structure_dict
         }
 
+    def update_structure_selector(self, structures=None):
+        """ structures: precomputed structure_selector_items of the loaded atlas """
+        self.bg_atlas_structures = structures if structures is not None else self.structure_selector_items(self.bg_atlas)
+
         self.structure_selector.clear()
         self.structure_selector.setEnabled(True)
         self.structure_selector.addItems(self.bg_atlas_structures.keys())
@@ -339,57 +673,57 @@ class BrainAtlas(Module):
         self.hemisphere_selector.setCurrentText(structure_hemisphere)
 
         self.highlight_structure_btn.setEnabled(True)
+        self.clear_highlights_btn.setEnabled(True)
 
     def update_atlas_user_params_editors(self):
         self.subsampling_stride_editor.setText(str(self.get_user_param('subsampling_stride')))
+        self.level_of_detail_checkbox.blockSignals(True)
+        self.level_of_detail_checkbox.setChecked(self.level_of_detail)
+        self.level_of_detail_checkbox.blockSignals(False)
+        self.subsampling_stride_editor.setEnabled(not self.level_of_detail)
         self.atlas_transform_editor.setText(self.get_user_param('atlas_transforms_str'))
 
     def update_atlas_transform(self):
         self.brain_atlas_tmat = None
-        self.atlas_voxel_coordinates = None # Reset voxels coordinates
         if self.atlas_glvol is not None:
             self.atlas_glvol.resetTransform()
             self.atlas_glvol.applyTransform(pyqtg.QMatrix4x4(self.brain_atlas_tmat.T.ravel()), local=False)
 
-    @property
-    def atlas_voxel_coordinates(self):
-        # Check if tmat has changed since last update
-        if self._tmat_version_hash != object_list_hash([self.brain_atlas_tmat]):
-            self._atlas_voxel_coordinates = None # Recompute if it is
-        if self._atlas_voxel_coordinates is None:
-            atlas_shape = self.ref_atlas.shape
-            voxel_coords = np.mgrid[0:atlas_shape[0], 0:atlas_shape[1], 0:atlas_shape[2]]
-            raveled_coords = voxel_coords.reshape(3, -1).T
-
-            # Apply atlas spatial transformations
-            self.update_atlas_transform()
-            raveled_coords_4by = np.vstack([raveled_coords.T, np.ones(len(raveled_coords))]).T
-            transformed_coords = raveled_coords_4by @ self.brain_atlas_tmat
-            self._atlas_voxel_coordinates = transformed_coords[:, :3]
-            self._tmat_version_hash = object_list_hash([self.brain_atlas_tmat])
-        return self._atlas_voxel_coordinates
-    
-    @atlas_voxel_coordinates.setter
-    def atlas_voxel_coordinates(self, value):
-        self._atlas_voxel_coordinates = value
-
     def _highlight_structure_btn_pressed(self):
         selected_structure = self.structure_selector.currentText()
         selected_hemisphere = self.hemisphere_selector.currentText()
         self.set_user_param('highlighted_structure', selected_structure)
         self.set_user_param('highlighted_structure_hemisphere', selected_hemisphere)
+
+        # Toggle the selected structure / hemisphere in the highlighted structures
+        highlighted_structures = self.highlighted_structures
+        highlighted_keys = [(structure_name, hemisphere) for structure_name, hemisphere, _ in highlighted_structures]
+        if (selected_structure, selected_hemisphere) in highlighted_keys:
+            highlighted_structures.pop(highlighted_keys.index((selected_structure, selected_hemisphere)))
+        elif self.bg_atlas_structures.get(selected_structure) is not None:
+            colormap = plt.get_cmap(self.HIGHLIGHT_COLORMAP)
+            colors = [[int(cc) for cc in colormap(ii, bytes=True)[:3]] for ii in range(colormap.N)]
+            used_colors = [color for _, _, color in highlighted_structures]
+            color = next((color for color in colors if color not in used_colors), colors[len(highlighted_structures) % colormap.N]) # First unused color
+            highlighted_structures.append([selected_structure, selected_hemisphere, color])
+        self.set_user_param('highlighted_structures', highlighted_structures)
+        self.update_rendered_object()
+
+    def _clear_highlights_btn_pressed(self):
+        self.set_user_param('highlighted_structures', [])
         self.update_rendered_object()
 
     def highlight_structure(self):
-        if self.raw_highlighted_structure_volume is not None:
-            self._atlas_rgba_volume[self.raw_highlighted_structure_volume != 0, 0] = 200
-            self._atlas_rgba_volume[self.raw_highlighted_structure_volume != 0, 1] = 0
-            self._atlas_rgba_volume[self.raw_highlighted_structure_volume != 0, 2] = 0
-            self._atlas_rgba_volume[self.raw_highlighted_structure_volume != 0, 3] = self.get_user_param('alpha') * 255
+        highlighted_voxels, highlight_labels = self.highlighted_voxels
+        if len(highlighted_voxels) > 0: # All structures colored in a single label -> RGBA lookup
+            self._atlas_rgba_volume.reshape(-1, 4)[highlighted_voxels] = self.highlight_lut[highlight_labels]
 
     @property
     def atlas_rgba_volume(self):
-        self._atlas_rgba_volume = self.raw_atlas_rgba_volume.copy()
+        atlas_index_volume = self.atlas_index_volume
+        if self._atlas_rgba_volume is None or self._atlas_rgba_volume.shape[:3] != atlas_index_volume.shape:
+            self._atlas_rgba_volume = np.empty(atlas_index_volume.shape + (4,), dtype=np.uint8)
+        apply_colormap_lut(atlas_index_volume, self.atlas_lut, out=self._atlas_rgba_volume) # RGBA buffer reused across renders
 
         self.compute_slicing_plane()
 
@@ -400,14 +734,15 @@ class BrainAtlas(Module):
         slicing_plane_pts = self.parent_viewer.slicing_plane_3pts
         if slicing_plane_pts is not None:
             if not self.parent_viewer.postpone_slicing_plane_computation or self._slicing_plane_mask is None:
-                raveled_mask = np.dot(
-                    self.atlas_voxel_coordinates - slicing_plane_pts[0],
-                    np.cross(
+                self._slicing_plane_mask = half_space_mask(
+                    self.brain_atlas_tmat,
+                    self.atlas_shape,
+                    plane_origin=slicing_plane_pts[0],
+                    plane_normal=np.cross(
                         slicing_plane_pts[1] - slicing_plane_pts[0],
-                        slicing_plane_pts[2] - slicing_plane_pts[0]
-                    )) > 0
-                
-                self._slicing_plane_mask = raveled_mask.reshape(self.ref_atlas.shape).astype(int) * self.get_user_param('alpha') * 255
+                        slicing_plane_pts[2] - slicing_plane_pts[0]),
+                    n_threads=self.SLICING_PLANE_N_THREADS)
 
             self._atlas_rgba_volume[:, :, :, 3] = self._slicing_plane_mask
+            self._atlas_rgba_volume[:, :, :, 3] *= np.uint8(self.get_user_param('alpha') * 255)
             self._atlas_rgba_volume[:, :, :, 3][self._atlas_rgba_volume[:, :, :, 0] == 0] = 0
\ No newline at end of file
@@ -117,6 +117,18 @@ class RefImageAsPlane(Module):
             self.ref_image_glitem.resetTransform()
             self.ref_image_glitem.applyTransform(pyqtg.QMatrix4x4(self.ref_image_tmat.T.ravel()), local=False)
     
+    def on_cached_params_changed(self, param_ids):
+        if 'last_used_img_name' in param_ids or (self.ref_image_name is not None and f'{self.ref_image_name}.file_path' in param_ids):
+            # Other image -> reload (the cached image name is left untouched)
+            if self.ref_image_glitem is not None:
+                self.parent_viewer.gl_view.removeItem(self.ref_image_glitem)
+                self.ref_image_glitem = None
+            self.ref_image_name = None
+            self.add_rendered_object()
+        elif self.ref_image_glitem is not None and any(param_id.startswith(f'{self.ref_image_name}.') for param_id in param_ids):
+            self._update_editors()
+            self.update_img_transform()
+
     # --- Module specific attributes ---
 
     def _parse_editor(self, src_editor, param_name, unit):
@@ -32,7 +32,8 @@ class TrimeshHandler:
         if self.stl_item_name is not None:
             param_value = self.parent_viewer.cache.get_attr(
                 ['mesh_handler', self.stl_item_name, param_name],
-                default_value = default_value
+                default_value = default_value,
+                call_site = f'{self.__class__.__name__} {self.stl_item_name}'
             )
         else:
             param_value = default_value
@@ -43,9 +44,18 @@ class TrimeshHandler:
         if self.stl_item_name is not None:
             self.parent_viewer.cache.set_attr(
                 ['mesh_handler', self.stl_item_name, param_name],
-                param_value
+                param_value,
+                call_site = f'{self.__class__.__name__} {self.stl_item_name}'
             )
 
+    def on_cached_params_changed(self, param_names):
+        """ Called when cached parameters of the mesh item were changed from outside of it (eg. by another process) """
+        if 'file_path' in param_names:
+            self.raw_stl_item_mesh = None # Reload mesh
+        self.stl_item_mesh = None # Reapply transforms
+        if self.stl_glitem is not None:
+            self.update_rendered_object()
+
     @property
     def stl_item_tmat(self):
         if self._stl_item_tmat is None:
@@ -55,10 +55,28 @@ class InternalConsoleModule(Module):
         self.clear_console_btn.clicked.connect(self.clear_console)
         self.dock_layout.addWidget(self.clear_console_btn, 1, 0, 1, 1)
 
+        self.profile_settings_btn = pyqtw.QPushButton('Profile settings access')
+        self.profile_settings_btn.setCheckable(True)
+        self.profile_settings_btn.toggled.connect(self._on_profile_settings_btn_toggled)
+        self.dock_layout.addWidget(self.profile_settings_btn, 2, 0, 1, 1)
+
     # --- Module specific attributes ---
     
     def clear_console(self):
         self.console_widget.clear()
+
+    def _on_profile_settings_btn_toggled(self, checked):
+        profiler = self.parent_viewer.cache.profiler
+        if checked:
+            profiler.start()
+            print('Profiling settings access...')
+        else:
+            profiler.stop()
+            print(profiler.report())
+            # Stored in a subfolder so that profiles are not listed as settings files
+            profile_fpath = self.parent_viewer.cache.cache_dir / 'profiles' / f'settings_access_{time.strftime("%Y%m%d_%H%M%S")}.json'
+            profiler.dump_json(profile_fpath)
+            print(f'Settings access profile saved to {profile_fpath}')
     
     def _on_console_dock_visibility_change(self, visible):
         if visible:
@@ -41,14 +41,16 @@ class Module:
             default_value = self._DEFAULT_PARAMS[param_name]
         param_value = self.parent_viewer.cache.get_attr(
             [self.module_id, *additional_identifiers, param_name],
-            default_value = default_value
+            default_value = default_value,
+            call_site = self.__class__.__name__
         )
         return param_value
 
     def set_user_param(self, param_name, param_value, additional_identifiers=[]):
         self.parent_viewer.cache.set_attr(
             [self.module_id, *additional_identifiers, param_name],
-            param_value
+            param_value,
+            call_site = self.__class__.__name__
         )
 
     # --- Required module attributes ---
@@ -69,6 +71,11 @@ class Module:
         """ Called for the removal of module-specific elements from the 3D viewer """
         pass
 
+    def on_cached_params_changed(self, param_ids):
+        """ Called when cached parameters of the module were changed from outside of it (eg. by another process)
+        param_ids: ids of the changed parameters, relative to the module id """
+        self.update_rendered_object()
+
     # @propertys
     # def status_bar_widget_list(self):
     #     return []
\ No newline at end of file
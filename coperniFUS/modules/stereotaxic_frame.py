@@ -1,5 +1,6 @@
 from coperniFUS import *
 from coperniFUS.modules.module_base import Module
+from coperniFUS.modules._kinematics import KinematicTree, ReachabilityMap, damped_least_squares_steps
 from coperniFUS.modules._stereotaxic_frame_helper_classes import *
 from coperniFUS.modules.armatures.base_armature import Armature
 from coperniFUS.modules.armatures.mesh_armatures import STLMeshArmature, TrimeshScriptArmature, STLMeshBooleanArmature, STLMeshConvexHull
@@ -39,16 +40,23 @@ class StereotaxicFrame(Module):
         }
     }
 
+    SWEEP_CHUNK_SIZE = 2**15 # Configurations per batched forward kinematics pass in sweep_end_transforms (bounds memory use)
+    IK_FD_STEP = 1e-3 # Finite differences step of the inverse kinematics Jacobians (fraction of the params _edit_increment)
+    REACHABILITY_N_INCREMENTS = 20 # Swept increments on each side of the current value of params without '_limits'
+    REACHABILITY_GRID_LEVEL = 2 # Reachability maps voxels span 2**REACHABILITY_GRID_LEVEL atlas voxels along each axis
+
     def __init__(self, parent_viewer, **kwargs) -> None:
         super().__init__(parent_viewer, 'sterotax_frame', **kwargs)
 
-        self._armatures_objects = {
-            armature_display_name: eval(armature_cls_name)(
+        self.kinematic_tree = KinematicTree() # Cached joints transform matrices of all the armatures
+        self.reachability_map = None
+        self.reachability_glitem = None
+        self._armatures_objects = {} # Filled in order, armatures may read the transforms of the previous ones while being instantiated
+        for armature_display_name, armature_cls_name in self.get_user_param('_steframe_armatures_objects_clsnames').items():
+            self._armatures_objects[armature_display_name] = eval(armature_cls_name)(
                 armature_display_name=armature_display_name,
                 parent_viewer=self.parent_viewer,
                 stereotax_frame_instance=self)
-            for armature_display_name, armature_cls_name in self.get_user_param('_steframe_armatures_objects_clsnames').items()
-        }
 
     # --- Required module attributes ---
 
@@ -104,6 +112,12 @@ class StereotaxicFrame(Module):
         self.armature_parameters_groupbox.setLayout(armature_parameters_layout)
         self.dock_layout.addWidget(self.armature_parameters_groupbox, 3, 0, 1, 2) # Y, X, h, w
 
+        # Reachability map of the selected armature
+        self.reachability_map_btn = pyqtw.QPushButton('Show reachability map')
+        self.reachability_map_btn.setCheckable(True)
+        self.reachability_map_btn.toggled.connect(self._on_reachability_map_btn_toggled)
+        self.dock_layout.addWidget(self.reachability_map_btn, 4, 0, 1, 2) # Y, X, h, w
+
         # Remove padding
         self.armature_parameters_groupbox.setContentsMargins(0, 20, 0, 0)
         self.armature_parameters_stacked_widget.setContentsMargins(0, 0, 0, 0)
@@ -273,9 +287,10 @@ class StereotaxicFrame(Module):
                 uneval_armature_config_dict_str=nested_dict_formatter(armature_object.uneval_armature_config_dict),
             )
             if self.armature_editor_popup.exec():
-                armature_object.armature_config_csts = self.armature_editor_popup.edited_armature_config_csts
-                armature_object.uneval_armature_config_dict = self.armature_editor_popup.edited_uneval_armature_config_dict
-                armature_object.armature_config_dict = None # Reset evaluated armature_config_dict
+                armature_object.armature_config_csts = self.armature_editor_popup.edited_armature_config_csts # Re-evaluates dependent args only
+                if self.armature_editor_popup.edited_uneval_armature_config_dict != armature_object.uneval_armature_config_dict:
+                    armature_object.uneval_armature_config_dict = self.armature_editor_popup.edited_uneval_armature_config_dict
+                    armature_object.armature_config_dict = None # Reset evaluated armature_config_dict
                 self.parent_viewer.statusBar().showMessage('Applying armature configuration', self.parent_viewer._STATUS_BAR_MSG_TIMEOUT)
 
                 self._update_armature_parameters_widgets_on_configuration_change(armature_object)
@@ -353,13 +368,242 @@ class StereotaxicFrame(Module):
         unsorted_hierarchy_dict = self._get_nested_dict_inheritance(self.get_user_param('_steframe_arch_dict'))
         self.stereotaxic_frame_hierarchy = {k: v[0] for k, v in sorted(unsorted_hierarchy_dict.items(), key=lambda item: item[1][1])}
 
+        # Only re-parented armatures subtrees are marked dirty, transforms are recomputed on read
+        for node_id in self.kinematic_tree.node_ids(): # Drop removed armatures joints
+            if node_id in self.kinematic_tree and node_id[0] not in self._armatures_objects:
+                self.kinematic_tree.remove_node(node_id)
+        self.update_kinematic_tree()
         for child_armature_name, parent_armature_name in self.stereotaxic_frame_hierarchy.items():
-            # stime = time.time()
             if child_armature_name in self._armatures_objects:
+                child_origin_node_id = self._armatures_objects[child_armature_name]._kinematic_node_id('_origin')
                 if parent_armature_name is not None and parent_armature_name in self._armatures_objects:
-                    self._armatures_objects[child_armature_name].parent_transform_mat = self._armatures_objects[parent_armature_name].end_transform_mat
+                    self.kinematic_tree.set_parent(child_origin_node_id, self._armatures_objects[parent_armature_name]._kinematic_node_id('_end'))
                 else:
-                    self._armatures_objects[child_armature_name].parent_transform_mat = None
+                    self.kinematic_tree.set_parent(child_origin_node_id, None)
+
+    def update_kinematic_tree(self):
+        """ Registers the joints of new / reconfigured armatures in the kinematic tree """
+        for arm_obj in self._armatures_objects.values():
+            arm_obj.update_kinematic_tree()
+
+    def armature_ancestors_chain(self, armature_display_name):
+        """ Armatures objects from the root of the hierarchy down to armature_display_name """
+        self.update_kinematic_tree()
+        armatures_chain = []
+        while armature_display_name is not None:
+            armature_object = self._armatures_objects[armature_display_name]
+            armatures_chain.insert(0, armature_object)
+            parent_node_id = self.kinematic_tree.parent_id(armature_object._kinematic_node_id('_origin'))
+            armature_display_name = None if parent_node_id is None else parent_node_id[0]
+        return armatures_chain
+
+    def sweep_end_transforms(self, armature_display_name, params_values, grid=True):
+        """ End transform matrices of armature_display_name for many joint params configurations, computed with
+        batched forward kinematics (SWEEP_CHUNK_SIZE configurations at once) instead of one compute_armature_coords call per configuration
+        params_values: {(armature_display_name, param label or (joint_id, transform_id)): values} params of the armature or of its parents
+        grid: True -> all the combinations of the params values, returns (n_param_1, ..., n_param_k, 4, 4) matrices
+              False -> params values are broadcast together (eg. N configurations), returns (*broadcast_shape, 4, 4) matrices
+        Tooltip positions are found in [..., 3, :3] """
+        armatures_chain = self.armature_ancestors_chain(armature_display_name)
+        chain_armature_names = [arm_obj.armature_display_name for arm_obj in armatures_chain]
+
+        swept_params = [] # [(armature_display_name, (joint_id, transform_id))]
+        for swept_armature_name, param in params_values.keys():
+            if swept_armature_name not in chain_armature_names:
+                raise ValueError(f'{swept_armature_name} is neither {armature_display_name} nor one of its parent armatures')
+            swept_params.append((swept_armature_name, self._armatures_objects[swept_armature_name].joint_param_key(param)))
+
+        if grid:
+            swept_values = [np.ravel(np.asarray(values, dtype=float)) for values in params_values.values()]
+            sweep_shape = tuple(len(values) for values in swept_values)
+        else:
+            swept_values = np.broadcast_arrays(*[np.asarray(values, dtype=float) for values in params_values.values()])
+            sweep_shape = swept_values[0].shape if len(swept_values) > 0 else ()
+            swept_values = [np.ravel(values) for values in swept_values]
+        n_configs = int(np.prod(sweep_shape))
+
+        end_tmats = np.empty((n_configs, 4, 4))
+        for chunk_start in range(0, n_configs, self.SWEEP_CHUNK_SIZE):
+            config_indices = np.arange(chunk_start, min(chunk_start + self.SWEEP_CHUNK_SIZE, n_configs))
+            if grid and len(swept_values) > 0: # Params values indices of each combination
+                values_indices = np.unravel_index(config_indices, sweep_shape)
+            else:
+                values_indices = [config_indices] * len(swept_values)
+
+            parent_tmats = None # Current transforms are kept upstream of the first swept armature
+            for arm_obj in armatures_chain:
+                args_values = {
+                    transform_key: values[indices]
+                    for (swept_armature_name, transform_key), values, indices in zip(swept_params, swept_values, values_indices)
+                    if swept_armature_name == arm_obj.armature_display_name
+                }
+                if len(args_values) > 0 or parent_tmats is not None:
+                    parent_tmats = arm_obj.batched_end_transform_mats(args_values, parent_transform_mats=parent_tmats)
+            if parent_tmats is None: # Nothing swept
+                parent_tmats = armatures_chain[-1].end_transform_mat
+            end_tmats[config_indices] = parent_tmats
+
+        return end_tmats.reshape(*sweep_shape, 4, 4)
+
+    def solve_inverse_kinematics(self, armature_display_name, target_positions, target_directions=None, params=None, targets_tmat=None,
+                                 direction_axis='z', direction_weight=0.01, tolerance=1e-6, max_iterations=50, damping=1e-3,
+                                 snap_to_increments=False, raise_errors=False):
+        """ Joint params values bringing the end of armature_display_name onto M target positions (solved all at once)
+        Damped least-squares iterations, Jacobians are estimated by finite differences of batched forward kinematics (see sweep_end_transforms)
+        target_positions: (M, 3) or (3,) points, target_directions: optional (M, 3) or (3,) directions of the armature end direction_axis
+        params: [(armature_display_name, param label or (joint_id, transform_id))] of the armature or of its parents,
+                defaults to its editable translations (+ editable rotations if target_directions is given)
+        targets_tmat: (4, 4) transform of the targets coordinates to the frame coordinates (eg. atlas brain_atlas_tmat for voxel coordinates)
+        direction_weight: length (m) weighting the direction residuals, tolerance: residuals norm (m) below which a target is reached
+        Params are scaled by their _edit_increment and clipped to their optional '_limits': [min, max] (None for no bound)
+        snap_to_increments: rounds the solution to a whole number of _edit_increment from the current params values
+        returns ({(armature_display_name, param): (M,) values}, (M,) position errors) """
+        target_positions = np.atleast_2d(np.asarray(target_positions, dtype=float))
+        if target_directions is not None:
+            target_directions = np.broadcast_to(np.atleast_2d(np.asarray(target_directions, dtype=float)), target_positions.shape)
+        if targets_tmat is not None:
+            target_positions = af_tr.apply_tmats(targets_tmat, target_positions)
+            if target_directions is not None:
+                target_directions = target_directions @ np.asarray(targets_tmat)[:3, :3]
+        if target_directions is not None:
+            target_directions = target_directions / np.linalg.norm(target_directions, axis=-1, keepdims=True)
+        direction_axis_index = 'xyz'.index(direction_axis)
+
+        if params is None:
+            params = [
+                (armature_display_name, param_label)
+                for param_label, (_, transform_id) in self._armatures_objects[armature_display_name].editable_joint_params.items()
+                if target_directions is not None or transform_id.startswith('translation')
+            ]
+        param_keys = [(param_armature_name, self._armatures_objects[param_armature_name].joint_param_key(param)) for param_armature_name, param in params]
+        transform_dicts = [
+            self._armatures_objects[param_armature_name].armature_config_dict['_armature_joints'][joint_id][transform_id]
+            for param_armature_name, (joint_id, transform_id) in param_keys
+        ]
+        initial_values = np.array([transform_dict['args'][1] for transform_dict in transform_dicts], dtype=float)
+        increments = np.array([transform_dict.get('_edit_increment', 1) for transform_dict in transform_dicts], dtype=float)
+        limits = [transform_dict.get('_limits', [None, None]) for transform_dict in transform_dicts]
+        lower_limits = np.array([-np.inf if lim[0] is None else lim[0] for lim in limits], dtype=float)
+        upper_limits = np.array([np.inf if lim[1] is None else lim[1] for lim in limits], dtype=float)
+
+        def end_residuals(params_values):
+            # (M, K, P) params values (K configurations per target) -> (M, K, R) position (+ weighted direction) residuals
+            end_tmats = self.sweep_end_transforms(
+                armature_display_name,
+                {param_key: params_values[..., ii] for ii, param_key in enumerate(param_keys)},
+                grid=False)
+            residuals = end_tmats[..., 3, :3] - target_positions[:, None, :]
+            if target_directions is not None:
+                direction_residuals = direction_weight * (end_tmats[..., direction_axis_index, :3] - target_directions[:, None, :])
+                residuals = np.concatenate([residuals, direction_residuals], axis=-1)
+            return residuals
+
+        n_targets, n_params = len(target_positions), len(param_keys)
+        params_values = np.tile(np.clip(initial_values, lower_limits, upper_limits), (n_targets, 1))
+        fd_steps = np.vstack([np.zeros(n_params), np.eye(n_params) * self.IK_FD_STEP]) * increments # Base configuration + one step per param
+        for iteration in range(max_iterations + 1):
+            residuals = end_residuals(params_values[:, None, :] + fd_steps)
+            converged = np.linalg.norm(residuals[:, 0], axis=-1) <= tolerance
+            if np.all(converged) or iteration == max_iterations:
+                break
+            jacobians = np.swapaxes(residuals[:, 1:] - residuals[:, :1], 1, 2) / self.IK_FD_STEP # (M, R, P) in increment units
+            steps = damped_least_squares_steps(jacobians, residuals[:, 0], damping=damping) * increments
+            params_values = np.clip(params_values + np.where(converged[:, None], 0, steps), lower_limits, upper_limits)
+
+        if snap_to_increments:
+            params_values = initial_values + np.round((params_values - initial_values) / increments) * increments
+            params_values = np.clip(params_values, lower_limits, upper_limits)
+            residuals = end_residuals(params_values[:, None, :])
+        position_errors = np.linalg.norm(residuals[:, 0, :3], axis=-1)
+
+        if not np.all(converged) and not snap_to_increments:
+            err_msg = f'Inverse kinematics of {armature_display_name} did not converge for {np.count_nonzero(~converged)} / {n_targets} targets (max position error {position_errors.max():.3g})'
+            if raise_errors:
+                raise ValueError(err_msg)
+            else:
+                print(err_msg)
+        return {param: params_values[:, ii] for ii, param in enumerate(params)}, position_errors
+
+    def reachability_params_ranges(self, armature_display_name, params=None):
+        """ {(armature_display_name, param): values} swept to build a reachability map, params default to the armature editable translations
+        Params are swept over their '_limits' (or REACHABILITY_N_INCREMENTS increments around their current value) by _edit_increment steps """
+        if params is None:
+            params = [
+                (armature_display_name, param_label)
+                for param_label, (_, transform_id) in self._armatures_objects[armature_display_name].editable_joint_params.items()
+                if transform_id.startswith('translation')
+            ]
+        params_ranges = {}
+        for param_armature_name, param in params:
+            joint_id, transform_id = self._armatures_objects[param_armature_name].joint_param_key(param)
+            transform_dict = self._armatures_objects[param_armature_name].armature_config_dict['_armature_joints'][joint_id][transform_id]
+            increment = transform_dict.get('_edit_increment', 1)
+            half_range = self.REACHABILITY_N_INCREMENTS * increment
+            lower_limit, upper_limit = transform_dict.get('_limits', [None, None])
+            lower_limit = transform_dict['args'][1] - half_range if lower_limit is None else lower_limit
+            upper_limit = transform_dict['args'][1] + half_range if upper_limit is None else upper_limit
+            params_ranges[(param_armature_name, param)] = np.arange(lower_limit, upper_limit + increment / 2, increment)
+        return params_ranges
+
+    def compute_reachability_map(self, armature_display_name, grid_tmat, grid_shape, params_ranges=None, use_cache=True):
+        """ Voxel grid (see ReachabilityMap) of the end positions of armature_display_name over all the combinations of params_ranges
+        params_ranges: {(armature_display_name, param): values} of the armature or of its parents (see reachability_params_ranges for defaults)
+        Maps are saved in the cache directory, keyed by a hash of the armatures configurations, swept ranges and voxel grid """
+        if params_ranges is None:
+            params_ranges = self.reachability_params_ranges(armature_display_name)
+        armatures_chain = self.armature_ancestors_chain(armature_display_name)
+        reachability_map_hash = object_list_hash(
+            [(arm_obj.armature_display_name, arm_obj.armature_config_dict) for arm_obj in armatures_chain]
+            + [item for param_key, values in params_ranges.items() for item in (param_key, np.asarray(values, dtype=float))] # Top level arrays -> hashed by value, not by (abbreviated) repr
+            + [np.asarray(grid_tmat, dtype=float), tuple(grid_shape)])
+        reachability_map_fpath = self.parent_viewer.cache.cache_dir / 'reachability' / f'{reachability_map_hash}.npz'
+        if use_cache and reachability_map_fpath.exists():
+            return ReachabilityMap.load(reachability_map_fpath)
+
+        reachability_map = ReachabilityMap(grid_tmat, grid_shape, params_ranges.keys())
+        end_positions = self.sweep_end_transforms(armature_display_name, params_ranges, grid=True)[..., 3, :3]
+        params_values = np.stack(np.meshgrid(*[np.asarray(values, dtype=float) for values in params_ranges.values()], indexing='ij'), axis=-1)
+        reachability_map.add_configurations(end_positions.reshape(-1, 3), params_values.reshape(-1, len(params_ranges)))
+
+        reachability_map_fpath.parent.mkdir(exist_ok=True)
+        reachability_map.save(reachability_map_fpath)
+        return reachability_map
+
+    def _on_reachability_map_btn_toggled(self, checked):
+        if self.reachability_glitem is not None:
+            self.parent_viewer.gl_view.removeItem(self.reachability_glitem)
+            self.reachability_glitem = None
+        if not checked:
+            return
+        armature_object = self.qtree_selected_armature_object
+        if armature_object is None or len(armature_object.editable_joint_params) == 0:
+            print('Select an armature with editable joints to compute its reachability map')
+            self.reachability_map_btn.setChecked(False)
+            return
+
+        # Grid aligned with the brain atlas voxels blocks (independent of the rendered level of detail -> stable cache key)
+        brain_atlas = self.parent_viewer.get_module_object_from_name('BrainAtlas')
+        grid_tmat, grid_shape = brain_atlas.atlas_grid(self.REACHABILITY_GRID_LEVEL)
+        self.reachability_map = self.compute_reachability_map(
+            armature_object.armature_display_name,
+            grid_tmat=grid_tmat,
+            grid_shape=grid_shape)
+        self.reachability_glitem = gl.GLScatterPlotItem(
+            pos=self.reachability_map.reachable_positions,
+            color=(0.2, 0.8, 0.4, 0.3),
+            size=3,
+            pxMode=True, # pt size expressed in pixels
+            glOptions='additive',
+        )
+        self.parent_viewer.gl_view.addItem(self.reachability_glitem, name=f'{armature_object.armature_display_name} reachability map')
+
+    def set_joint_params_values(self, params_values):
+        """ Sets {(armature_display_name, param label or (joint_id, transform_id)): value} joint params (eg. one solve_inverse_kinematics solution)
+        Call parent_viewer.update_armatures_rendered_view to render the new configuration """
+        for (param_armature_name, param), value in params_values.items():
+            armature_object = self._armatures_objects[param_armature_name]
+            joint_id, transform_id = armature_object.joint_param_key(param)
+            armature_object._update_armature_dict_value(['_armature_joints', joint_id, transform_id], float(value))
 
     def _on_checkbox_checked(self, item):
         # Armature column
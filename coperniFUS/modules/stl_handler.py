@@ -69,6 +69,12 @@ class StlHandlerGUI(StlHandler): # TODO Subclass Module
         self.stl_item_transform_editor.setText(str(self._DEFAULT_PARAMS['stl_item_transforms_str']))
         self.stl_item_transform_editor.setEnabled(False)
 
+    def on_cached_params_changed(self, param_names):
+        if 'stl_item_transforms_str' in param_names:
+            self.reset_stl_item_tmat()
+            self._update_item_transform_editor()
+        super().on_cached_params_changed(param_names)
+
     # --- Module specific attributes ---
 
     def parse_editor(self, src_editor, param_name, unit='', param_type='float'): # TODO move to Module
@@ -80,6 +86,8 @@ class StlHandlerGUI(StlHandler): # TODO Subclass Module
             edited_value = si_parse(edited_text_nounit.replace('u', 'µ'))
         else: # raw str
             edited_value = src_editor.text()
+        if param_name.endswith('transforms_str'):
+            self.parent_viewer.show_transform_str_errors(edited_value)
         self.set_stl_user_param(param_name, edited_value)
         self.parent_viewer.update_rendered_view()
 
@@ -87,12 +95,9 @@ class StlHandlerGUI(StlHandler): # TODO Subclass Module
     def stl_item_tmat(self):
         if self._stl_item_tmat is None:
             # Compute transform matrix from transforms str
-            transforms_matrices = af_tr_from_str.transform_matrices_from_str(
+            self._stl_item_tmat = af_tr_from_str.transform_mat_from_str(
                 self.get_stl_user_param('stl_item_transforms_str')
             )
-            self._stl_item_tmat = af_tr.scale_mat(1)
-            for tr_mat in transforms_matrices:
-                self._stl_item_tmat = self._stl_item_tmat @ tr_mat
 
         # Apply anatomical landmark calibration transformation if enabled
         if not self.get_stl_user_param('ignore_anatomical_landmarks_calibration'):
@@ -13,6 +13,8 @@ class Tooltip(Module):
         super().__init__(parent_viewer, 'tooltip', **kwargs)
 
         self._tooltip_tmat = None
+        self._versioned_tooltip_tmat = None # Last tooltip_tmat accounted for in tooltip_tmat_version
+        self._tooltip_tmat_version = 0
         self.x_glaxis = None
         self.y_glaxis = None
         self.z_glaxis = None
@@ -49,6 +51,12 @@ class Tooltip(Module):
             self.parent_viewer.gl_view.removeItem(self.z_glaxis)
             self.z_glaxis = None
     
+    def on_cached_params_changed(self, param_ids):
+        if 'tooltip_transforms_str' in param_ids:
+            self.tooltip_tmat = None
+            self.tooltip_transform_editor.setText(str(self.get_user_param('tooltip_transforms_str')))
+        super().on_cached_params_changed(param_ids)
+    
     def _init_status_bar_widget(self):
         seperator_ui_label = pyqtw.QLabel(' |')
         self.parent_viewer.statusBar().addPermanentWidget(seperator_ui_label)
@@ -75,6 +83,8 @@ class Tooltip(Module):
             edited_value = si_parse(edited_text_nounit.replace('u', 'µ'))
         else: # raw str
             edited_value = src_editor.text()
+        if param_name.endswith('transforms_str'):
+            self.parent_viewer.show_transform_str_errors(edited_value)
         self._on_editor_parsed(param_name, edited_value)
     
     # --- Module specific attributes ---
@@ -83,17 +93,24 @@ class Tooltip(Module):
     def tooltip_tmat(self):
         if self._tooltip_tmat is None:
             # Compute tooltip transform matrix from tooltip_transforms_str (status bar qedit)
-            transforms_matrices = af_tr_from_str.transform_matrices_from_str(
+            self._tooltip_tmat = af_tr_from_str.transform_mat_from_str(
                 self.get_user_param('tooltip_transforms_str')
             )
-            self._tooltip_tmat = af_tr.scale_mat(1)
-            for tr_mat in transforms_matrices:
-                self._tooltip_tmat = self._tooltip_tmat @ tr_mat
+        if self._tooltip_tmat is not self._versioned_tooltip_tmat:
+            if self._versioned_tooltip_tmat is None or not np.array_equal(self._tooltip_tmat, self._versioned_tooltip_tmat):
+                self._tooltip_tmat_version += 1
+            self._versioned_tooltip_tmat = self._tooltip_tmat
         return self._tooltip_tmat
     
     @tooltip_tmat.setter
     def tooltip_tmat(self, value):
         self._tooltip_tmat = value
+
+    @property
+    def tooltip_tmat_version(self):
+        """ Incremented whenever the value of tooltip_tmat changes """
+        self.tooltip_tmat # Accounts for pending changes
+        return self._tooltip_tmat_version
     
     def _update_transform(self):
         self.x_glaxis.resetTransform()
@@ -17,8 +17,11 @@ class Window(pyqtw.QMainWindow):
 
     _STATUS_BAR_MSG_TIMEOUT = 5000
 
-    def __init__(self, app, assets_dir_path='', **kwargs) -> None:
+    def __init__(self, app, assets_dir_path='', settings_backend='json', watch_settings_file=False, **kwargs) -> None:
         self.assets_dir_path = pathlib.Path(assets_dir_path)
+        self.settings_backend = settings_backend
+        self.watch_settings_file = watch_settings_file
+        self.settings_file_watcher = None
         self.app_kwargs = kwargs
         if app is not None: # ignore app when running tests
             self.app = app
@@ -29,6 +32,7 @@ class Window(pyqtw.QMainWindow):
 
         self.slicing_plane_direction = 1
         self.slicing_plane_name = None
+        self._slicing_plane_version = 0 # Incremented on slicing plane selection / reversal
         self._slicing_plane_def = np.array([
             [0, 0, 0, 1],
             [0, 1, 0, 1],
@@ -36,7 +40,7 @@ class Window(pyqtw.QMainWindow):
             [1, 0, 0, 1],
         ])
 
-        self.cache = CachedDataHandler('coperniFUSCache')
+        self.cache = CachedDataHandler('coperniFUSCache', backend=self.settings_backend)
 
         self.setWindowTitle("CoperniFUS")
         self.setGeometry(*self.cache.get_attr('viewer.geometry', default_value=[100, 100, 1500, 1000]))
@@ -44,6 +48,8 @@ class Window(pyqtw.QMainWindow):
         self.init_gui()
         self.init_menu_bar()
         self.init_modules()
+        if self.watch_settings_file:
+            self.init_settings_file_watcher()
         self.show()
         self.showMaximized()
 
@@ -153,6 +159,17 @@ class Window(pyqtw.QMainWindow):
             mm.update_rendered_object()
         self.stereotaxic_frame.update_rendered_object()
 
+    def update_armatures_rendered_view(self):
+        """ Lighter update_rendered_view for armature only edits (eg. knob increments), the other modules are only updated if the slicing plane moved """
+        slicing_plane_version = self.slicing_plane_version
+        self.stereotaxic_frame.update_armature_inheritance()
+        self.stereotaxic_frame.update_tooltip_on_armature()
+        if self.slicing_plane_version != slicing_plane_version:
+            self.update_rendered_view()
+        else:
+            self.tooltip.update_rendered_object()
+            self.stereotaxic_frame.update_rendered_object()
+
     def update_cached_settings_menu(self):
         self.cached_settings_menu.clear()
 
@@ -250,6 +267,7 @@ class Window(pyqtw.QMainWindow):
                     [0, 1, 0, 1],
                     [0, 0, 1, 1],
                 ])
+        self._slicing_plane_version += 1
         self.update_rendered_view()
 
     def reverse_plane_slicing_checked(self):
@@ -257,6 +275,7 @@ class Window(pyqtw.QMainWindow):
             self.slicing_plane_direction = -1
         else:
             self.slicing_plane_direction = 1
+        self._slicing_plane_version += 1
         self.update_rendered_view()
 
     @property
@@ -291,6 +310,13 @@ class Window(pyqtw.QMainWindow):
             sp_normal_vect = None
         return sp_normal_vect
     
+    @property
+    def slicing_plane_version(self):
+        """ Changes whenever slicing_plane_normal_vect may have changed (plane selection or tooltip transform if a plane is selected) """
+        if self.slicing_plane_name is None:
+            return (self._slicing_plane_version, None)
+        return (self._slicing_plane_version, self.tooltip.tooltip_tmat_version)
+
     @property
     def postpone_slicing_plane_computation(self):
         param_button_long_press = self.app.mouseButtons() == pyqtc.Qt.MouseButton.LeftButton
@@ -304,18 +330,45 @@ class Window(pyqtw.QMainWindow):
         else:
             module_dock.hide()
 
-    def switch_cached_settings_file(self, cached_settings_fname):
+    def switch_cached_settings_file(self, cached_settings_fname, full_reload=False):
+        """ Switches to another settings file of the cache directory.
+        Only the modules and armatures whose settings differ are refreshed (loaded atlases, meshes and simulation results are kept), unless
+        the set of armatures or meshes differs or full_reload is set, in which case every module is rebuilt """
         print('Switching to ', cached_settings_fname)
 
         if self.cache.is_cached_filename_existent(cached_settings_fname):
 
+            self.cache.flush() # Write pending changes of the current settings file
+            new_cache = CachedDataHandler(cache_dir_name='coperniFUSCache', cached_settings_fname=cached_settings_fname, backend=self.settings_backend)
+
+            armatures_clsnames_id = [self.stereotaxic_frame.module_id, '_steframe_armatures_objects_clsnames']
+            full_reload = full_reload or (
+                self.cache.peek_attr(armatures_clsnames_id, self.stereotaxic_frame._DEFAULT_PARAMS['_steframe_armatures_objects_clsnames'])
+                != new_cache.peek_attr(armatures_clsnames_id, self.stereotaxic_frame._DEFAULT_PARAMS['_steframe_armatures_objects_clsnames'])
+            )
+            # Meshes and armatures items are only refreshed if already loaded -> items missing from the current settings require a rebuild
+            for items_prefix in ['mesh_handler', 'armature']:
+                full_reload = full_reload or (
+                    set(self.cache.get_attr_unique_childs(items_prefix)) != set(new_cache.get_attr_unique_childs(items_prefix)))
+            full_reload = full_reload or (
+                self.cache.peek_attr(['mesh_handler', 'last_used_stl_item_name']) != new_cache.peek_attr(['mesh_handler', 'last_used_stl_item_name']))
+            if not full_reload:
+                changed_keys = self.cache.diff_attributes(new_cache)
+                self.cache.close()
+                self.cache = new_cache
+                print(f'{len(changed_keys)} changed settings')
+                self.apply_changed_settings_keys(changed_keys)
+                if self.settings_file_watcher is not None:
+                    self.init_settings_file_watcher()
+                return
+
             # Freeze wnidow to prevent user interactions during reloading
             self.setEnabled(False)
             pyqtw.QApplication.processEvents()
 
             # Set new cached file name
-            # self.cache.cached_settings_fname = cached_settings_fname
-            self.cache = CachedDataHandler(cache_dir_name='coperniFUSCache', cached_settings_fname=cached_settings_fname)
+            self.cache.close()
+            self.cache = new_cache
 
             # Clear rendered view
             self.clear_rendered_view()
@@ -336,6 +389,8 @@ class Window(pyqtw.QMainWindow):
 
             # Re-initialize modules
             self.init_modules()
+            if self.settings_file_watcher is not None:
+                self.init_settings_file_watcher()
 
             # Freeze wnidow to prevent user interactions during reloading
             self.setEnabled(True)
@@ -343,9 +398,73 @@ class Window(pyqtw.QMainWindow):
         else:
             print(f'{cached_settings_fname} cached file does not exist')
 
+    def init_settings_file_watcher(self):
+        """ Watches the settings file version stamp to apply the settings saved by other processes (eg. batch planning scripts) """
+        if self.settings_file_watcher is not None:
+            self.settings_file_watcher.deleteLater()
+        self.settings_file_watcher = pyqtc.QFileSystemWatcher(self)
+        # Stamps are replaced (not modified) on save -> the directory is watched too
+        self.settings_file_watcher.addPath(str(self.cache.cache_dir))
+        if self.cache.settings_version_fpath.exists():
+            self.settings_file_watcher.addPath(str(self.cache.settings_version_fpath))
+        self.settings_file_watcher.directoryChanged.connect(self._on_settings_file_event)
+        self.settings_file_watcher.fileChanged.connect(self._on_settings_file_event)
+
+    def _on_settings_file_event(self, path):
+        version_fpath = str(self.cache.settings_version_fpath)
+        if version_fpath not in self.settings_file_watcher.files() and self.cache.settings_version_fpath.exists():
+            self.settings_file_watcher.addPath(version_fpath)
+        if self.cache.has_external_changes():
+            self.apply_changed_settings_keys(self.cache.sync())
+
+    def apply_changed_settings_keys(self, changed_keys):
+        """ Refreshes only the modules, armatures and meshes whose cached settings are listed in changed_keys """
+        changed_params = {} # {first key segment: [remaining key segments]}
+        for changed_key in changed_keys:
+            key_segments = changed_key.split('.')
+            changed_params.setdefault(key_segments[0], []).append(key_segments[1:])
+        if len(changed_params) == 0:
+            return
+
+        # Armatures
+        armatures_by_name = {arm_obj.armature_name: arm_obj for arm_obj in self.stereotaxic_frame.armatures_objects.values()}
+        changed_armatures = {}
+        for key_segments in changed_params.pop('armature', []):
+            if len(key_segments) > 0 and key_segments[0] in armatures_by_name:
+                changed_armatures.setdefault(key_segments[0], []).append('.'.join(key_segments[1:]))
+        armature_params_widget_index = self.stereotaxic_frame.armature_parameters_stacked_widget.currentIndex()
+        for armature_name, param_names in changed_armatures.items():
+            armatures_by_name[armature_name].on_cached_params_changed(param_names)
+            if 'uneval_armature_config_dict' in param_names or 'armature_config_csts' in param_names or any(param_name.startswith('knob_values.') for param_name in param_names):
+                self.stereotaxic_frame._update_armature_parameters_widgets_on_configuration_change(armatures_by_name[armature_name])
+        self.stereotaxic_frame.armature_parameters_stacked_widget.setCurrentIndex(armature_params_widget_index)
+
+        # Meshes (STL handler module + armatures meshes)
+        mesh_handlers = [mm for mm in self._modules if isinstance(mm, StlHandlerGUI)]
+        mesh_handlers += [arm_obj.mesh_handler for arm_obj in armatures_by_name.values() if hasattr(arm_obj, 'mesh_handler')]
+        changed_meshes = {}
+        for key_segments in changed_params.pop('mesh_handler', []):
+            if len(key_segments) > 1:
+                changed_meshes.setdefault(key_segments[0], []).append('.'.join(key_segments[1:]))
+        for mesh_handler in mesh_handlers:
+            if mesh_handler.stl_item_name in changed_meshes:
+                mesh_handler.on_cached_params_changed(changed_meshes[mesh_handler.stl_item_name])
+
+        # Modules
+        for module in [self.tooltip, self.anat_calib, self.stereotaxic_frame, *self._modules]:
+            module_id = getattr(module, 'module_id', None)
+            if module_id in changed_params and module is not self.stereotaxic_frame:
+                module.on_cached_params_changed(['.'.join(key_segments) for key_segments in changed_params[module_id]])
+
+        if len(changed_armatures) > 0 or self.stereotaxic_frame.module_id in changed_params:
+            if self.stereotaxic_frame.module_id in changed_params or any('visible' in param_names for param_names in changed_armatures.values()):
+                self.stereotaxic_frame._update_armatures_qtree() # Armatures tree or visibility checkboxes edited
+            self.stereotaxic_frame.update_rendered_object()
+            self.tooltip.update_rendered_object()
+
     @property
     def cached_settings_files(self):
-        cached_files_dict = {ff.name: str(ff) for ff in self.cache.cache_dir.glob('*.json')}
+        cached_files_dict = {ff.name: str(ff) for ff in self.cache.cache_dir.glob(f'*{self.cache.settings_file_suffix}')}
         cached_files_dict = {kk: cached_files_dict[kk] for kk in sorted(cached_files_dict.keys())}
         return cached_files_dict
 
@@ -413,6 +532,13 @@ class Window(pyqtw.QMainWindow):
             error_msg_box.setInformativeText(error_description)
         error_msg_box.exec()
 
+    def show_transform_str_errors(self, transform_str):
+        """ Shows the first malformed token of an edited transform str in the status bar, malformed tokens are skipped when rendering """
+        try:
+            af_tr_from_str.compile_transform_str(transform_str, raise_errors=True)
+        except TransformStrSyntaxError as e:
+            self.statusBar().showMessage(str(e), self._STATUS_BAR_MSG_TIMEOUT)
+
     @property
     def _is_dark_mode(self):
         palette = pyqtw.QApplication.palette()
@@ -443,6 +569,7 @@ class Window(pyqtw.QMainWindow):
         # Restore stdout and stderr when closing the application
         sys.stdout = sys.__stdout__
         sys.stderr = sys.__stderr__
+        self.cache.close() # Write pending settings changes
         super().closeEvent(event)
 
 
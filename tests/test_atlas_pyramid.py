@@ -0,0 +1,20 @@
+import numpy as np
+from coperniFUS.modules._atlas_pyramid import AtlasPyramid, block_mean_reduce, select_pyramid_level
+
+def test_atlas_pyramid(tmp_path):
+    """Test that pyramid levels are block reductions of the previous level, persisted and memory-mapped."""
+    volume = np.random.default_rng(0).integers(0, 256, size=(9, 6, 5)).astype(np.uint8)
+    mean_level = block_mean_reduce(volume, slab_size=2)
+    assert mean_level.shape == (5, 3, 3)
+    assert mean_level[0, 0, 0] == np.floor(volume[:2, :2, :2].mean() + .5)
+    assert mean_level[4, 2, 2] == np.floor(volume[8, 4:6, 4].mean() + .5) # Edge padded block
+    pyramid = AtlasPyramid(tmp_path / 'pyramid', 'reference', lambda: volume, block_mean_reduce, n_levels=3)
+    assert np.array_equal(pyramid.level(2), block_mean_reduce(mean_level))
+    assert isinstance(pyramid.level(1), np.memmap) and pyramid.level_fpath(0).exists()
+
+def test_select_pyramid_level():
+    """Test that the rendered level follows the screen pixel size and the rendered voxels budget."""
+    assert select_pyramid_level(10e-6, 1e-6, n_levels=6) == 0
+    assert select_pyramid_level(10e-6, 30e-6, n_levels=6) == 2
+    assert select_pyramid_level(10e-6, 1, n_levels=6) == 5
+    assert select_pyramid_level(10e-6, 1e-6, n_levels=6, region_shape=(512, 512, 512), max_voxels=2**24) == 1
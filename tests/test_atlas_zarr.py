@@ -0,0 +1,14 @@
+import numpy as np
+import tifffile
+from coperniFUS.modules._atlas_pyramid import save_npy_atomic
+from coperniFUS.modules._atlas_zarr import lazy_tiff_volume, lazy_zarr_volume
+
+def test_lazy_zarr_volume(tmp_path):
+    """Test that tiff volumes converted to chunked zarr stores are read lazily and saved by slabs."""
+    volume = np.random.default_rng(0).integers(0, 2**16, size=(40, 20, 30), dtype=np.uint16)
+    tifffile.imwrite(tmp_path / 'reference.tiff', volume)
+    lazy_volume = lazy_zarr_volume(tmp_path / 'reference.zarr', lambda: lazy_tiff_volume(tmp_path / 'reference.tiff'), chunks=(16, 16, 16))
+    assert np.array_equal(lazy_volume[::3, ::3, ::3].compute(), volume[::3, ::3, ::3])
+    reopened_volume = lazy_zarr_volume(tmp_path / 'reference.zarr', None, chunks=(16, 16, 16)) # No conversion once stored
+    save_npy_atomic(tmp_path / 'reference.npy', reopened_volume, slab_size=7)
+    assert np.array_equal(np.load(tmp_path / 'reference.npy'), volume)
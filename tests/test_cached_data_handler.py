@@ -0,0 +1,199 @@
+import gc, json, threading, weakref
+import numpy as np
+import pytest
+from coperniFUS import CachedDataHandler
+
+@pytest.fixture
+def cache(tmp_path):
+    """Fixture to create a settings handler in a temporary cache directory."""
+    cache = CachedDataHandler(cache_dir_name=str(tmp_path), flush_delay=60)
+    yield cache
+    cache.close()
+
+def test_write_back_store(cache):
+    """Test that writes are served from memory and only reach the disk on flush."""
+    assert cache.set_attr(['module', 'param'], (1, 2)) == [1, 2] # Stored value, as read back
+    assert cache.get_attr('module.param') == [1, 2]
+    assert cache.peek_attr('module.missing', 3) == 3 and 'module.missing' not in cache.export_attr_subtree('module')
+    assert cache.stats['flushes'] == 0
+
+    cache.flush()
+    with open(cache.cached_settings_fpath) as f:
+        assert json.load(f)['module.param'] == [1, 2]
+    assert cache.stats['flushes'] == 1
+
+def test_sqlite_backend_migration(tmp_path):
+    """Test that .json settings are migrated to the sqlite backend and queried by prefix."""
+    json_cache = CachedDataHandler(cache_dir_name=str(tmp_path))
+    json_cache.set_attr(['mesh_handler', 'mesh_0', 'file_path'], 'a.stl')
+    json_cache.set_attr(['mesh_handler', 'mesh_1', 'file_path'], 'b.stl')
+    json_cache.close()
+
+    sqlite_cache = CachedDataHandler(cache_dir_name=str(tmp_path), backend='sqlite')
+    assert sqlite_cache.cached_settings_fpath.suffix == '.sqlite'
+    assert sqlite_cache.get_attr('mesh_handler.mesh_1.file_path') == 'b.stl'
+    assert list(sqlite_cache.get_attr_unique_childs('mesh_handler')) == ['mesh_0', 'mesh_1']
+    sqlite_cache.close()
+
+def test_journal_backend_crash_recovery(tmp_path):
+    """Test that journaled writes survive a record truncated by a crash."""
+    cache = CachedDataHandler(cache_dir_name=str(tmp_path), backend='journal')
+    cache.set_attr(['armature', 'arm_0', 'knob'], 1.5)
+    cache.close()
+    with open(f'{cache.cached_settings_fpath}.journal', 'a') as f:
+        f.write('{"key": "armature.arm_0.knob", "val') # Partial record
+
+    cache = CachedDataHandler(cache_dir_name=str(tmp_path), backend='journal')
+    assert cache.get_attr('armature.arm_0.knob') == 1.5
+    cache.set_attr(['armature', 'arm_0', 'knob'], 2.)
+    cache.close()
+
+    cache = CachedDataHandler(cache_dir_name=str(tmp_path), backend='journal')
+    assert cache.get_attr('armature.arm_0.knob') == 2.
+    cache.close()
+
+def test_journal_compaction_by_another_handler(tmp_path):
+    """Test that writes journaled after another handler compacted the shared journal are kept."""
+    cache_a = CachedDataHandler(cache_dir_name=str(tmp_path), flush_delay=60, backend='journal')
+    cache_b = CachedDataHandler(cache_dir_name=str(tmp_path), flush_delay=60, backend='journal')
+    cache_a.set_attr('k1', 1)
+    cache_a.flush()
+    cache_b.sync()
+    cache_a._store.backend.compact()
+    cache_b.set_attr('k2', 2)
+    cache_b.flush()
+    cache_b.close()
+    cache_a.close()
+
+    cache = CachedDataHandler(cache_dir_name=str(tmp_path), backend='journal')
+    assert (cache.get_attr('k1'), cache.get_attr('k2')) == (1, 2)
+    cache.close()
+
+def test_subtree_queries(cache, tmp_path):
+    """Test child enumeration, subtree read, export and deletion on dotted attribute ids."""
+    cache.set_attr(['armature', 'arm_0', 'visible'], True)
+    cache.set_attr(['armature', 'arm_0', 'armature_config_csts'], {'L1': 0.02})
+    cache.set_attr(['armature', 'arm_1', 'visible'], False)
+
+    assert list(cache.get_attr_unique_childs('armature')) == ['arm_0', 'arm_1']
+    assert cache.get_attr_subtree(['armature', 'arm_0']) == {'visible': True, 'armature_config_csts': {'L1': 0.02}}
+
+    exported = cache.export_attr_subtree('armature.arm_1', fpath=tmp_path / 'arm_1.json')
+    with open(tmp_path / 'arm_1.json') as f:
+        assert json.load(f) == exported == {'armature.arm_1.visible': False}
+
+    assert cache.delete_attr_subtree(['armature', 'arm_0']) == 2
+    assert list(cache.get_attr_unique_childs('armature')) == ['arm_1']
+
+def test_array_side_store(tmp_path):
+    """Test that numpy arrays are stored losslessly outside the settings file and memory-mapped when large."""
+    cache = CachedDataHandler(cache_dir_name=str(tmp_path), array_mmap_threshold=1024)
+    cal_tmat = cache.get_attr(['anat_calib', 'cal_tmat'], default_value=np.eye(4))
+    assert np.array_equal(cal_tmat, np.eye(4)) and not cal_tmat.flags.writeable
+    mask = np.random.default_rng(0).random((64, 64)) > .5
+    cache.set_attr(['atlas', 'mask'], mask)
+    cache.close()
+
+    cache = CachedDataHandler(cache_dir_name=str(tmp_path), array_mmap_threshold=1024)
+    assert isinstance(cache.get_attr('atlas.mask'), np.memmap)
+    assert np.array_equal(cache.get_attr('atlas.mask'), mask)
+    assert np.array_equal(cache.get_attr('anat_calib.cal_tmat'), np.eye(4))
+    cache.close()
+
+def test_concurrent_handlers_merge_and_sync(tmp_path):
+    """Test that two handlers sharing a settings file keep each other's saves and report changed keys."""
+    gui_cache = CachedDataHandler(cache_dir_name=str(tmp_path), flush_delay=60)
+    script_cache = CachedDataHandler(cache_dir_name=str(tmp_path), flush_delay=60)
+    gui_cache.set_attr(['tooltip', 'visible'], True)
+    gui_cache.flush()
+
+    assert not gui_cache.has_external_changes()
+    script_cache.set_attr(['armature', 'arm_0', 'visible'], False)
+    script_cache.flush() # Merged on top of the gui save
+    assert gui_cache.has_external_changes()
+    assert gui_cache.sync() == ['armature.arm_0.visible']
+    assert gui_cache.get_attr('armature.arm_0.visible') is False
+    script_cache.close()
+    gui_cache.close()
+
+    with open(gui_cache.cached_settings_fpath) as f:
+        assert json.load(f) == {'tooltip.visible': True, 'armature.arm_0.visible': False}
+
+def test_diff_attributes(tmp_path):
+    """Test that only the attributes differing between two settings files are reported."""
+    (tmp_path / 'a.json').write_text('{}')
+    cache_a = CachedDataHandler(cache_dir_name=str(tmp_path), cached_settings_fname='a.json')
+    cache_a.set_attr(['tooltip', 'visible'], True)
+    cache_a.set_attr(['armature', 'arm_0', 'visible'], True)
+    cache_a.flush()
+    (tmp_path / 'b.json').write_text(json.dumps({'tooltip.visible': True, 'armature.arm_0.visible': False, 'atlas.alpha': .2}))
+
+    cache_b = CachedDataHandler(cache_dir_name=str(tmp_path), cached_settings_fname='b.json')
+    assert cache_a.diff_attributes(cache_b) == ['armature.arm_0.visible', 'atlas.alpha']
+    cache_a.close()
+    cache_b.close()
+
+def test_settings_access_profiler(tmp_path):
+    """Test that profiled reads / writes are counted per key and call site and dumped to json."""
+    cache = CachedDataHandler(cache_dir_name=str(tmp_path))
+    cache.get_attr(['tooltip', 'visible']) # Not profiled
+    cache.profiler.start()
+    cache.set_attr(['tooltip', 'visible'], True, call_site='ToolTip')
+    for _ in range(3):
+        cache.get_attr(['tooltip', 'visible'], call_site='ToolTip')
+    cache.get_attr(['atlas', 'alpha'], default_value=.2, call_site='BrainAtlas')
+    cache.profiler.stop()
+    cache.get_attr(['tooltip', 'visible'])
+
+    summary = cache.profiler.summary()
+    keys_summary = {key_summary['key']: key_summary for key_summary in summary['keys']}
+    assert keys_summary['tooltip.visible']['count'] == 4
+    assert keys_summary['tooltip.visible']['get count'] == 3
+    assert keys_summary['tooltip.visible']['call_sites'] == {'ToolTip': 4}
+    assert keys_summary['atlas.alpha']['call_sites'] == {'BrainAtlas': 1}
+    assert 'tooltip.visible' in cache.profiler.report()
+
+    profile_fpath = cache.profiler.dump_json(tmp_path / 'profiles' / 'settings_access.json')
+    with open(profile_fpath) as f:
+        assert len(json.load(f)['keys']) == 2
+    cache.close()
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite', 'journal'])
+def test_flush_io_does_not_block_reads(tmp_path, monkeypatch, backend):
+    """Test that settings stay readable and writable while a flush writes to disk, and that closed handlers are released."""
+    cache = CachedDataHandler(cache_dir_name=str(tmp_path), flush_delay=60, backend=backend)
+    shelf_cls = type(cache._store.backend)
+    write_started, write_released = threading.Event(), threading.Event()
+    write_prepared = shelf_cls.write_prepared
+    def blocking_write_prepared(shelf, prepared):
+        write_started.set()
+        write_released.wait(10)
+        write_prepared(shelf, prepared)
+    monkeypatch.setattr(shelf_cls, 'write_prepared', blocking_write_prepared)
+
+    cache.set_attr(['tooltip', 'visible'], True)
+    flush_thread = threading.Thread(target=cache.flush)
+    flush_thread.start()
+    assert write_started.wait(10)
+    read_values = []
+    def read_and_write():
+        read_values.append(cache.get_attr('tooltip.visible'))
+        cache.set_attr(['tooltip', 'axes_length'], 2e-3)
+    gui_thread = threading.Thread(target=read_and_write)
+    gui_thread.start()
+    gui_thread.join(5)
+    assert read_values == [True] # Served during the disk write
+    write_released.set()
+    gui_thread.join()
+    flush_thread.join()
+    monkeypatch.undo()
+    cache.close()
+
+    cache = CachedDataHandler(cache_dir_name=str(tmp_path), backend=backend)
+    assert cache.get_attr('tooltip.visible') is True
+    assert cache.get_attr('tooltip.axes_length') == 2e-3
+    cache_ref = weakref.ref(cache)
+    cache.close()
+    del cache
+    gc.collect()
+    assert cache_ref() is None
@@ -0,0 +1,14 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from coperniFUS import colormap_lut, quantize_to_uint8, apply_colormap_lut
+
+def test_colormap_lut_matches_matplotlib():
+    """Test that uint8 lookup-table colormaps match matplotlib colormaps."""
+    volume = np.random.default_rng(0).uniform(-0.5, 3, size=(6, 5, 4))
+    indices = quantize_to_uint8(volume, vmin=0, vmax=2.5, chunk_size=7)
+    assert indices.dtype == np.uint8
+    rgba = apply_colormap_lut(indices, colormap_lut('viridis'))
+    assert rgba.dtype == np.uint8 and rgba.shape == (6, 5, 4, 4)
+    assert np.array_equal(rgba, plt.cm.viridis(plt.Normalize(vmin=0, vmax=2.5)(volume), bytes=True))
+    alpha_lut = colormap_lut('viridis', alpha=20 * np.arange(256) / 255)
+    assert alpha_lut[0, 3] == 0 and alpha_lut[-1, 3] == 20
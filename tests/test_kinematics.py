@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from coperniFUS import AffineTransforms, compile_args_expression
+from coperniFUS.modules._kinematics import KinematicTree, ReachabilityMap, damped_least_squares_steps
+
+af_tr = AffineTransforms()
+
+def test_kinematic_tree_dirty_propagation():
+    """Test that editing a joint only recomputes its subtree, lazily on read."""
+    kinematic_tree = KinematicTree()
+    offsets = {'a': .1, 'b': .2, 'c': .3, 'd': .4}
+    for node_id, parent_id in [('a', None), ('b', 'a'), ('c', 'b'), ('d', 'a')]:
+        kinematic_tree.add_node(node_id, parent_id, lambda node_id=node_id: af_tr.translat_mat('x', offsets[node_id]))
+    assert np.allclose(kinematic_tree.compound_tmat('c'), af_tr.translat_mat('x', .6))
+    assert np.allclose(kinematic_tree.compound_tmat('d'), af_tr.translat_mat('x', .5))
+    assert kinematic_tree.n_recomputed == 4
+
+    offsets['b'] = 1
+    kinematic_tree.invalidate('b')
+    assert kinematic_tree.is_dirty('c') and not kinematic_tree.is_dirty('d')
+    assert np.allclose(kinematic_tree.compound_tmat('c'), af_tr.translat_mat('x', 1.4))
+    assert kinematic_tree.n_recomputed == 6 # b and c only
+
+    kinematic_tree.set_parent('d', 'c')
+    assert np.allclose(kinematic_tree.compound_tmat('d'), af_tr.translat_mat('x', 1.8))
+    with pytest.raises(ValueError):
+        kinematic_tree.set_parent('a', 'd')
+    kinematic_tree.remove_node('b')
+    assert kinematic_tree.parent_id('c') is None
+    assert np.allclose(kinematic_tree.compound_tmat('d'), af_tr.translat_mat('x', .7))
+
+def test_kinematic_tree_compound_versions():
+    """Test that compound versions only change when the compound matrix value changes."""
+    kinematic_tree = KinematicTree()
+    offsets = {'a': .1, 'b': .2}
+    for node_id, parent_id in [('a', None), ('b', 'a')]:
+        kinematic_tree.add_node(node_id, parent_id, lambda node_id=node_id: af_tr.translat_mat('x', offsets[node_id]))
+    b_version = kinematic_tree.compound_version('b')
+    kinematic_tree.invalidate('a') # Same value
+    assert kinematic_tree.compound_version('b') == b_version
+    offsets['a'] = .3
+    kinematic_tree.invalidate('a')
+    assert kinematic_tree.compound_version('b') > b_version
+
+def test_compiled_args_expression_dependencies():
+    """Test that args expressions are compiled once with the csts keys they read."""
+    args_code, csts_keys = compile_args_expression("csts['L1']*2 + csts.get('L2', 0)")
+    assert csts_keys == {'L1', 'L2'}
+    assert compile_args_expression("csts['L1']*2 + csts.get('L2', 0)")[0] is args_code
+    assert eval(args_code, {'csts': {'L1': np.array([1., 2.])}, 'np': np}).tolist() == [2, 4] # Vectorized
+    assert compile_args_expression("-csts[key]")[1] is None # Dynamic access -> depends on every constant
+    assert compile_args_expression("np.pi / 2")[1] == frozenset()
+
+def test_damped_least_squares_steps():
+    """Test that batched damped least-squares steps solve well-conditioned linear systems."""
+    rng = np.random.default_rng(0)
+    jacobians = rng.normal(size=(4, 3, 3)) + 3 * np.eye(3)
+    target_steps = rng.normal(size=(4, 3))
+    errors = -np.einsum('mij,mj->mi', jacobians, target_steps)
+    steps = damped_least_squares_steps(jacobians, errors, damping=1e-9)
+    assert steps.shape == (4, 3)
+    assert np.allclose(steps, target_steps, atol=1e-6)
+    assert np.allclose(damped_least_squares_steps(np.zeros((2, 3, 2)), np.ones((2, 3))), 0)
+
+def test_reachability_map_lookup(tmp_path):
+    """Test that reachability lookups return the params of the configuration closest to the voxel center."""
+    reachability_map = ReachabilityMap(ReachabilityMap.box_grid_tmat([0, 0, 0], 0.5), (4, 4, 4), [('Arm', 'AP knob')])
+    positions = np.array([[0.1, 0, 0], [0.55, 0.5, 0.5], [0.45, 0.5, 0.5], [10, 0, 0]])
+    reachability_map.add_configurations(positions, [[1], [2], [3], [4]])
+    assert reachability_map.reachable.sum() == 2
+    reachability_map.save(tmp_path / 'reachability.npz')
+    loaded_map = ReachabilityMap.load(tmp_path / 'reachability.npz')
+    assert loaded_map.params == [('Arm', 'AP knob')]
+    reachable, params_values = loaded_map.lookup([[0.5, 0.5, 0.5], [0, 0, 0], [1.5, 1.5, 1.5], [-1, 0, 0]])
+    assert list(reachable) == [True, True, False, False]
+    assert params_values[0, 0] in (2, 3) and params_values[1, 0] == 1
+    assert np.isnan(params_values[2:]).all()
@@ -0,0 +1,16 @@
+import numpy as np
+from coperniFUS.modules._structure_index import StructureVoxelIndex
+
+def test_structure_voxel_index(tmp_path):
+    """Test that structure masks rasterized from the run-length index match the dense annotation masks."""
+    rng = np.random.default_rng(0)
+    annotation = rng.choice(np.array([0, 3, 5, 8], dtype=np.uint32), size=(13, 9, 11), p=[.4, .3, .2, .1])
+    hemispheres = np.broadcast_to(np.where(np.arange(11) < 5, 1, 2).astype(np.uint8), annotation.shape)
+    StructureVoxelIndex.from_annotation(annotation, hemispheres, slab_size=4).save(tmp_path / 'index.npz')
+    structure_index = StructureVoxelIndex.load(tmp_path / 'index.npz')
+    structure_mask = np.isin(annotation, [3, 8]) & (hemispheres == 2)
+    assert np.array_equal(structure_index.subsampled_mask([3, 8, 42], stride=3, hemisphere=2), structure_mask[::3, ::3, ::3])
+    block_mask = np.pad(structure_mask, [(0, 1), (0, 1), (0, 1)]).reshape(7, 2, 5, 2, 6, 2).any(axis=(1, 3, 5))
+    assert np.array_equal(structure_index.block_mask([3, 8], 1, (1, 0, 2), (7, 4, 6), hemisphere=2), block_mask[1:7, 0:4, 2:6])
+    assert np.array_equal(structure_index.structure_bbox([5]), [np.argwhere(annotation == 5).min(axis=0), np.argwhere(annotation == 5).max(axis=0)])
+    assert structure_index.structure_bbox([42]) is None
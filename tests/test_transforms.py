@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from coperniFUS import AffineTransforms, AffineTransformsFromStr, TransformStrSyntaxError, half_space_mask
+
+af_tr = AffineTransforms()
+
+@pytest.mark.parametrize('rot_axis', ['x', 'y', 'z'])
+def test_batched_rotations_match_scalar(rot_axis):
+    """Test that stacked rotation matrices match the one-at-a-time ones."""
+    thetas = np.linspace(-180, 180, 7)
+    rot_mats = af_tr.rot_mats(rot_axis, thetas)
+    assert rot_mats.shape == (7, 4, 4)
+    for theta, rot_mat in zip(thetas, rot_mats):
+        assert np.allclose(rot_mat, af_tr.rot_mat(rot_axis, theta))
+
+def test_batched_translations_and_scales_match_scalar():
+    """Test that stacked translation and scaling matrices match the one-at-a-time ones."""
+    offsets = np.array([-1e-3, 0, 2e-2])
+    for offset, tmat in zip(offsets, af_tr.translat_mats('y', offsets)):
+        assert np.allclose(tmat, af_tr.translat_mat('y', offset))
+    ratios = np.array([[1, 2, 3], [.5, .5, .5]])
+    for ratio, scale_mat in zip(ratios, af_tr.scale_mats(ratios)):
+        assert np.allclose(scale_mat, af_tr.scale_mat(ratio))
+
+def test_compose_and_apply():
+    """Test that batched composition broadcasts single matrices and that points are transformed as row vectors."""
+    offsets = np.array([0, 1, 2])
+    tmats = af_tr.compose(af_tr.rot_mat('z', 90), af_tr.translat_mats('x', offsets))
+    assert tmats.shape == (3, 4, 4)
+    points = af_tr.apply_tmats(tmats, [[1, 0, 0]])
+    assert points.shape == (3, 1, 3)
+    assert np.allclose(points[:, 0], [[0, 1, 0], [1, 1, 0], [2, 1, 0]])
+
+def test_compiled_transform_str():
+    """Test that a compiled transform str matches the chained elementary matrices and is cached."""
+    af_tr_from_str = AffineTransformsFromStr()
+    tr_str = 'S1.15 Rx-89.3deg  Rz180deg Ry-5deg Ty.55mm Tx-5.5mm Sz2'
+    transform_ops, transform_mat = af_tr_from_str.compile_transform_str(tr_str)
+    assert transform_ops[0] == ('scale', None, 1.15)
+    assert transform_ops[4] == ('translation', 'y', pytest.approx(.55e-3))
+    expected_mat = af_tr.scale_mat(1.15) @ af_tr.rot_mat('x', -89.3) @ af_tr.rot_mat('z', 180) @ af_tr.rot_mat('y', -5) \
+        @ af_tr.translat_mat('y', .55e-3) @ af_tr.translat_mat('x', -5.5e-3) @ af_tr.scale_mat(np.array([1, 1, 2], dtype=float))
+    assert np.allclose(transform_mat, expected_mat)
+    transform_mat[:] = 0 # Callers get their own copy
+    assert np.allclose(af_tr_from_str.transform_mat_from_str(tr_str), expected_mat)
+    assert af_tr_from_str._compile_transform_str_cached.cache_info().hits == 1
+
+def test_malformed_transform_str():
+    """Test that malformed tokens are skipped, or raised with their location."""
+    af_tr_from_str = AffineTransformsFromStr()
+    tr_str = 'Tx1mm Rw5deg Ty2mm'
+    assert np.allclose(af_tr_from_str.transform_mat_from_str(tr_str), af_tr.translat_mat('x', 1e-3) @ af_tr.translat_mat('y', 2e-3))
+    with pytest.raises(TransformStrSyntaxError) as excinfo:
+        af_tr_from_str.transform_mat_from_str(tr_str, raise_errors=True)
+    assert (excinfo.value.token, excinfo.value.token_index) == ('Rw5deg', 1)
+    with pytest.raises(ValueError):
+        af_tr_from_str.transform_mat_from_str('Tx1 Q3', raise_errors=True)
+
+@pytest.mark.parametrize('n_threads', [1, 3])
+def test_half_space_mask(n_threads):
+    """Test that the separable half-space mask matches the plane test on explicit voxel coordinates."""
+    grid_tmat = af_tr.scale_mat([1e-4, 2e-4, 1e-4]) @ af_tr.rot_mat('z', 30) @ af_tr.translat_mat('x', 1e-3)
+    grid_shape = (20, 11, 7)
+    plane_origin, plane_normal = np.array([1e-3, 5e-4, 3e-4]), np.array([1, -2, 0.5])
+    voxel_coords = np.moveaxis(np.indices(grid_shape), 0, -1)
+    ref_mask = (af_tr.apply_tmats(grid_tmat, voxel_coords.reshape(-1, 3)) - plane_origin) @ plane_normal > 0
+    mask = half_space_mask(grid_tmat, grid_shape, plane_origin, plane_normal, n_threads=n_threads, chunk_size=4)
+    assert mask.dtype == bool
+    assert np.array_equal(mask, ref_mask.reshape(grid_shape))
@@ -1,12 +1,132 @@
 import pytest
+import tarfile
+import numpy as np
 from coperniFUS.viewer import Window, pyqtw
+from coperniFUS.modules._atlas_loader import AtlasLoader, BrainGlobeAtlas
 
 @pytest.fixture
 def viewer_window(qtbot):
     """Fixture to create CoperniFUS viewer window."""
     window = Window(app=None, running_test=True)
+    brain_atlas = window.get_module_object_from_name('BrainAtlas')
+    qtbot.waitUntil(lambda: not brain_atlas.atlas_loading, timeout=120000) # Atlas loaded by a worker thread
     return window
 
+@pytest.fixture
+def jointed_armature(viewer_window):
+    """Fixture returning the first armature with editable joints, the knob values edited by the test are restored at teardown."""
+    armatures = viewer_window.stereotaxic_frame.armatures_objects.values()
+    stored_knob_values = {armature.armature_name: viewer_window.cache.get_attr_subtree(['armature', armature.armature_name, 'knob_values']) for armature in armatures}
+    yield next(armature for armature in armatures if len(armature.editable_joint_params) > 0)
+    for armature_name, knob_values in stored_knob_values.items(): # Restore the user settings
+        viewer_window.cache.delete_attr_subtree(['armature', armature_name, 'knob_values'])
+        for knob_id, value in knob_values.items():
+            viewer_window.cache.set_attr(['armature', armature_name, 'knob_values', knob_id], value)
+    viewer_window.cache.flush()
+
 def test_brain_atlas(viewer_window):
     """Test tha the example atlas has been loaded."""
     assert viewer_window.get_module_object_from_name('BrainAtlas').bg_atlas.atlas_name == 'example_mouse_100um'
+
+def test_atlas_loader_local_mirror(tmp_path):
+    """Test that the loader worker downloads, extracts and prepares atlases from a local mirror, and cancels cleanly."""
+    local_atlas_dir = BrainGlobeAtlas('example_mouse_100um', check_latest=False).root_dir
+    mirror_dir = tmp_path / 'mirror'
+    mirror_dir.mkdir()
+    with tarfile.open(mirror_dir / f'{local_atlas_dir.name}.tar.gz', 'w:gz') as archive:
+        archive.add(local_atlas_dir, arcname=local_atlas_dir.name)
+    (mirror_dir / 'last_versions.conf').write_text(f"[atlases]\nexample_mouse_100um = {local_atlas_dir.name.split('_v')[-1]}\n")
+
+    atlas_loader = AtlasLoader(brainglobe_dir=tmp_path / 'brainglobe', mirror=mirror_dir)
+    atlas_loader.start('example_mouse_100um', download=True, prepare_fn=lambda bg_atlas, report_progress, cancel_event: bg_atlas.reference.shape)
+    atlas_loader.thread.join(timeout=120)
+    messages = atlas_loader.poll()
+    assert any(message_type == 'progress' for message_type, _ in messages)
+    message_type, (bg_atlas, prepared) = messages[-1]
+    assert message_type == 'loaded' and prepared == tuple(bg_atlas.shape)
+    assert bg_atlas.root_dir.parent == tmp_path / 'brainglobe'
+
+    canceled_loader = AtlasLoader(brainglobe_dir=tmp_path / 'canceled', mirror=mirror_dir)
+    canceled_loader.cancel()
+    canceled_loader.start('example_mouse_100um', download=True)
+    canceled_loader.thread.join(timeout=120)
+    assert canceled_loader.poll()[-1] == ('canceled', 'example_mouse_100um')
+    assert list((tmp_path / 'canceled').iterdir()) == [] # No partial download
+
+def test_multi_structure_highlight(viewer_window):
+    """Test that each highlighted structure is painted with its own color and persisted."""
+    brain_atlas = viewer_window.get_module_object_from_name('BrainAtlas')
+    stored_highlighted_structures = brain_atlas.get_user_param('highlighted_structures')
+    structure_names = [name for name, acronym in brain_atlas.bg_atlas_structures.items() if acronym is not None][:2]
+    try:
+        brain_atlas._clear_highlights_btn_pressed()
+        for structure_name in structure_names:
+            brain_atlas.structure_selector.setCurrentText(structure_name)
+            brain_atlas.hemisphere_selector.setCurrentText('Both')
+            brain_atlas._highlight_structure_btn_pressed()
+        highlighted_structures = brain_atlas.get_user_param('highlighted_structures')
+        assert [name for name, _, _ in highlighted_structures] == structure_names
+        _, highlight_labels = brain_atlas.highlighted_voxels
+        assert len(highlight_labels) > 0
+        rgba_colors = brain_atlas.atlas_rgba_volume[..., :3].reshape(-1, 3)
+        for label in np.unique(highlight_labels):
+            assert np.any(np.all(rgba_colors == highlighted_structures[label - 1][2], axis=-1))
+        brain_atlas._clear_highlights_btn_pressed()
+        assert len(brain_atlas.highlighted_voxels[0]) == 0
+    finally: # Restore the user settings
+        brain_atlas.set_user_param('highlighted_structures', stored_highlighted_structures)
+        viewer_window.cache.flush()
+
+def test_batched_forward_kinematics(jointed_armature):
+    """Test that batched armature forward kinematics match the one configuration at a time computation."""
+    armature = jointed_armature
+    joint_id = armature.get_joints()[-1]
+    transform_id = list(armature.get_joint_transforms(joint_id))[0]
+    init_value = armature.armature_config_dict['_armature_joints'][joint_id][transform_id]['args'][1]
+    values = init_value + np.linspace(-1e-3, 1e-3, 5)
+    end_tmats = armature.batched_end_transform_mats({(joint_id, transform_id): values})
+    assert end_tmats.shape == (5, 4, 4)
+    for value, end_tmat in zip(values, end_tmats):
+        armature._update_armature_dict_value(['_armature_joints', joint_id, transform_id], float(value))
+        assert np.allclose(end_tmat, armature.end_transform_mat)
+    armature._update_armature_dict_value(['_armature_joints', joint_id, transform_id], init_value)
+
+def test_sweep_end_transforms(jointed_armature):
+    """Test that a joint param sweep matches the end transforms of each combination."""
+    armature = jointed_armature
+    joint_id = armature.get_joints()[-1]
+    transform_ids = list(armature.get_joint_transforms(joint_id))
+    transform_key = (joint_id, transform_ids[0])
+    init_value = armature.armature_config_dict['_armature_joints'][joint_id][transform_ids[0]]['args'][1]
+    values = init_value + np.linspace(-1e-3, 1e-3, 3)
+    assert armature.sweep_end_transforms({transform_key: values.reshape(1, 3)}, grid=False).shape == (1, 3, 4, 4)
+    end_tmats = armature.sweep_end_transforms({transform_key: values})
+    tooltip_positions = armature.sweep_tooltip_positions({transform_key: values})
+    assert np.allclose(end_tmats[:, 3, :3], tooltip_positions)
+    for value, end_tmat in zip(values, end_tmats):
+        armature._update_armature_dict_value(['_armature_joints', joint_id, transform_ids[0]], float(value))
+        assert np.allclose(end_tmat, armature.end_transform_mat)
+    armature._update_armature_dict_value(['_armature_joints', joint_id, transform_ids[0]], init_value)
+
+def test_inverse_kinematics(viewer_window, jointed_armature):
+    """Test that solved joint params bring the armature end onto the target positions."""
+    stereotaxic_frame = viewer_window.stereotaxic_frame
+    armature = jointed_armature
+    init_values = {(armature.armature_display_name, param): armature.armature_config_dict['_armature_joints'][joint_id][transform_id]['args'][1] for param, (joint_id, transform_id) in armature.editable_joint_params.items()}
+    target_positions = armature.end_transform_mat[3, :3] + np.array([[1e-3, 0, 0], [0, -1e-3, 2e-3]])
+    params_values, position_errors = stereotaxic_frame.solve_inverse_kinematics(armature.armature_display_name, target_positions, raise_errors=True)
+    assert np.all(position_errors < 1e-5)
+    stereotaxic_frame.set_joint_params_values({param: values[1] for param, values in params_values.items()})
+    assert np.allclose(armature.end_transform_mat[3, :3], target_positions[1], atol=1e-5)
+    stereotaxic_frame.set_joint_params_values(init_values)
+
+def test_knob_edit_fast_path(viewer_window, jointed_armature):
+    """Test that a knob edit is stored under its own settings key and applied over the stored armature configuration."""
+    armature = jointed_armature
+    nested_keys = ['_armature_joints', armature.get_joints()[-1], list(armature.get_joint_transforms(armature.get_joints()[-1]))[0]]
+    stored_uneval_dict = viewer_window.cache.get_attr(['armature', armature.armature_name, 'uneval_armature_config_dict'])
+    armature._update_armature_dict_value(nested_keys, 1e-3)
+    assert viewer_window.cache.get_attr(['armature', armature.armature_name, 'knob_values', '&&'.join(nested_keys)]) == 1e-3
+    assert viewer_window.cache.get_attr(['armature', armature.armature_name, 'uneval_armature_config_dict']) == stored_uneval_dict
+    assert armature.uneval_armature_config_dict['_armature_joints'][nested_keys[1]][nested_keys[2]]['args'][1] == 1e-3
+    assert armature.armature_config_dict['_armature_joints'][nested_keys[1]][nested_keys[2]]['args'][1] == 1e-3